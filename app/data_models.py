@@ -1,5 +1,5 @@
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, Field
 from datetime import datetime
 
 
@@ -97,3 +97,17 @@ class Listing(BaseModel):
     reviews: List[Review]
     text_embeddings: List[float]
     image_embeddings: List[float]
+
+
+class SearchResultItem(BaseModel):
+    id: int = Field(alias='_id')
+    name: str
+    accommodates: Optional[int] = None
+    address: Address
+    summary: Optional[str] = None
+    description: Optional[str] = None
+    neighborhood_overview: Optional[str] = None
+    notes: Optional[str] = None
+    images: ImageDescrib
+    search_score: Optional[float] = None
+    reviews: Optional[List[Dict[str, Any]]] = None
@@ -1,28 +1,83 @@
 from rag import RagAgent
 import gradio as gr
-import time
-from utils.mongodb import get_collection
+import os
+from search.fusion import FusionExecutor
+from search.vector_store import LocalVectorBackend
+from utils.intent_classifier import CONFIDENCE, INTENT_EXAMPLES_PATH, IntentClassifier
+from utils.mongodb import get_collection, registry as mongo_registry
+from utils.semantic_cache import SemanticCache, watch_listing_changes
+from utils.session_history import get_session_store
+from utils.tracing import metrics, start_metrics_server
 import uuid
 from utils.logger import LOG
 
+# requests served at once, requests waiting beyond which new ones are rejected (the client is told
+# the queue is full), and threads running the blocking calls, two per request being prepared
+CONCURRENCY_LIMIT = int(os.getenv('CONCURRENCY_LIMIT', 16))
+QUEUE_MAX_SIZE = int(os.getenv('QUEUE_MAX_SIZE', 64))
+RAG_WORKERS = int(os.getenv('RAG_WORKERS', 2 * CONCURRENCY_LIMIT))
+
+# per-stage latency metrics, served in the Prometheus text format on METRICS_PORT (e.g. TRACING=1 METRICS_PORT=9100)
+if os.getenv('TRACING') == '1':
+    metrics.enable()
+    # MongoDB command latencies as a "mongodb" stage per command, the connection pool counters as gauges
+    mongo_registry.add_command_observer(
+        lambda command, seconds, failed: metrics.record_span("mongodb", seconds, {"command": command}, failed))
+    metrics.add_gauges(lambda: {f"mongodb_pool_{name}": value for name, value in mongo_registry.stats()["pool"].items()})
+    if os.getenv('METRICS_PORT'):
+        start_metrics_server(int(os.getenv('METRICS_PORT')))
+        LOG.info(f"metrics served on :{os.getenv('METRICS_PORT')}/metrics")
+
+# torch intra-op threads of the process, used by the CLIP image encoder, e.g. CLIP_NUM_THREADS=4
+if os.getenv('CLIP_NUM_THREADS'):
+    import torch
+    torch.set_num_threads(int(os.getenv('CLIP_NUM_THREADS')))
+
 collection = get_collection()
-rag_agent = RagAgent(collection)
+# serve vector search from local memory-mapped indexes when exported, see database/export_vectors.py
+vector_backend = None
+if os.getenv('LOCAL_VECTOR_DIR'):
+    vector_backend = LocalVectorBackend.load(os.getenv('LOCAL_VECTOR_DIR'))
+    LOG.info(f"local vector indexes: {list(vector_backend.indexes)}")
+# run the retrieval legs concurrently and fuse them client-side instead of in one aggregation
+fusion = FusionExecutor(collection, vector_backend) if os.getenv('CLIENT_SIDE_FUSION') == '1' else None
+# reuse retrievals and first-turn answers of near-identical queries, e.g. SEMANTIC_CACHE_THRESHOLD=0.95
+semantic_cache = None
+if os.getenv('SEMANTIC_CACHE_THRESHOLD'):
+    semantic_cache = SemanticCache(threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD')))
+    if os.getenv('SEMANTIC_CACHE_WATCH') == '1':
+        watch_listing_changes(semantic_cache, collection)
+# rank on ids and scores only, then fetch the final listings with their latest reviews in one query
+two_phase = os.getenv('TWO_PHASE_RETRIEVAL') == '1'
+# decide confident queries with a local classifier and only ask the LLM about the others,
+# LOCAL_INTENT_CLASSIFIER=0 to always ask the LLM
+intent_classifier = None
+if os.getenv('LOCAL_INTENT_CLASSIFIER', '1') == '1':
+    intent_classifier = IntentClassifier.from_examples(
+        os.getenv('INTENT_EXAMPLES_PATH', INTENT_EXAMPLES_PATH),
+        confidence=float(os.getenv('INTENT_CONFIDENCE', CONFIDENCE)))
+rag_agent = RagAgent(collection, vector_backend, fusion, semantic_cache, two_phase=two_phase,
+                     max_workers=RAG_WORKERS, intent_classifier=intent_classifier)
 
-session_id = None
 
-def slow_echo(user_message, history):
-    global session_id
-    if session_id is None:
-        session_id = str(uuid.uuid4())
-        LOG.info(f"history is empty, create a new session_id:::::::: ,{session_id}")
-    response = rag_agent.response_to_user(user_message, session_id)
-    for i in range(len(response)):
-        time.sleep(0.01)
-        yield "" + response[: i + 1]
+def new_session_id():
+    session_id = str(uuid.uuid4())
+    LOG.info(f"create a new session_id: {session_id}")
+    return session_id
+
+
+async def stream_reply(user_message, history, session_id):
+    # forward the LLM tokens as they arrive
+    response = ""
+    async for chunk in rag_agent.astream_response_to_user(user_message, session_id):
+        response += chunk
+        yield response
 
 
 with gr.Blocks() as demo:
     gr.Markdown("# Airbnb Chatbot")
+    # one conversation per browser session, its history is dropped when the session closes
+    session_state = gr.State(new_session_id, delete_callback=lambda session_id: get_session_store().delete(session_id))
     chatbot = gr.Chatbot(
         type="messages",
         height=600,
@@ -32,27 +87,31 @@ with gr.Blocks() as demo:
     )
 
     gr.ChatInterface(   
-        fn=slow_echo,
+        fn=stream_reply,
         chatbot=chatbot,
         type="messages",
         flagging_mode="manual",
         flagging_options=["Like", "Spam", "Inappropriate", "Other"],
         multimodal=True,
         textbox=gr.MultimodalTextbox(file_count="single", file_types=["image"], sources=["upload"]),
+        additional_inputs=[session_state],
     )
     with gr.Row():
         clear_session = gr.Button("New Chat")
         
-    def reset_session():
-        global session_id
-        session_id = None
-        return None
+    def reset_session(session_id):
+        get_session_store().delete(session_id)
+        return None, new_session_id()
         
     clear_session.click(
         fn=reset_session,
-        outputs=chatbot
+        inputs=session_state,
+        outputs=[chatbot, session_state]
     )
 
+# bound the concurrent and the waiting requests, see bench_concurrency.py
+demo.queue(default_concurrency_limit=CONCURRENCY_LIMIT, max_size=QUEUE_MAX_SIZE)
+
 
 if __name__ == "__main__":
     demo.launch(share=True, server_name="0.0.0.0")  # 启动界面并设置为公共可访问
@@ -1,108 +1,175 @@
-from typing import Any, Dict, List, Optional
-from pydantic import BaseModel, Field
-from data_models import Address, ImageDescrib
+import asyncio
+import contextvars
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from data_models import SearchResultItem  # re-exported, it used to be defined here
 from search.hybrid_search import HybridSearch
 from search.multimodal_search import MultiModalSearch
 from search.semantic_search import SemanticSearch
+from utils.context_builder import ContextBuilder
+from utils.embedding import get_text_embedding
+from utils.intent_classifier import IntentClassifier
 from utils.logger import LOG
-from utils.session_history import get_session_history
+from utils.semantic_cache import CacheEntry, SemanticCache
+from utils.session_history import get_session_history, prompt_history
+from utils.tracing import metrics, request_context, span
 from langchain.chat_models import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 
-class SearchResultItem(BaseModel):
-    id: int = Field(alias='_id')
-    name: str
-    accommodates: Optional[int] = None
-    address: Address
-    summary: Optional[str] = None
-    description: Optional[str] = None
-    neighborhood_overview: Optional[str] = None
-    notes: Optional[str] = None
-    images: ImageDescrib
-    search_score: Optional[float] = None
-    reviews: Optional[List[Dict[str, Any]]] = None
-
+# per-stage timeouts of response_to_user, in seconds
+CLASSIFY_TIMEOUT = 15
+RETRIEVAL_TIMEOUT = 30
+ANSWER_TIMEOUT = 60
+ANSWER_TIMEOUT_MESSAGE = "Sorry, the answer took too long. Please try again."
+MAX_WORKERS = int(os.getenv('RAG_WORKERS', 8))
 
 class RagAgent:
-    def __init__(self, collection):
+    def __init__(self, collection, vector_backend=None, fusion=None, semantic_cache: Optional[SemanticCache] = None,
+                 context_builder: Optional[ContextBuilder] = None, two_phase: bool = False,
+                 max_workers: int = MAX_WORKERS, intent_classifier: Optional[IntentClassifier] = None):
         self.collection = collection
-        self.hybrid_search = HybridSearch(collection)
-        self.semantic_search = SemanticSearch(collection)
-        self.multimodal_search = MultiModalSearch(collection)
+        self.hybrid_search = HybridSearch(collection, vector_backend, fusion, two_phase=two_phase)
+        self.semantic_search = SemanticSearch(collection, vector_backend, two_phase=two_phase)
+        self.multimodal_search = MultiModalSearch(collection, vector_backend, fusion, two_phase=two_phase)
         self.chat = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+        self.semantic_cache = semantic_cache
+        self.context_builder = context_builder or ContextBuilder()
+        self.intent_classifier = intent_classifier
+        # runs the blocking LLM, embedding, pymongo and CLIP calls of aresponse_to_user; a request
+        # holds up to two workers at once (classifier and retrieval), size it for the concurrent requests
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-agent")
 
-    def retrieve_knowledge(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def search_listings(self, query: Dict[str, Any]) -> List[SearchResultItem]:
         """
-        Retrieve relevant knowledge from MongoDB based on the query.
+        Search the listings relevant to the query.
         Args:
             query: Dictionary containing 'text' and optionally 'files'
         Returns:
-            List of search results with relevant information
+            List of search results
         """
         if len(query.get('files', [])) == 0:
             LOG.info(f"query: {query}")
-            get_knowledge = self.hybrid_search.do_search(query.get('text'))
+            with span("search", search="hybrid"):
+                get_knowledge = self.hybrid_search.do_search(query.get('text'))
         else:
             LOG.info(f"query: {query}")
-            get_knowledge = self.multimodal_search.do_search(query.get('text'), query.get('files')[0])
+            with span("search", search="multimodal"):
+                get_knowledge = self.multimodal_search.do_search(query.get('text'), query.get('files')[0])
 
         # Check if there are any results
         if not get_knowledge:
             return []
 
         # Convert search results into a list of SearchResultItem models
-        search_results_models = [
-            SearchResultItem(**result)
-            for result in get_knowledge
-        ]
+        # (also drains the remaining batches of a cursor)
+        with span("validate"):
+            return [
+                SearchResultItem(**result)
+                for result in get_knowledge
+            ]
 
+    def build_context(self, search_results_models: List[SearchResultItem]) -> List[Dict[str, Any]]:
+        """
+        Format search results as context for the LLM, within the token budget of the context builder.
+        Args:
+            search_results_models: Search results
+        Returns:
+            List of search results with relevant information
+        """
         # Prepare the context for LangChain
-        context = [{
-            'content': f"""
-            Name: {row.name}
-            Description: {row.description}
-            Summary: {row.summary}
-            Neighborhood: {row.neighborhood_overview}
-            Notes: {row.notes}
-            Search Score: {row.search_score}
-            Image URL: {row.images}
-            Reviews: {row.reviews}
-            """,
-            'score': row.search_score
-        } for row in search_results_models]
+        context, report = self.context_builder.build(search_results_models)
+        LOG.info(f"context tokens: {report['context_tokens']} (saved {report['tokens_saved']} of {report['full_tokens']})")
+        metrics.count("context_tokens", report['context_tokens'])
+        metrics.count("context_tokens_saved", report['tokens_saved'])
         LOG.info(f"context: {context}")
         return context
 
-    def response_to_user(self, query: Dict[str, Any], session_id: str = "default") -> str:
+    def retrieve_knowledge(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
-        Generate a response to the user query using LLM and session history.
+        Retrieve relevant knowledge from MongoDB based on the query.
         Args:
             query: Dictionary containing 'text' and optionally 'files'
-            session_id: Unique identifier for the conversation session
         Returns:
-            Generated response string
+            List of search results with relevant information
         """
-        # Get or create session history
-        history = get_session_history(session_id)
+        search_results_models = self.search_listings(query)
+        with span("build_context"):
+            return self.build_context(search_results_models)
+
+    def retrieve_with_cache(self, query: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[CacheEntry]]:
+        """
+        Retrieve knowledge, reusing the retrieval of a semantically similar earlier query.
+        Only text queries are cached.
+        Args:
+            query: Dictionary containing 'text' and optionally 'files'
+        Returns:
+            Tuple of (context, semantic cache entry of the query or None when not cached)
+        """
+        if self.semantic_cache is None or len(query.get('files', [])) > 0:
+            return self.retrieve_knowledge(query), None
+        query_embedding = get_text_embedding(query.get('text'))
+        if query_embedding is None:
+            return self.retrieve_knowledge(query), None
+
+        with span("semantic_cache_lookup"):
+            entry = self.semantic_cache.lookup(query_embedding)
+        metrics.count("semantic_cache_lookups", result="miss" if entry is None else "hit")
+        if entry is not None:
+            LOG.info(f"semantic cache hit, similar to query: {entry.query_text}")
+            return entry.context, entry
+        search_results_models = self.search_listings(query)
+        with span("build_context"):
+            context = self.build_context(search_results_models)
+        entry = self.semantic_cache.put(query_embedding, query.get('text'), [row.id for row in search_results_models], context)
+        return context, entry
 
-        # First, determine if the query is about property recommendations
+    def classify_query(self, query_text: str) -> bool:
+        """
+        Determine with the LLM if the query is about property recommendations.
+        Args:
+            query_text: Text of the user query
+        Returns:
+            True if the query is about Airbnb property recommendations
+        """
         query_type_prompt = ChatPromptTemplate.from_messages([
             ("system", "You are a query classifier. Your task is to determine if the user is asking about Airbnb property recommendations. Respond with only 'yes' or 'no'."),
             ("human", "Is this query about Airbnb property recommendations? Query: {query}")
         ])
-        query_text, query_files = query.get('text'), query.get('files')
-        LOG.info(f"query_text: {query_text}")
-        LOG.info(f"query_files: {query_files}")
-        query_type_response = self.chat(query_type_prompt.format_messages(query=query_text))
-        is_property_query = query_type_response.content.lower().strip() == 'yes'
-        has_image = len(query_files) > 0
-        # If it's a property query or has an image, retrieve knowledge
-        context = []
-        if is_property_query or has_image:
-            context = self.retrieve_knowledge(query)
+        with span("classify"):
+            query_type_response = self.chat(query_type_prompt.format_messages(query=query_text))
+        return query_type_response.content.lower().strip() == 'yes'
+
+    def classify_query_locally(self, query_text: str) -> Optional[bool]:
+        """
+        Determine with the local intent classifier if the query is about property recommendations.
+        Args:
+            query_text: Text of the user query
+        Returns:
+            True or False, None when there is no local classifier or it is not confident
+        """
+        if self.intent_classifier is None:
+            return None
+        with span("classify_local"):
+            is_property_query = self.intent_classifier.classify(query_text)
+        metrics.count("query_classifications", classifier="llm" if is_property_query is None else "local")
+        return is_property_query
 
+    def build_messages(self, query: Dict[str, Any], history, use_context: bool, context: List[Dict[str, Any]]):
+        """
+        Build the answer prompt.
+        Args:
+            query: Dictionary containing 'text' and optionally 'files'
+            history: Chat history of the session
+            use_context: Whether the query is about properties or has an image
+            context: Retrieved listings
+        Returns:
+            Formatted messages for the LLM
+        """
         # Create different prompt templates based on the query type
-        if is_property_query or has_image:
+        if use_context:
             prompt_template = ChatPromptTemplate.from_messages([
                 ("system", """You are an Airbnb listing recommendation system. Please:
                 1. Respond in the same language as the user
@@ -113,34 +180,101 @@ class RagAgent:
                    - Highlight features that match the user's criteria
                 3. If the user has provided an image, consider visual similarity in your recommendations
                 4. Be friendly and helpful in your responses"""),
-                *history.messages,
+                *prompt_history(history.messages),
                 ("human", "Answer this user query: {query} with the following context:\n{context}")
             ])
-        else:
-            prompt_template = ChatPromptTemplate.from_messages([
-                ("system", """You are an Airbnb customer service assistant. Please:
-                1. Respond in the same language as the user
-                2. Be friendly and helpful
-                3. If you don't know the answer, say so politely
-                4. Keep responses concise and relevant"""),
-                *history.messages,
-                ("human", "Answer this user query: {query}")
-            ])
-        
-        # Format the prompt with the actual values
-        if is_property_query or has_image:
-            formatted_messages = prompt_template.format_messages(
+            # Format the prompt with the actual values
+            return prompt_template.format_messages(
                 query=query,
                 context=context if context else "No specific property information available."
             )
-        else:
-            formatted_messages = prompt_template.format_messages(
-                query=query
-            )
 
-        # Get response from LLM
-        response = self.chat(formatted_messages)
-        system_response = response.content
+        prompt_template = ChatPromptTemplate.from_messages([
+            ("system", """You are an Airbnb customer service assistant. Please:
+            1. Respond in the same language as the user
+            2. Be friendly and helpful
+            3. If you don't know the answer, say so politely
+            4. Keep responses concise and relevant"""),
+            *prompt_history(history.messages),
+            ("human", "Answer this user query: {query}")
+        ])
+        return prompt_template.format_messages(
+            query=query
+        )
+
+    async def _run_blocking(self, timeout: float, func, *args):
+        loop = asyncio.get_running_loop()
+        # run in a copy of the current context, so spans in the pool keep the request and session ids
+        call = functools.partial(contextvars.copy_context().run, func, *args)
+        return await asyncio.wait_for(loop.run_in_executor(self.executor, call), timeout)
+
+    async def _prepare_answer(self, query: Dict[str, Any], session_id: str):
+        """
+        Classify the query and retrieve its context, then build the answer prompt.
+
+        The local intent classifier decides confident queries first: retrieval is skipped for the
+        ones that are not about properties and started right away for the others, as for image
+        queries, which always use the retrieved context. Only for the queries it defers to the
+        classifier LLM call does retrieval (query embedding and search) start speculatively while
+        the call is running, its result discarded if the query is not about properties. Blocking
+        calls run in the agent's thread pool, each stage bounded by its own timeout.
+        Returns:
+            Tuple of (session history, formatted answer messages, semantic cache entry or None)
+        """
+        # Get or create session history
+        with span("session_history"):
+            history = get_session_history(session_id)
+
+        query_text, query_files = query.get('text'), query.get('files')
+        LOG.info(f"query_text: {query_text}")
+        LOG.info(f"query_files: {query_files}")
+        has_image = len(query_files) > 0
+
+        is_property_query = True if has_image else self.classify_query_locally(query_text)
+        retrieval = None
+        if is_property_query is not False:
+            retrieval = asyncio.ensure_future(self._run_blocking(RETRIEVAL_TIMEOUT, self.retrieve_with_cache, query))
+            # never leave a discarded speculative retrieval with an unretrieved exception
+            retrieval.add_done_callback(lambda task: task.cancelled() or task.exception())
+        if is_property_query is None:
+            try:
+                is_property_query = await self._run_blocking(CLASSIFY_TIMEOUT, self.classify_query, query_text)
+            except asyncio.TimeoutError:
+                LOG.warning("query classification timed out, treating the query as a property query")
+                metrics.count("stage_timeouts", stage="classify")
+                is_property_query = True
+
+        # If it's a property query or has an image, retrieve knowledge
+        context, cache_entry = [], None
+        use_context = is_property_query or has_image
+        if use_context:
+            try:
+                # only the part of the retrieval not hidden behind the classifier
+                with span("retrieval_wait"):
+                    context, cache_entry = await retrieval
+            except asyncio.TimeoutError:
+                LOG.warning("retrieval timed out, answering without context")
+                metrics.count("stage_timeouts", stage="retrieval")
+        elif retrieval is not None:
+            retrieval.cancel()
+            metrics.count("speculative_retrievals", result="discarded")
+
+        with span("build_messages"):
+            messages = self.build_messages(query, history, use_context, context)
+        return history, messages, cache_entry
+
+    @staticmethod
+    def _cached_answer(history, cache_entry: Optional[CacheEntry]) -> Optional[str]:
+        # answers depend on the conversation, so only first-turn answers are reused
+        if cache_entry is not None and cache_entry.answer is not None and not history.messages:
+            LOG.info("reusing the answer of the semantic cache")
+            return cache_entry.answer
+        return None
+
+    def _record(self, history, query: Dict[str, Any], system_response: str,
+                cache_entry: Optional[CacheEntry] = None) -> None:
+        if cache_entry is not None and not history.messages:
+            self.semantic_cache.set_answer(cache_entry.key, system_response)
 
         # Add messages to history
         history.add_user_message(str(query))
@@ -149,4 +283,95 @@ class RagAgent:
         LOG.info(f"- User Question:\n{query}\n")
         LOG.info(f"- System Response:\n{system_response}\n")
 
-        return system_response
\ No newline at end of file
+    async def aresponse_to_user(self, query: Dict[str, Any], session_id: str = "default") -> str:
+        """
+        Generate a response to the user query using LLM and session history.
+        Args:
+            query: Dictionary containing 'text' and optionally 'files'
+            session_id: Unique identifier for the conversation session
+        Returns:
+            Generated response string
+        """
+        with request_context(session_id), span("request", mode="blocking"):
+            history, formatted_messages, cache_entry = await self._prepare_answer(query, session_id)
+
+            system_response = self._cached_answer(history, cache_entry)
+            if system_response is None:
+                # Get response from LLM
+                with span("answer", mode="blocking"):
+                    response = await self._run_blocking(ANSWER_TIMEOUT, self.chat, formatted_messages)
+                system_response = response.content
+
+            self._record(history, query, system_response, cache_entry)
+            return system_response
+
+    async def astream_response_to_user(self, query: Dict[str, Any], session_id: str = "default") -> AsyncIterator[str]:
+        """
+        Stream the response to the user query token by token as the LLM produces it.
+        The exchange is added to the session history once the stream completes. A stream that
+        has not completed within ANSWER_TIMEOUT, first chunk included, is closed with a notice
+        to the user and not recorded.
+        Args:
+            query: Dictionary containing 'text' and optionally 'files'
+            session_id: Unique identifier for the conversation session
+        Yields:
+            Chunks of the generated response
+        """
+        start = time.perf_counter()
+        # the request context is never held across a yield, which may resume in another context
+        with request_context(session_id) as request_id:
+            history, formatted_messages, cache_entry = await self._prepare_answer(query, session_id)
+
+        cached_answer = self._cached_answer(history, cache_entry)
+        if cached_answer is not None:
+            yield cached_answer
+            with request_context(session_id, request_id):
+                metrics.observe("request", time.perf_counter() - start, mode="stream")
+                self._record(history, query, cached_answer, cache_entry)
+            return
+
+        chunks = []
+        answer_start = time.perf_counter()
+        stream = self.chat.astream(formatted_messages).__aiter__()
+        try:
+            while True:
+                # a stalled completion would otherwise hold its queue slot forever
+                remaining = ANSWER_TIMEOUT - (time.perf_counter() - answer_start)
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), max(remaining, 0))
+                except StopAsyncIteration:
+                    break
+                if not chunk.content:
+                    continue
+                if not chunks:
+                    first_token = time.perf_counter() - start
+                    LOG.info(f"time to first token: {first_token * 1000:.0f} ms")
+                    with request_context(session_id, request_id):
+                        metrics.observe("time_to_first_token", first_token)
+                chunks.append(chunk.content)
+                yield chunk.content
+        except asyncio.TimeoutError:
+            LOG.warning(f"answer stream timed out after {len(chunks)} chunks, not recording the partial answer")
+            with request_context(session_id, request_id):
+                metrics.count("stage_timeouts", stage="answer")
+            yield ("\n\n" if chunks else "") + ANSWER_TIMEOUT_MESSAGE
+            return
+        finally:
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+
+        with request_context(session_id, request_id):
+            metrics.observe("answer", time.perf_counter() - answer_start, mode="stream")
+            metrics.observe("request", time.perf_counter() - start, mode="stream")
+            self._record(history, query, "".join(chunks), cache_entry)
+
+    def response_to_user(self, query: Dict[str, Any], session_id: str = "default") -> str:
+        """
+        Blocking wrapper of `aresponse_to_user`, for callers without an event loop.
+        Args:
+            query: Dictionary containing 'text' and optionally 'files'
+            session_id: Unique identifier for the conversation session
+        Returns:
+            Generated response string
+        """
+        return asyncio.run(self.aresponse_to_user(query, session_id))
@@ -1,6 +1,12 @@
+from search.hydration import hydrate
+from utils.tracing import span
+
+
 class FullTextSearch():
-    def __init__(self, collection) -> None:
+    def __init__(self, collection, limit: int = 10, two_phase: bool = False) -> None:
         self.collection = collection
+        self.limit = limit
+        self.two_phase = two_phase  # rank on ids and scores, then fetch the results' fields only
 
     def _build_pipeline(self, query_text: str) -> list[dict]:
         pipeline = [
@@ -14,6 +20,8 @@ class FullTextSearch():
                 }
             },
             {
+                "$project": {"_id": 1, "search_score": {"$meta": "searchScore"}}
+            } if self.two_phase else {
                 "$addFields": {
                     "search_score": {"$meta": "searchScore"}
                 }
@@ -23,10 +31,13 @@ class FullTextSearch():
                     "search_score": -1
                 }
             },
-            {"$limit": 10}
+            {"$limit": self.limit}
         ]
         return pipeline
 
     def do_search(self, text_query: str) -> list[dict]:
         pipeline = self._build_pipeline(text_query)       
-        return self.collection.aggregate(pipeline)
\ No newline at end of file
+        with span("aggregate", search="fulltext"):
+            if self.two_phase:
+                return hydrate(self.collection, list(self.collection.aggregate(pipeline)))
+            return self.collection.aggregate(pipeline)
\ No newline at end of file
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from search.hydration import hydrate
+
+RRF_K = 60
+MAX_WORKERS = 8
+
+
+def reciprocal_rank_fusion(rankings: List[List[Any]], weights: List[float],
+                           k: int = RRF_K) -> Tuple[List[Any], np.ndarray]:
+    """
+    Weighted Reciprocal Rank Fusion of several ranked id lists.
+
+    A document at 0-based rank r of leg i gets weights[i] / (r + k) from that leg, the same
+    formula as the `$group`/`$unwind` pipelines. Documents are sorted by decreasing fused score,
+    ties keeping the order in which the documents were first seen.
+
+    Args:
+        rankings: One list of ids per leg, best first
+        weights: Weight of each leg
+        k: RRF rank constant
+    Returns:
+        Tuple of (fused ids, (n_ids, n_legs) matrix of per-leg contributions), best first
+    """
+    ids = [id_ for ranking in rankings for id_ in ranking]
+    if not ids:
+        return [], np.zeros((0, len(rankings)))
+    legs = np.concatenate([np.full(len(ranking), i) for i, ranking in enumerate(rankings)])
+    ranks = np.concatenate([np.arange(len(ranking)) for ranking in rankings])
+    contributions = np.asarray(weights, dtype=np.float64)[legs] / (ranks + k)
+
+    unique_ids = list(dict.fromkeys(ids))
+    position = {id_: i for i, id_ in enumerate(unique_ids)}
+    rows = np.fromiter((position[id_] for id_ in ids), dtype=np.int64, count=len(ids))
+    scores = np.zeros((len(unique_ids), len(rankings)))
+    # a document appearing twice in one leg keeps its best rank, like the $max in the pipelines
+    np.maximum.at(scores, (rows, legs), contributions)
+    order = np.argsort(-scores.sum(axis=1), kind='stable')
+    return [unique_ids[i] for i in order], scores[order]
+
+
+class FusionExecutor():
+    """
+    Runs the retrieval legs of a hybrid or multimodal search concurrently and fuses them in Python.
+
+    Each leg is a lightweight pipeline returning only `_id` and a score (see
+    `build_hybrid_search_legs` and `pipelines_multimodal_legs`). Vector legs are answered by
+    the local vector backend when one is given. Only the fused top results are then fetched
+    with a single `$in` query (see search.hydration).
+    """
+    def __init__(self, collection, vector_backend=None, max_workers: int = MAX_WORKERS) -> None:
+        self.collection = collection
+        self.vector_backend = vector_backend
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fusion-leg")
+
+    def _run_leg(self, pipeline: List[Dict[str, Any]]) -> List[Any]:
+        first = pipeline[0]
+        if self.vector_backend is not None and "$vectorSearch" in first \
+                and first["$vectorSearch"]["path"] in self.vector_backend.indexes:
+            spec = first["$vectorSearch"]
+            ids, _ = self.vector_backend.search(spec["path"], spec["queryVector"], spec.get("limit", 10),
+                                                spec.get("numCandidates"))
+            return ids
+        return [doc["_id"] for doc in self.collection.aggregate(pipeline)]
+
+    def run_legs(self, legs: List[List[Dict[str, Any]]]) -> List[List[Any]]:
+        """Run the legs concurrently and get their ranked ids."""
+        return [future.result() for future in [self.pool.submit(self._run_leg, leg) for leg in legs]]
+
+    def search(self, legs: List[List[Dict[str, Any]]], weights: List[float], score_fields: List[str],
+               return_keys: List[str], limit: int, k: int = RRF_K,
+               projection: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Run the legs, fuse them with weighted RRF and hydrate the top results.
+        Args:
+            legs: Pipelines returning `_id` and score in rank order
+            weights: Weight of each leg
+            score_fields: Name of the per-leg score field of each leg, e.g. vs_score and fts_score
+            return_keys: Document fields to return
+            limit: Number of fused results
+            k: RRF rank constant
+            projection: Projection of the hydration query, overriding `return_keys`
+        Returns:
+            Documents with their fields in `return_keys`, the per-leg scores and `search_score`,
+            sorted by decreasing `search_score`
+        """
+        fused_ids, scores = reciprocal_rank_fusion(self.run_legs(legs), weights, k)
+        ranked = []
+        for id_, leg_scores in zip(fused_ids[:limit], scores[:limit]):
+            ranked.append({"_id": id_, **{field: float(score) for field, score in zip(score_fields, leg_scores)},
+                           "search_score": float(leg_scores.sum())})
+        return hydrate(self.collection, ranked, projection or {key: 1 for key in return_keys})
@@ -1,18 +1,44 @@
-from search.pipelines.hybrid_search_pipeline import build_hybrid_search_stage
+from search.hydration import hydrate, result_projection
+from search.pipelines.hybrid_search_pipeline import build_hybrid_search_stage, build_hybrid_search_legs, \
+    build_hybrid_rank_stage, HYBRID_RETURN_KEYS
 from utils.embedding import get_text_embedding
+from utils.tracing import span
 
 class HybridSearch():
-    def __init__(self, collection) -> None:
+    def __init__(self, collection, vector_backend=None, fusion=None, alpha_vector: float = 0.8,
+                 num_candidates: int = 100, limit: int = 20, two_phase: bool = False) -> None:
         self.collection = collection
+        self.vector_backend = vector_backend
+        self.fusion = fusion  # FusionExecutor, to run the legs concurrently and fuse client-side
+        self.alpha_vector = alpha_vector
+        self.num_candidates = num_candidates
+        self.limit = limit  # results of each leg, 10 are returned after fusion
+        self.two_phase = two_phase  # rank on ids and scores, then fetch the results' fields only
 
     def _build_pipeline(self, query_vector: list[float], query_text: str) -> list[dict]:
-        pipeline = build_hybrid_search_stage(query_vector, query_text)
+        if self.two_phase:
+            return build_hybrid_rank_stage(query_vector, query_text, alpha_vector=self.alpha_vector,
+                                           num_candidates=self.num_candidates, limit=self.limit)
+        pipeline = build_hybrid_search_stage(query_vector, query_text, alpha_vector=self.alpha_vector,
+                                             num_candidates=self.num_candidates, limit=self.limit)
         # TODO: add additional stages
         return pipeline
 
     def do_search(self, user_query: str) -> list[dict]:
         query_text = user_query
         query_vector = get_text_embedding(query_text)
+        if self.fusion is not None:
+            with span("aggregate", search="hybrid", fusion="client"):
+                return self.fusion.search(build_hybrid_search_legs(query_vector, query_text, self.num_candidates, self.limit),
+                                          weights=[self.alpha_vector, 1 - self.alpha_vector],
+                                          score_fields=["vs_score", "fts_score"],
+                                          return_keys=HYBRID_RETURN_KEYS, limit=10,
+                                          projection=result_projection() if self.two_phase else None)
         pipeline = self._build_pipeline(query_vector, query_text)       
-        return self.collection.aggregate(pipeline)
+        if self.vector_backend is not None:
+            pipeline = self.vector_backend.rewrite(pipeline)
+        with span("aggregate", search="hybrid"):
+            if self.two_phase:
+                return hydrate(self.collection, list(self.collection.aggregate(pipeline)))
+            return self.collection.aggregate(pipeline)
     
@@ -0,0 +1,42 @@
+from typing import Any, Dict, List, Optional
+
+from data_models import SearchResultItem
+
+REVIEW_SLICE = 10  # most recent reviews fetched per listing, the context builder quotes a few of them
+COMPUTED_FIELDS = {"search_score"}
+
+
+def result_projection(model=SearchResultItem, review_slice: Optional[int] = REVIEW_SLICE) -> Dict[str, Any]:
+    """
+    Projection fetching exactly the fields of a result model, never the embedding arrays.
+    Args:
+        model: Pydantic model the results are validated with
+        review_slice: Number of reviews kept from the end of the `reviews` array, None for all
+    Returns:
+        Projection for `find`, with a `$slice` on reviews
+    """
+    projection = {}
+    for name, field in model.model_fields.items():
+        key = field.alias or name
+        if key not in COMPUTED_FIELDS:
+            projection[key] = 1
+    if review_slice is not None and "reviews" in projection:
+        projection["reviews"] = {"$slice": -review_slice}
+    return projection
+
+
+def hydrate(collection, ranked: List[Dict[str, Any]], projection: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Second phase of a two-phase retrieval: fetch the ranked documents with one `$in` query.
+    Args:
+        collection: MongoDB collection
+        ranked: Results of the ranking phase, `_id` and scores only, best first
+        projection: Fields to fetch, defaults to `result_projection()`
+    Returns:
+        The fetched documents in rank order, carrying the scores of the ranking phase
+    """
+    if not ranked:
+        return []
+    ids = [doc["_id"] for doc in ranked]
+    docs = {doc["_id"]: doc for doc in collection.find({"_id": {"$in": ids}}, projection or result_projection())}
+    return [{**docs[doc["_id"]], **doc} for doc in ranked if doc["_id"] in docs]
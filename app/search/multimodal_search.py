@@ -9,20 +9,44 @@
 @Desc   : Please enter here
 '''
 from utils.embedding import get_img_embedding, get_text_embedding
-from search.pipelines.multimodal_search_pipelines import pipeline_image_only_search, pipeline_multimodal_search
+from utils.tracing import span
+from search.hydration import hydrate, result_projection
+from search.pipelines.multimodal_search_pipelines import pipeline_image_only_search, pipeline_multimodal_search, \
+    pipelines_multimodal_legs, pipeline_multimodal_rank, pipeline_image_only_rank, RETURN_KEYS, NUM_CANDIDATES, TOP_K
 
 
 class MultiModalSearch():
-    def __init__(self,collection):
+    def __init__(self,collection, vector_backend=None, fusion=None, num_candidates=NUM_CANDIDATES, top_k=TOP_K,
+                 two_phase=False):
         self.collection = collection
+        self.vector_backend = vector_backend
+        self.fusion = fusion  # FusionExecutor, to run the legs concurrently and fuse client-side
+        self.num_candidates = num_candidates
+        self.top_k = top_k
+        self.two_phase = two_phase  # rank on ids and scores, then fetch the results' fields only
 
     def do_search(self, query_text, query_img, alpha_text=0.5):
         query_text_embedding, query_img_embedding = None, None
         query_img_embedding = get_img_embedding(query_img)
         if query_text is not None and query_text != '':
             query_text_embedding = get_text_embedding(query_text)
-            pipeline = pipeline_multimodal_search(query_text_embedding, query_img_embedding, alpha_text)
+            if self.fusion is not None:
+                with span("aggregate", search="multimodal", fusion="client"):
+                    return self.fusion.search(pipelines_multimodal_legs(query_text_embedding, query_img_embedding,
+                                                                        self.num_candidates, self.top_k),
+                                              weights=[alpha_text, 1 - alpha_text],
+                                              score_fields=["text_search_score", "image_search_score"],
+                                              return_keys=RETURN_KEYS, limit=self.top_k,
+                                              projection=result_projection() if self.two_phase else None)
+            build = pipeline_multimodal_rank if self.two_phase else pipeline_multimodal_search
+            pipeline = build(query_text_embedding, query_img_embedding, alpha_text, self.num_candidates, self.top_k)
         else:
-            pipeline = pipeline_image_only_search(query_img_embedding)
-        return list(self.collection.aggregate(pipeline))
+            build = pipeline_image_only_rank if self.two_phase else pipeline_image_only_search
+            pipeline = build(query_img_embedding, self.num_candidates, self.top_k)
+        if self.vector_backend is not None:
+            pipeline = self.vector_backend.rewrite(pipeline)
+        with span("aggregate", search="multimodal" if query_text_embedding is not None else "image_only"):
+            if self.two_phase:
+                return hydrate(self.collection, list(self.collection.aggregate(pipeline)))
+            return list(self.collection.aggregate(pipeline))
 
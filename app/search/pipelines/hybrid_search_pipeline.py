@@ -1,4 +1,6 @@
 from typing import List, Dict, Any
+from search.pipelines.rank_stages import rank_ids
+from utils.embedding_dimensions import TEXT_EMBED_FIELD, TEXT_VECTOR_INDEX
 
 
 
@@ -28,8 +30,8 @@ def build_hybrid_search_stage(
     Returns:
         List[Dict[str, Any]]: Combined and ranked search results, each containing document metadata
     """
-    VECTOR_INDEX_NAME = "vector_index_text"
-    VECTOR_QUERY_PATH = "description_embedding"
+    VECTOR_INDEX_NAME = TEXT_VECTOR_INDEX
+    VECTOR_QUERY_PATH = TEXT_EMBED_FIELD
     FULL_TEXT_INDEX_NAME = "full_text_search_index"
     FULL_TEXT_QUERY_PATH = "description"
     COLLECTION_NAME = "airbnb_embeddings"
@@ -201,3 +203,120 @@ def build_hybrid_search_stage(
         {"$limit": final_limit}
     ]
     return pipeline
+
+
+HYBRID_RETURN_KEYS = ['name', 'accommodates', 'address', 'summary', 'description', 'neighborhood_overview', 'notes', 'images', 'reviews']
+
+
+def build_hybrid_search_legs(
+    query_vector: List[float],
+    query_text: str,
+    num_candidates: int = 100,
+    limit: int = 20) -> List[List[Dict[str, Any]]]:
+    """Builds the two retrieval legs of the hybrid search as separate lightweight pipelines.
+
+    Unlike `build_hybrid_search_stage`, each leg only returns `_id` and its native score, in rank
+    order, so the legs can run concurrently and be fused client-side (see search.fusion).
+
+    Args:
+        query_vector (List[float]): Vector embedding of the search query
+        query_text (str): Text query for full-text search
+        num_candidates (int, optional): Number of candidates to consider in vector search. Defaults to 100
+        limit (int, optional): Maximum results to return from each search type. Defaults to 20
+
+    Returns:
+        List[List[Dict[str, Any]]]: The vector search pipeline and the full-text search pipeline
+    """
+    vector_leg = [
+        {
+            "$vectorSearch": {
+                "index": TEXT_VECTOR_INDEX,
+                "path": TEXT_EMBED_FIELD,
+                "queryVector": query_vector,
+                "numCandidates": num_candidates,
+                "limit": limit
+            }
+        },
+        {"$project": {"_id": 1, "score": {"$meta": "vectorSearchScore"}}}
+    ]
+    full_text_leg = [
+        {
+            "$search": {
+                "index": "full_text_search_index",
+                "phrase": {
+                    "query": query_text,
+                    "path": "description"
+                }
+            }
+        },
+        {"$limit": limit},
+        {"$project": {"_id": 1, "score": {"$meta": "searchScore"}}}
+    ]
+    return [vector_leg, full_text_leg]
+
+
+def build_hybrid_rank_stage(
+    query_vector: List[float],
+    query_text: str,
+    alpha_vector: float = 0.8,
+    num_candidates: int = 100,
+    limit: int = 20,
+    final_limit: int = 10) -> List[Dict[str, Any]]:
+    """Ranking phase of a two-phase hybrid search.
+
+    Same RRF fusion as `build_hybrid_search_stage`, but only `_id` and the scores go through the
+    `$group`/`$unwind`/`$unionWith` stages; the final listings are fetched afterwards with one
+    `$in` query (see search.hydration).
+
+    Args:
+        query_vector (List[float]): Vector embedding of the search query
+        query_text (str): Text query for full-text search
+        alpha_vector (float, optional): Weight of the vector search results. Defaults to 0.8
+        num_candidates (int, optional): Number of candidates to consider in vector search. Defaults to 100
+        limit (int, optional): Maximum results to return from each search type. Defaults to 20
+        final_limit (int, optional): Final number of results after combining both searches. Defaults to 10
+
+    Returns:
+        List[Dict[str, Any]]: Pipeline returning `_id`, vs_score, fts_score and search_score, best first
+    """
+    return [
+        {
+            "$vectorSearch": {
+                "index": TEXT_VECTOR_INDEX,
+                "path": TEXT_EMBED_FIELD,
+                "queryVector": query_vector,
+                "numCandidates": num_candidates,
+                "limit": limit
+            }
+        },
+        *rank_ids("vs_score", alpha_vector),
+        {
+            "$unionWith": {
+                "coll": "airbnb_embeddings",
+                "pipeline": [
+                    {
+                        "$search": {
+                            "index": "full_text_search_index",
+                            "phrase": {
+                                "query": query_text,
+                                "path": "description"
+                            }
+                        }
+                    },
+                    {"$limit": limit},
+                    *rank_ids("fts_score", 1 - alpha_vector)
+                ]
+            }
+        },
+        {"$group": {"_id": "$_id", "vs_score": {"$max": "$vs_score"}, "fts_score": {"$max": "$fts_score"}}},
+        {
+            "$project": {
+                "_id": 1,
+                "vs_score": {"$ifNull": ["$vs_score", 0]},
+                "fts_score": {"$ifNull": ["$fts_score", 0]}
+            }
+        },
+        {"$addFields": {"search_score": {"$add": ["$fts_score", "$vs_score"]}}},
+        {"$sort": {"search_score": -1}},
+        {"$limit": final_limit}
+    ]
@@ -9,11 +9,14 @@
 @Desc   : Please enter here
 '''
 from typing import List, Dict, Any
+from search.pipelines.rank_stages import rank_ids
+from utils.embedding_dimensions import TEXT_EMBED_FIELD, TEXT_VECTOR_INDEX
 
-TEXT_EMBED_FIELD_NAME = "description_embedding"
+TEXT_EMBED_FIELD_NAME = TEXT_EMBED_FIELD
 IMG_EMBED_FIELD_NAME = "image_embeddings"
 vc_index_name_prefix = "vector_index"
 ind_suffix = ['text','image']
+vc_index_names = {'text': TEXT_VECTOR_INDEX, 'image': f"{vc_index_name_prefix}_image"}
 SCORE_NAME_BASIC = 'search_score'
 # RETURN_KEYS = ['_id', 'listing_url', 'name', 'summary', 'space', 'description', 'neighborhood_overview', 'notes', 'transit', 'access', 'interaction', 'house_rules', 'property_type', 'room_type', 'bed_type', 'minimum_nights', 'maximum_nights', 'cancellation_policy', 'last_scraped', 'calendar_last_scraped', 'first_review', 'last_review', 'accommodates', 'bedrooms', 'beds', 'number_of_reviews', 'bathrooms', 'amenities', 'price', 'security_deposit', 'cleaning_fee', 'extra_people', 'guests_included', 'images', 'host', 'address', 'availability', 'review_scores', 'reviews']
 RETURN_KEYS = ['name','accommodates','address','summary',  'description', 'neighborhood_overview', 'notes', 'images', 'listing_url']
@@ -21,7 +24,10 @@ COLLECTION_NAME = "airbnb_embeddings"
 NUM_CANDIDATES = 150
 TOP_K = 20
 
-def pipeline_image_only_search(query_vector: List[float]) -> List[Dict[str, Any]]:
+def pipeline_image_only_search(
+    query_vector: List[float],
+    num_candidates: int = NUM_CANDIDATES,
+    top_k: int = TOP_K) -> List[Dict[str, Any]]:
     ind_name = "vector_index_image"
     score_name = "image_search_score"
     embed_name = IMG_EMBED_FIELD_NAME
@@ -32,8 +38,8 @@ def pipeline_image_only_search(query_vector: List[float]) -> List[Dict[str, Any]
             "index": ind_name,
             "path": embed_name, 
             "queryVector": query_vector,
-            "numCandidates": NUM_CANDIDATES,
-            "limit": TOP_K,
+            "numCandidates": num_candidates,
+            "limit": top_k,
             "scoreField": score_name
         }
     })
@@ -48,7 +54,9 @@ def pipeline_image_only_search(query_vector: List[float]) -> List[Dict[str, Any]
 def pipeline_multimodal_search(
     query_text_vector: List[float],
     query_img_vector: List[float],
-    alpha_text: float = 0.4) -> List[Dict[str, Any]]:
+    alpha_text: float = 0.4,
+    num_candidates: int = NUM_CANDIDATES,
+    top_k: int = TOP_K) -> List[Dict[str, Any]]:
     """Performs hybrid search combining vector and full-text search results.
 
     This pipeline executes both vector similarity search and full-text search on MongoDB collections,
@@ -59,6 +67,8 @@ def pipeline_multimodal_search(
         query_vector_text (List[float]): Vector embedding of the queried text
         query_vector_image (List[float]): Vector embedding of the queried image
         text_weight (float): Text embedding weight, between [0,1]
+        num_candidates (int): Number of candidates of each vector search. Defaults to NUM_CANDIDATES
+        top_k (int): Results of each vector search and of the fused ranking. Defaults to TOP_K
     Returns:
         List[Dict[str, Any]]: Combined and ranked search results, each containing document metadata
     """
@@ -69,7 +79,7 @@ def pipeline_multimodal_search(
     # embed_text, embed_img = embeddings_list
     alpha_img = 1 - alpha_text
 
-    ind_name_text, ind_name_img = f"{vc_index_name_prefix}_text", f"{vc_index_name_prefix}_image"
+    ind_name_text, ind_name_img = vc_index_names['text'], vc_index_names['image']
     score_name_text, score_name_img = f"text_{SCORE_NAME_BASIC}", f"image_{SCORE_NAME_BASIC}"
     embed_name_text, embed_name_img = TEXT_EMBED_FIELD_NAME, IMG_EMBED_FIELD_NAME
 
@@ -83,8 +93,8 @@ def pipeline_multimodal_search(
                 "index": ind_name_text,
                 "path": embed_name_text,
                 "queryVector": query_text_vector,
-                "numCandidates": NUM_CANDIDATES,
-                "limit": TOP_K
+                "numCandidates": num_candidates,
+                "limit": top_k
             }
         }, {
             "$group": {
@@ -126,11 +136,11 @@ def pipeline_multimodal_search(
                             "index": ind_name_img,
                             "path": embed_name_img,
                             "queryVector": query_img_vector,
-                            "numCandidates": NUM_CANDIDATES,
-                            "limit": TOP_K
+                            "numCandidates": num_candidates,
+                            "limit": top_k
                         }
                     }, {
-                        "$limit": TOP_K
+                        "$limit": top_k
                     }, {
                         "$group": {
                             "_id": None,
@@ -189,7 +199,111 @@ def pipeline_multimodal_search(
             }
         },
         {"$sort": {SCORE_NAME_BASIC: -1}},
-        {"$limit": TOP_K}
+        {"$limit": top_k}
     ]
     return pipeline
 
+
+
+def pipelines_multimodal_legs(
+    query_text_vector: List[float],
+    query_img_vector: List[float],
+    num_candidates: int = NUM_CANDIDATES,
+    top_k: int = TOP_K) -> List[List[Dict[str, Any]]]:
+    """Builds the text and image vector search legs of `pipeline_multimodal_search` as separate
+    pipelines returning only `_id` and score, in rank order, to be fused client-side (see search.fusion).
+
+    Args:
+        query_text_vector (List[float]): Vector embedding of the queried text
+        query_img_vector (List[float]): Vector embedding of the queried image
+        num_candidates (int): Number of candidates of each vector search. Defaults to NUM_CANDIDATES
+        top_k (int): Results of each leg. Defaults to TOP_K
+    Returns:
+        List[List[Dict[str, Any]]]: The text leg and the image leg
+    """
+    legs = []
+    for ind, path, vector in zip(ind_suffix, [TEXT_EMBED_FIELD_NAME, IMG_EMBED_FIELD_NAME], [query_text_vector, query_img_vector]):
+        legs.append([
+            {
+                "$vectorSearch": {
+                    "index": vc_index_names[ind],
+                    "path": path,
+                    "queryVector": vector,
+                    "numCandidates": num_candidates,
+                    "limit": top_k
+                }
+            },
+            {"$project": {"_id": 1, "score": {"$meta": "vectorSearchScore"}}}
+        ])
+    return legs
+
+
+def pipeline_multimodal_rank(
+    query_text_vector: List[float],
+    query_img_vector: List[float],
+    alpha_text: float = 0.4,
+    num_candidates: int = NUM_CANDIDATES,
+    top_k: int = TOP_K) -> List[Dict[str, Any]]:
+    """Ranking phase of a two-phase multimodal search.
+
+    Same RRF fusion as `pipeline_multimodal_search`, moving only `_id` and the scores; the final
+    listings are fetched afterwards with one `$in` query (see search.hydration).
+
+    Args:
+        query_text_vector (List[float]): Vector embedding of the queried text
+        query_img_vector (List[float]): Vector embedding of the queried image
+        alpha_text (float): Text embedding weight, between [0,1]
+        num_candidates (int): Number of candidates of each vector search. Defaults to NUM_CANDIDATES
+        top_k (int): Results of each vector search and of the fused ranking. Defaults to TOP_K
+    Returns:
+        List[Dict[str, Any]]: Pipeline returning `_id` and the scores, best first
+    """
+    score_name_text, score_name_img = f"text_{SCORE_NAME_BASIC}", f"image_{SCORE_NAME_BASIC}"
+    vector_searches = [
+        {
+            "$vectorSearch": {
+                "index": vc_index_names[ind],
+                "path": path,
+                "queryVector": vector,
+                "numCandidates": num_candidates,
+                "limit": top_k
+            }
+        }
+        for ind, path, vector in zip(ind_suffix, [TEXT_EMBED_FIELD_NAME, IMG_EMBED_FIELD_NAME],
+                                     [query_text_vector, query_img_vector])
+    ]
+    return [
+        vector_searches[0],
+        *rank_ids(score_name_text, alpha_text),
+        {"$unionWith": {"coll": COLLECTION_NAME, "pipeline": [vector_searches[1], *rank_ids(score_name_img, 1 - alpha_text)]}},
+        {"$group": {"_id": "$_id", score_name_img: {"$max": f"${score_name_img}"}, score_name_text: {"$max": f"${score_name_text}"}}},
+        {
+            "$project": {
+                "_id": 1,
+                score_name_img: {"$ifNull": [f"${score_name_img}", 0]},
+                score_name_text: {"$ifNull": [f"${score_name_text}", 0]}
+            }
+        },
+        {"$addFields": {SCORE_NAME_BASIC: {"$add": [f"${score_name_img}", f"${score_name_text}"]}}},
+        {"$sort": {SCORE_NAME_BASIC: -1}},
+        {"$limit": top_k}
+    ]
+
+
+def pipeline_image_only_rank(
+    query_vector: List[float],
+    num_candidates: int = NUM_CANDIDATES,
+    top_k: int = TOP_K) -> List[Dict[str, Any]]:
+    """Ranking phase of a two-phase image-only search, like `pipeline_image_only_search` without the document fields."""
+    return [
+        {
+            "$vectorSearch": {
+                "index": "vector_index_image",
+                "path": IMG_EMBED_FIELD_NAME,
+                "queryVector": query_vector,
+                "numCandidates": num_candidates,
+                "limit": top_k
+            }
+        },
+        {"$project": {"_id": 1, "image_search_score": {"$meta": "vectorSearchScore"}}}
+    ]
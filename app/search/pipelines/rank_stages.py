@@ -0,0 +1,22 @@
+from typing import Any, Dict, List
+
+from search.fusion import RRF_K
+
+
+def rank_ids(score_field: str, weight: float, k: int = RRF_K) -> List[Dict[str, Any]]:
+    """
+    Stages turning the results of one leg of a two-phase ranking pipeline into their weighted
+    RRF contribution, carrying nothing but `_id` and the score.
+    Args:
+        score_field: Name of the score field of the leg, e.g. vs_score
+        weight: Weight of the leg
+        k: RRF rank constant
+    Returns:
+        Stages to append to the leg, after its `$limit`
+    """
+    return [
+        {"$project": {"_id": 1}},
+        {"$group": {"_id": None, "ids": {"$push": "$_id"}}},
+        {"$unwind": {"path": "$ids", "includeArrayIndex": "rank"}},
+        {"$project": {"_id": "$ids", score_field: {"$multiply": [weight, {"$divide": [1.0, {"$add": ["$rank", k]}]}]}}}
+    ]
@@ -1,19 +1,27 @@
+from search.hydration import hydrate
 from utils.embedding import get_text_embedding
+from utils.embedding_dimensions import TEXT_EMBED_FIELD, TEXT_VECTOR_INDEX
+from utils.tracing import span
 
 
 class SemanticSearch():
-    def __init__(self, collection) -> None:
+    def __init__(self, collection, vector_backend=None, num_candidates: int = 150, limit: int = 10,
+                 two_phase: bool = False) -> None:
         self.collection = collection
+        self.vector_backend = vector_backend
+        self.num_candidates = num_candidates
+        self.limit = limit
+        self.two_phase = two_phase  # rank on ids and scores, then fetch the results' fields only
 
     def _build_pipeline(self, query_embedding: list[float]) -> list[dict]:
         pipeline = [
             {
                 "$vectorSearch": {
-                    "index": "vector_index_text",
+                    "index": TEXT_VECTOR_INDEX,
                     "queryVector": query_embedding,
-                    "path": "description_embedding",
-                    "numCandidates": 150,
-                    "limit": 10,
+                    "path": TEXT_EMBED_FIELD,
+                    "numCandidates": self.num_candidates,
+                    "limit": self.limit,
                     "scoreField": "search_score"
                 }
             }, 
@@ -28,4 +36,11 @@ class SemanticSearch():
     def do_search(self, text_query: str) -> list[dict]:
         query_embedding = get_text_embedding(text_query)
         pipeline = self._build_pipeline(query_embedding)       
-        return self.collection.aggregate(pipeline)
\ No newline at end of file
+        if self.two_phase:
+            pipeline.append({"$project": {"_id": 1, "search_score": 1}})
+        if self.vector_backend is not None:
+            pipeline = self.vector_backend.rewrite(pipeline)
+        with span("aggregate", search="semantic"):
+            if self.two_phase:
+                return hydrate(self.collection, list(self.collection.aggregate(pipeline)))
+            return self.collection.aggregate(pipeline)
\ No newline at end of file
@@ -0,0 +1,537 @@
+import copy
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+VECTORS_FILE = "vectors.npy"
+IDS_FILE = "ids.npy"
+META_FILE = "meta.json"
+LOCAL_SCORE_FIELD = "vector_search_score"
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class LocalVectorIndex():
+    """
+    Exact cosine search over a contiguous float32 matrix of unit-normalized vectors.
+
+    The matrix and the matching id array are saved as .npy files and memory-mapped on load,
+    so the index can be larger than RAM and is shared between processes by the page cache.
+    Scores follow Atlas `vectorSearchScore` for cosine similarity: (1 + cosine) / 2.
+    """
+    def __init__(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        if len(ids) != len(vectors):
+            raise ValueError(f"got {len(ids)} ids for {len(vectors)} vectors")
+        self.ids = ids
+        self.vectors = vectors
+        self._positions = None
+
+    @classmethod
+    def build(cls, ids: List[Any], vectors: List[List[float]]) -> "LocalVectorIndex":
+        matrix = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        return cls(np.asarray(ids), np.ascontiguousarray(matrix, dtype=np.float32))
+
+    @property
+    def dimensions(self) -> int:
+        return self.vectors.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, VECTORS_FILE), self.vectors)
+        np.save(os.path.join(directory, IDS_FILE), self.ids)
+        with open(os.path.join(directory, META_FILE), 'w') as f:
+            json.dump({"type": "exact", "count": len(self), "dimensions": self.dimensions}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "LocalVectorIndex":
+        mmap_mode = 'r' if mmap else None
+        return cls(np.load(os.path.join(directory, IDS_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, VECTORS_FILE), mmap_mode=mmap_mode))
+
+    def positions(self, ids: List[Any]) -> np.ndarray:
+        """Row numbers of the given ids, -1 for unknown ids."""
+        if self._positions is None:
+            self._positions = {id_.item() if hasattr(id_, 'item') else id_: i for i, id_ in enumerate(self.ids)}
+        return np.array([self._positions.get(id_, -1) for id_ in ids], dtype=np.int64)
+
+    def search(self, query_vector: List[float], limit: int = 10,
+               num_candidates: Optional[int] = None) -> Tuple[List[Any], List[float]]:
+        """
+        Get the `limit` most similar vectors.
+        Args:
+            query_vector: Query embedding, of the same dimension as the index
+            limit: Number of results
+            num_candidates: Ignored by exact search, accepted for interface parity with ANN indexes
+        Returns:
+            Tuple of (ids, scores), sorted by decreasing score
+        """
+        query = normalize_rows(np.asarray(query_vector, dtype=np.float32))
+        similarities = self.vectors @ query
+        limit = min(limit, len(similarities))
+        if limit <= 0:
+            return [], []
+        top = np.argpartition(-similarities, limit - 1)[:limit]
+        top = top[np.argsort(-similarities[top], kind='stable')]
+        scores = (1 + np.clip(similarities[top], -1, 1)) / 2
+        return self.ids[top].tolist(), scores.tolist()
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 20, seed: int = 0, spherical: bool = False) -> np.ndarray:
+    """Lloyd's k-means, returning the (k, d) centroids. Spherical k-means keeps centroids unit-normalized."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        if spherical:
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+        else:
+            distances = (vectors ** 2).sum(1, keepdims=True) - 2 * vectors @ centroids.T + (centroids ** 2).sum(1)
+            assignment = np.argmin(distances, axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # re-seed empty clusters with random points
+        centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        if spherical:
+            centroids = normalize_rows(centroids)
+    return centroids
+
+
+class IVFIndex(LocalVectorIndex):
+    """
+    Inverted-file approximate index, optionally with product quantization (IVF-PQ).
+
+    Vectors are clustered around `nlist` centroids and stored grouped by cluster, so each
+    inverted list is a contiguous slice. A query scans the lists of its nearest centroids;
+    with PQ it scores their compact codes (`pq_m` bytes per vector) and, if the float
+    vectors were kept, rescores the best `num_candidates` exactly.
+
+    `num_candidates` is the search-breadth knob, as for Atlas `numCandidates`: every
+    `candidates_per_probe` candidates buy one more probed list, and with PQ it is also
+    the size of the rescored shortlist.
+    """
+    def __init__(self, ids: np.ndarray, vectors: Optional[np.ndarray], centroids: np.ndarray, offsets: np.ndarray,
+                 codebooks: Optional[np.ndarray] = None, codes: Optional[np.ndarray] = None,
+                 candidates_per_probe: int = 10) -> None:
+        self.ids = ids
+        self.vectors = vectors
+        self._positions = None
+        self.centroids = centroids
+        self.offsets = offsets
+        self.codebooks = codebooks
+        self.codes = codes
+        self.candidates_per_probe = candidates_per_probe
+
+    @classmethod
+    def train(cls, ids: List[Any], vectors: np.ndarray, nlist: Optional[int] = None, pq_m: Optional[int] = None,
+              keep_vectors: bool = True, candidates_per_probe: int = 10, max_train: int = 50000,
+              seed: int = 0) -> "IVFIndex":
+        """
+        Build an index.
+        Args:
+            ids: Listing ids
+            vectors: (n, d) embeddings
+            nlist: Number of inverted lists, defaults to about sqrt(n)
+            pq_m: Number of PQ sub-quantizers (must divide d), None for IVF-Flat
+            keep_vectors: Keep the float vectors to rescore PQ candidates
+            candidates_per_probe: numCandidates per probed list
+            max_train: Maximum number of vectors used to train the quantizers
+        Returns:
+            IVFIndex: the trained index, in memory
+        """
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        ids = np.asarray(ids)
+        n, d = vectors.shape
+        nlist = nlist or max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(n, min(n, max_train), replace=False)]
+        centroids = kmeans(sample, nlist, seed=seed, spherical=True)
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(centroids)))])
+        vectors, ids = vectors[order], ids[order]
+
+        codebooks, codes = None, None
+        if pq_m:
+            if d % pq_m:
+                raise ValueError(f"pq_m={pq_m} does not divide the dimension {d}")
+            dsub = d // pq_m
+            sub_sample = sample.reshape(len(sample), pq_m, dsub)
+            codebooks = np.stack([kmeans(sub_sample[:, j], 256, seed=seed) for j in range(pq_m)])
+            codes = np.empty((n, pq_m), dtype=np.uint8)
+            sub = vectors.reshape(n, pq_m, dsub)
+            for j in range(pq_m):
+                book = codebooks[j]
+                for start in range(0, n, 10000):
+                    chunk = sub[start:start + 10000, j]
+                    distances = (chunk ** 2).sum(1, keepdims=True) - 2 * chunk @ book.T + (book ** 2).sum(1)
+                    codes[start:start + 10000, j] = np.argmin(distances, axis=1)
+        return cls(ids, vectors if keep_vectors or not pq_m else None, centroids.astype(np.float32), offsets,
+                   codebooks, codes, candidates_per_probe)
+
+    @property
+    def dimensions(self) -> int:
+        return self.centroids.shape[1]
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def bytes_per_vector(self) -> float:
+        """Resident bytes per vector scanned at query time (codes for IVF-PQ, float32 rows for IVF-Flat)."""
+        if self.codes is not None:
+            return float(self.codes.shape[1])
+        return float(self.dimensions * 4)
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, IDS_FILE), self.ids)
+        np.save(os.path.join(directory, "centroids.npy"), self.centroids)
+        np.save(os.path.join(directory, "offsets.npy"), self.offsets)
+        if self.vectors is not None:
+            np.save(os.path.join(directory, VECTORS_FILE), np.asarray(self.vectors))
+        elif os.path.exists(os.path.join(directory, VECTORS_FILE)):
+            os.remove(os.path.join(directory, VECTORS_FILE))
+        if self.codes is not None:
+            np.save(os.path.join(directory, "codebooks.npy"), self.codebooks)
+            np.save(os.path.join(directory, "codes.npy"), self.codes)
+        with open(os.path.join(directory, META_FILE), 'w') as f:
+            json.dump({"type": "ivf", "count": len(self), "dimensions": self.dimensions, "nlist": self.nlist,
+                       "pq_m": None if self.codes is None else int(self.codes.shape[1]),
+                       "candidates_per_probe": self.candidates_per_probe}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "IVFIndex":
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+
+        def optional(name, mode):
+            path = os.path.join(directory, name)
+            return np.load(path, mmap_mode=mode) if os.path.exists(path) else None
+
+        return cls(np.load(os.path.join(directory, IDS_FILE)), optional(VECTORS_FILE, mmap_mode),
+                   np.load(os.path.join(directory, "centroids.npy")), np.load(os.path.join(directory, "offsets.npy")),
+                   optional("codebooks.npy", None), optional("codes.npy", None),
+                   meta.get("candidates_per_probe", 10))
+
+    def nprobe(self, num_candidates: Optional[int]) -> int:
+        if not num_candidates:
+            return self.nlist
+        return int(min(self.nlist, max(1, -(-num_candidates // self.candidates_per_probe))))
+
+    def search(self, query_vector: List[float], limit: int = 10,
+               num_candidates: Optional[int] = None) -> Tuple[List[Any], List[float]]:
+        query = normalize_rows(np.asarray(query_vector, dtype=np.float32))
+        nprobe = self.nprobe(num_candidates)
+        probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.concatenate([np.arange(self.offsets[p], self.offsets[p + 1]) for p in probes])
+        if len(rows) == 0 or limit <= 0:
+            return [], []
+
+        if self.codes is None:
+            similarities = self.vectors[rows] @ query
+        else:
+            m, _, dsub = self.codebooks.shape
+            table = np.einsum('mkd,md->mk', self.codebooks, query.reshape(m, dsub))
+            similarities = table[np.arange(m), self.codes[rows]].sum(axis=1)
+            if self.vectors is not None:
+                shortlist = min(len(rows), max(limit, num_candidates or limit))
+                keep = np.argpartition(-similarities, shortlist - 1)[:shortlist]
+                rows = rows[keep]
+                similarities = self.vectors[rows] @ query
+
+        limit = min(limit, len(rows))
+        top = np.argpartition(-similarities, limit - 1)[:limit]
+        top = top[np.argsort(-similarities[top], kind='stable')]
+        scores = (1 + np.clip(similarities[top], -1, 1)) / 2
+        return self.ids[rows[top]].tolist(), scores.tolist()
+
+
+QUANTIZATIONS = ("int8", "binary")
+# shortlist rescored in full precision without numCandidates, in results: binary codes rank coarsely
+RESCORE_FACTORS = {"int8": 5, "binary": 20}
+SCAN_BLOCK = 256  # int8 rows dequantized at a time, the float32 temporary stays in cache
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def hamming_distances(codes: np.ndarray, query_code: np.ndarray) -> np.ndarray:
+    """Hamming distances between rows of packed bits and one packed query."""
+    if hasattr(np, "bitwise_count") and codes.shape[1] % 8 == 0:
+        # 64 bits at a time
+        return np.bitwise_count(codes.view(np.uint64) ^ query_code.view(np.uint64)).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[codes ^ query_code].sum(axis=1, dtype=np.int32)
+
+
+class QuantizedIndex(LocalVectorIndex):
+    """
+    Exhaustive search over compact codes, with a full-precision rescoring pass.
+
+    Unit vectors are stored as int8 scalar codes (one byte per dimension, with per-dimension
+    symmetric scales) or as binary codes (one bit per dimension, the signs after subtracting
+    the corpus mean). A query first scans every code, with dot products over blocks of
+    dequantized int8 rows or Hamming distances over the packed bits, then rescores a shortlist
+    of `num_candidates` (at least `limit`, `rescore_factor * limit` by default) with the float
+    vectors. Those stay memory-mapped, so only the shortlisted rows are read; without them the
+    scores are estimated from the codes.
+    """
+    def __init__(self, ids: np.ndarray, vectors: Optional[np.ndarray], quantization: str, codes: np.ndarray,
+                 scales: Optional[np.ndarray] = None, center: Optional[np.ndarray] = None,
+                 dimensions: Optional[int] = None, rescore_factor: Optional[int] = None) -> None:
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"unknown quantization {quantization}, expected one of {QUANTIZATIONS}")
+        if len(ids) != len(codes):
+            raise ValueError(f"got {len(ids)} ids for {len(codes)} codes")
+        self.ids = ids
+        self.vectors = vectors
+        self._positions = None
+        self.quantization = quantization
+        self.codes = codes
+        self.scales = scales
+        self.center = center
+        self._dimensions = dimensions or (codes.shape[1] if quantization == "int8" else codes.shape[1] * 8)
+        self.rescore_factor = rescore_factor or RESCORE_FACTORS[quantization]
+
+    @classmethod
+    def build(cls, ids: List[Any], vectors: List[List[float]], quantization: str = "int8",
+              keep_vectors: bool = True) -> "QuantizedIndex":
+        matrix = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        return cls.quantize(np.asarray(ids), np.ascontiguousarray(matrix), quantization, keep_vectors)
+
+    @classmethod
+    def quantize(cls, ids: np.ndarray, vectors: np.ndarray, quantization: str = "int8", keep_vectors: bool = True,
+                 rescore_factor: Optional[int] = None) -> "QuantizedIndex":
+        """
+        Encode unit-normalized vectors, e.g. the memory-mapped rows of an exported exact index.
+        Args:
+            ids: Listing ids
+            vectors: (n, d) unit-normalized embeddings, read in blocks
+            quantization: "int8" or "binary"
+            keep_vectors: Keep the float vectors to rescore the shortlist
+            rescore_factor: Shortlist size per result when no numCandidates is given, defaults to
+                RESCORE_FACTORS of the quantization
+        Returns:
+            QuantizedIndex: the index, in memory apart from the vectors
+        """
+        n, d = vectors.shape
+        blocks = [(start, min(start + SCAN_BLOCK, n)) for start in range(0, n, SCAN_BLOCK)]
+        scales, center = None, None
+        if quantization == "int8":
+            peak = np.zeros(d, dtype=np.float32)
+            for start, end in blocks:
+                peak = np.maximum(peak, np.abs(vectors[start:end]).max(axis=0))
+            scales = (np.where(peak > 0, peak, 1) / 127).astype(np.float32)
+            codes = np.empty((n, d), dtype=np.int8)
+            for start, end in blocks:
+                codes[start:end] = np.clip(np.rint(vectors[start:end] / scales), -127, 127)
+        elif quantization == "binary":
+            center = np.zeros(d, dtype=np.float64)
+            for start, end in blocks:
+                center += vectors[start:end].sum(axis=0, dtype=np.float64)
+            center = (center / max(n, 1)).astype(np.float32)
+            codes = np.empty((n, -(-d // 8)), dtype=np.uint8)
+            for start, end in blocks:
+                codes[start:end] = np.packbits(vectors[start:end] > center, axis=1)
+        else:
+            raise ValueError(f"unknown quantization {quantization}, expected one of {QUANTIZATIONS}")
+        return cls(np.asarray(ids), vectors if keep_vectors else None, quantization, codes, scales, center, d,
+                   rescore_factor)
+
+    @property
+    def dimensions(self) -> int:
+        return self._dimensions
+
+    def bytes_per_vector(self) -> float:
+        """Resident bytes per vector scanned at query time, the codes."""
+        return float(self.codes.shape[1])
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, IDS_FILE), self.ids)
+        vectors_path = os.path.join(directory, VECTORS_FILE)
+        if self.vectors is not None:
+            # quantized in place from an exported index, its vectors file is already there
+            if not (isinstance(self.vectors, np.memmap) and os.path.exists(vectors_path)
+                    and os.path.samefile(self.vectors.filename, vectors_path)):
+                np.save(vectors_path, np.asarray(self.vectors))
+        elif os.path.exists(vectors_path):
+            os.remove(vectors_path)
+        np.save(os.path.join(directory, "codes.npy"), self.codes)
+        if self.scales is not None:
+            np.save(os.path.join(directory, "scales.npy"), self.scales)
+        if self.center is not None:
+            np.save(os.path.join(directory, "center.npy"), self.center)
+        with open(os.path.join(directory, META_FILE), 'w') as f:
+            json.dump({"type": "quantized", "quantization": self.quantization, "count": len(self),
+                       "dimensions": self.dimensions, "rescore_factor": self.rescore_factor}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "QuantizedIndex":
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+
+        def optional(name, mode):
+            path = os.path.join(directory, name)
+            return np.load(path, mmap_mode=mode) if os.path.exists(path) else None
+
+        # every query scans all the codes, so they stay resident; the vectors are only read for rescoring
+        return cls(np.load(os.path.join(directory, IDS_FILE)), optional(VECTORS_FILE, 'r'), meta["quantization"],
+                   np.load(os.path.join(directory, "codes.npy"), mmap_mode='r' if mmap else None),
+                   optional("scales.npy", None), optional("center.npy", None), meta["dimensions"],
+                   meta.get("rescore_factor"))
+
+    def approximate_similarities(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarities of a unit query to every vector, estimated from the codes."""
+        if self.quantization == "int8":
+            scaled = query * self.scales
+            similarities = np.empty(len(self.codes), dtype=np.float32)
+            for start in range(0, len(self.codes), SCAN_BLOCK):
+                end = start + SCAN_BLOCK
+                similarities[start:end] = self.codes[start:end].astype(np.float32) @ scaled
+            return similarities
+        query_code = np.packbits(query > self.center)
+        # the angle between the signs estimates the angle between the (centered) vectors
+        return np.cos(np.pi * hamming_distances(self.codes, query_code) / self.dimensions).astype(np.float32)
+
+    def search(self, query_vector: List[float], limit: int = 10,
+               num_candidates: Optional[int] = None) -> Tuple[List[Any], List[float]]:
+        query = normalize_rows(np.asarray(query_vector, dtype=np.float32))
+        if limit <= 0 or len(self.codes) == 0:
+            return [], []
+        similarities = self.approximate_similarities(query)
+        rows = np.arange(len(similarities))
+        if self.vectors is not None:
+            shortlist = min(len(rows), max(limit, num_candidates or limit * self.rescore_factor))
+            # read the shortlisted rows in file order
+            rows = np.sort(np.argpartition(-similarities, shortlist - 1)[:shortlist])
+            similarities = self.vectors[rows] @ query
+
+        limit = min(limit, len(rows))
+        top = np.argpartition(-similarities, limit - 1)[:limit]
+        top = top[np.argsort(-similarities[top], kind='stable')]
+        scores = (1 + np.clip(similarities[top], -1, 1)) / 2
+        return self.ids[rows[top]].tolist(), scores.tolist()
+
+
+def load_index(directory: str, mmap: bool = True):
+    """Load an index saved by `save`, dispatching on the index type recorded next to it."""
+    with open(os.path.join(directory, META_FILE)) as f:
+        index_type = json.load(f).get("type", "exact")
+    return INDEX_TYPES[index_type].load(directory, mmap=mmap)
+
+
+INDEX_TYPES = {"exact": LocalVectorIndex, "ivf": IVFIndex, "quantized": QuantizedIndex}
+
+
+class LocalVectorBackend():
+    """
+    Serves the `$vectorSearch` stages of aggregation pipelines from local indexes.
+
+    `rewrite` replaces each `$vectorSearch` stage, including those nested in `$unionWith`,
+    with a `$match` on the ids found locally, ordered by rank and carrying the local score,
+    so the rest of the pipeline runs unchanged and returns the same result shape.
+    Indexes are keyed by the embedding path they were built from.
+    """
+    def __init__(self, indexes: Dict[str, Any]) -> None:
+        self.indexes = indexes
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "LocalVectorBackend":
+        indexes = {}
+        for path in sorted(os.listdir(directory)):
+            if os.path.exists(os.path.join(directory, path, META_FILE)):
+                indexes[path] = load_index(os.path.join(directory, path), mmap=mmap)
+        return cls(indexes)
+
+    def search(self, path: str, query_vector: List[float], limit: int,
+               num_candidates: Optional[int] = None) -> Tuple[List[Any], List[float]]:
+        return self.indexes[path].search(query_vector, limit, num_candidates)
+
+    def _vector_search_stages(self, spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+        ids, scores = self.search(spec["path"], spec["queryVector"], spec.get("limit", 10), spec.get("numCandidates"))
+        return [
+            {"$match": {"_id": {"$in": ids}}},
+            {"$addFields": {"_local_rank": {"$indexOfArray": [ids, "$_id"]}}},
+            {"$addFields": {LOCAL_SCORE_FIELD: {"$arrayElemAt": [scores, "$_local_rank"]}}},
+            {"$sort": {"_local_rank": 1}},
+            {"$unset": "_local_rank"},
+        ]
+
+    def _replace_score_meta(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            if value == {"$meta": "vectorSearchScore"}:
+                return f"${LOCAL_SCORE_FIELD}"
+            return {k: self._replace_score_meta(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._replace_score_meta(v) for v in value]
+        return value
+
+    def rewrite(self, pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Get a copy of the pipeline whose vector search stages are answered locally.
+        Args:
+            pipeline: Aggregation pipeline using `$vectorSearch`
+        Returns:
+            Equivalent pipeline without `$vectorSearch`
+        """
+        rewritten = []
+        for stage in pipeline:
+            if "$vectorSearch" in stage and stage["$vectorSearch"]["path"] in self.indexes:
+                rewritten.extend(self._vector_search_stages(stage["$vectorSearch"]))
+            elif "$unionWith" in stage:
+                union = copy.copy(stage["$unionWith"])
+                union["pipeline"] = self.rewrite(union.get("pipeline", []))
+                rewritten.append({"$unionWith": union})
+            else:
+                rewritten.append(self._replace_score_meta(stage))
+        return rewritten
+
+
+def export_vectors(collection, path: str, directory: str, batch_size: int = 1000) -> LocalVectorIndex:
+    """
+    Stream an embedding field out of the collection into a memory-mapped exact index.
+    Args:
+        collection: MongoDB collection
+        path: Embedding field, e.g. description_embedding or image_embeddings
+        directory: Output directory of the index
+    Returns:
+        LocalVectorIndex: the saved index, memory-mapped
+    """
+    query = {path: {"$exists": True, "$type": "array", "$ne": []}}
+    total = collection.count_documents(query)
+    os.makedirs(directory, exist_ok=True)
+    ids, vectors = [], None
+    row = 0
+    for doc in collection.find(query, {path: 1}).batch_size(batch_size):
+        vector = np.asarray(doc[path], dtype=np.float32)
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(os.path.join(directory, VECTORS_FILE), mode='w+',
+                                                dtype=np.float32, shape=(total, len(vector)))
+        if row >= total:
+            break
+        vectors[row] = normalize_rows(vector)
+        ids.append(doc["_id"])
+        row += 1
+    if vectors is None:
+        raise ValueError(f"no documents have the field {path}")
+    vectors.flush()
+    del vectors
+    if row < total:
+        # documents were removed while exporting
+        np.save(os.path.join(directory, VECTORS_FILE), np.load(os.path.join(directory, VECTORS_FILE))[:row])
+    np.save(os.path.join(directory, IDS_FILE), np.asarray(ids))
+    index = LocalVectorIndex.load(directory)
+    with open(os.path.join(directory, META_FILE), 'w') as f:
+        json.dump({"type": "exact", "count": len(index), "dimensions": index.dimensions}, f)
+    return index
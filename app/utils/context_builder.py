@@ -0,0 +1,179 @@
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")  # tokenizer of gpt-4o-mini
+except Exception:  # not installed, or the encoding file cannot be fetched
+    _encoding = None
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 3000))
+MAX_REVIEWS = 3
+REVIEW_TOKENS = 80
+FIELD_TOKENS = 300  # so one long description does not crowd out the reviews
+MIN_FIELD_TOKENS = 12  # below this a truncated field is dropped rather than kept as a stub
+# body fields of a listing, by priority, with their label in the prompt
+BODY_FIELDS = [("summary", "Summary"), ("description", "Description"),
+               ("neighborhood_overview", "Neighborhood"), ("notes", "Notes")]
+WHITESPACE = re.compile(r"\s+")
+SENTENCE_END = re.compile(r"[.!?](?=\s)")
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when available, otherwise estimate ~4 characters per token."""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut a text to at most `max_tokens` tokens, at the last sentence end (or word) of the kept part.
+    """
+    if max_tokens <= 0:
+        return ""
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        cut = _encoding.decode(tokens[:max_tokens - 1])  # one token for the ellipsis
+    else:
+        if len(text) <= max_tokens * 4:
+            return text
+        cut = text[:(max_tokens - 1) * 4]
+    ends = [m.end() for m in SENTENCE_END.finditer(cut + " ")]
+    if ends and ends[-1] > len(cut) // 2:
+        return cut[:ends[-1]] + " …"
+    return cut.rsplit(" ", 1)[0] + "…"
+
+
+def normalize(text: Any) -> str:
+    return WHITESPACE.sub(" ", str(text)).strip() if text else ""
+
+
+def select_reviews(reviews: Optional[List[Dict[str, Any]]], max_reviews: int = MAX_REVIEWS) -> List[str]:
+    """
+    Pick the reviews to quote, deterministically: distinct non-trivial comments, most recent
+    first when reviews are dated, then by decreasing length, ties broken by text.
+    """
+    comments = {}
+    for review in reviews or []:
+        comment = normalize(review.get("comments"))
+        if len(comment) < 20 or comment.lower() in comments:
+            continue
+        comments[comment.lower()] = (str(review.get("date") or ""), comment)
+    ranked = sorted(comments.values(), key=lambda item: (item[0], len(item[1]), item[1]), reverse=True)
+    return [comment for _, comment in ranked[:max_reviews]]
+
+
+def full_content(row) -> str:
+    """The untrimmed context of a listing, with every field and review, to measure the savings."""
+    return f"""
+            Name: {row.name}
+            Description: {row.description}
+            Summary: {row.summary}
+            Neighborhood: {row.neighborhood_overview}
+            Notes: {row.notes}
+            Search Score: {row.search_score}
+            Image URL: {row.images}
+            Reviews: {row.reviews}
+            """
+
+
+class ContextBuilder():
+    """
+    Formats search results into LLM context within a token budget.
+
+    Every listing gets its header (name, score, picture URL). The rest of the budget is split
+    across listings in proportion to their fused search score, and what a listing leaves unused
+    carries over to the next one. Within its share a listing's fields are whitespace-normalized,
+    dropped when contained in another of its fields (e.g. a summary repeated in the description),
+    and cut at sentence boundaries, each to at most `field_tokens`; reviews are reduced to a few distinct recent comments.
+    The output only depends on the input, so it can be cached.
+    """
+    def __init__(self, max_tokens: int = CONTEXT_TOKEN_BUDGET, max_reviews: int = MAX_REVIEWS,
+                 review_tokens: int = REVIEW_TOKENS, field_tokens: int = FIELD_TOKENS) -> None:
+        self.max_tokens = max_tokens
+        self.max_reviews = max_reviews
+        self.review_tokens = review_tokens
+        self.field_tokens = field_tokens
+
+    @staticmethod
+    def _header(row) -> str:
+        score = f"{row.search_score:.4f}" if row.search_score is not None else "n/a"
+        picture = getattr(row.images, "picture_url", "") if row.images is not None else ""
+        return f"Name: {normalize(row.name)}\nSearch Score: {score}\nImage URL: {picture}"
+
+    @staticmethod
+    def _body_fields(row) -> List[Tuple[str, str]]:
+        fields = [(label, normalize(getattr(row, name, None))) for name, label in BODY_FIELDS]
+        fields = [(label, text) for label, text in fields if text]
+        lowered = [text.lower() for _, text in fields]
+        # drop a field repeated inside a longer one (or an exact duplicate after the first)
+        return [(label, text) for i, (label, text) in enumerate(fields)
+                if not any((len(other) > len(lowered[i]) or (other == lowered[i] and j < i)) and lowered[i] in other
+                           for j, other in enumerate(lowered) if j != i)]
+
+    def _render(self, row, header: str, budget: int) -> str:
+        lines, remaining = [header], budget
+        for label, text in self._body_fields(row):
+            if remaining < MIN_FIELD_TOKENS:
+                break
+            # the label, ": " and the newline cost about two tokens more than the label alone
+            line = f"{label}: {truncate_to_tokens(text, min(self.field_tokens, remaining - count_tokens(label) - 2))}"
+            lines.append(line)
+            remaining -= count_tokens(line) + 1
+
+        reviews = select_reviews(row.reviews, self.max_reviews)
+        if reviews and remaining >= MIN_FIELD_TOKENS:
+            remaining -= count_tokens(f"Reviews ({len(reviews)} of {len(row.reviews)}):") + 1
+            quoted = []
+            for review in reviews:
+                if remaining < MIN_FIELD_TOKENS:
+                    break
+                line = f"- {truncate_to_tokens(review, min(self.review_tokens, remaining - 2))}"
+                quoted.append(line)
+                remaining -= count_tokens(line) + 1
+            if quoted:
+                lines.extend([f"Reviews ({len(quoted)} of {len(row.reviews)}):", *quoted])
+        return "\n".join(lines)
+
+    def build(self, search_results_models: List[Any]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """
+        Format search results as context for the LLM within the token budget.
+        Args:
+            search_results_models: Search results (SearchResultItem), best first
+        Returns:
+            Tuple of (list of {'content', 'score'} per listing, report with the tokens of the
+            untrimmed and the built context and the tokens saved)
+        """
+        rows = list(search_results_models)
+        headers = [self._header(row) for row in rows]
+        header_tokens = [count_tokens(header) for header in headers]
+        # keep the best listings whose headers fit
+        while rows and sum(header_tokens) > self.max_tokens:
+            rows, headers, header_tokens = rows[:-1], headers[:-1], header_tokens[:-1]
+
+        scores = [max(row.search_score or 0.0, 0.0) for row in rows]
+        total = sum(scores)
+        if total > 0:
+            weights = [score / total for score in scores]
+        else:
+            weights = [1 / max(len(rows), 1)] * len(rows)
+        body_budget = self.max_tokens - sum(header_tokens)
+
+        context, carry, used = [], 0, 0
+        for row, header, tokens, weight in zip(rows, headers, header_tokens, weights):
+            allowance = int(body_budget * weight) + carry
+            content = self._render(row, header, allowance)
+            content_tokens = count_tokens(content)
+            carry = max(allowance - (content_tokens - tokens), 0)
+            used += content_tokens
+            context.append({'content': content, 'score': row.search_score})
+
+        full = sum(count_tokens(full_content(row)) for row in search_results_models)
+        report = {"listings": len(context), "dropped_listings": len(search_results_models) - len(context),
+                  "budget": self.max_tokens, "full_tokens": full, "context_tokens": used,
+                  "tokens_saved": max(full - used, 0)}
+        return context, report
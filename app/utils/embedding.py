@@ -1,59 +1,83 @@
 import openai
 import os
-from transformers import CLIPProcessor, CLIPModel
-from PIL import Image
-import torch
+import threading
+from utils.embedding_cache import EmbeddingCache
+from utils.embedding_dimensions import TEXT_EMBED_SIZE
+from utils.image_cache import ImageEmbeddingCache
+from utils.image_encoder import get_image_encoder
+from utils.tracing import span
 
 TEXT_EMBED_MODEL = "text-embedding-3-small"
-TEXT_EMBED_SIZE = 1536
 IMG_EMBED_SIZE = 512
 CLIP_MODEL_PATH = "openai/clip-vit-base-patch32"
+CLIP_BACKEND = os.getenv('CLIP_BACKEND', 'fp32') # "int8" to quantize the vision tower, see benchmarks/bench_clip_backends.py
+EMBED_CACHE_PATH = os.getenv('EMBED_CACHE_PATH', '.cache/text_embeddings.sqlite') # empty to keep the cache in memory only
+IMG_EMBED_CACHE_PATH = os.getenv('IMG_EMBED_CACHE_PATH', '.cache/image_embeddings.sqlite') # empty to keep the cache in memory only
 os.environ['CURL_CA_BUNDLE'] = '' # for image encoder correctly being used
 
+_text_embedding_cache = None
+_text_embedding_cache_lock = threading.Lock()
+_img_embedding_cache = None
+_img_embedding_cache_lock = threading.Lock()
+
+
+def embed_texts(texts):
+    with span("text_embedding_api"):
+        response = openai.embeddings.create(input=texts, model=TEXT_EMBED_MODEL, dimensions=TEXT_EMBED_SIZE)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+def get_text_embedding_cache():
+    global _text_embedding_cache
+    with _text_embedding_cache_lock:
+        if _text_embedding_cache is None:
+            _text_embedding_cache = EmbeddingCache(embed_texts, TEXT_EMBED_MODEL, TEXT_EMBED_SIZE, path=EMBED_CACHE_PATH or None)
+        return _text_embedding_cache
+
 
 def get_text_embedding(text):
     if not text or not isinstance(text, str):
         print("text is not a string")
         return None
     try:
-        embedding = openai.embeddings.create(
-            input=text,
-            model=TEXT_EMBED_MODEL, dimensions=TEXT_EMBED_SIZE).data[0].embedding
-        return embedding
+        with span("text_embedding"):
+            return get_text_embedding_cache().get(text)
     except Exception as e:
         print(f"Error in get_text_embedding: {e}")
         return None
 
 
+def encode_images(images):
+    encoder = get_image_encoder(CLIP_MODEL_PATH, CLIP_BACKEND)
+    if len(images) == 1:
+        return [encoder.encode(images[0])]  # shares a batch with concurrent queries
+    return encoder.encode_batch(images)
+
+
+def get_img_embedding_cache():
+    global _img_embedding_cache
+    with _img_embedding_cache_lock:
+        if _img_embedding_cache is None:
+            # the int8 embeddings are close to but not equal to the fp32 ones, cache them apart
+            model = CLIP_MODEL_PATH if CLIP_BACKEND == "fp32" else f"{CLIP_MODEL_PATH}:{CLIP_BACKEND}"
+            _img_embedding_cache = ImageEmbeddingCache(encode_images, model, path=IMG_EMBED_CACHE_PATH or None)
+        return _img_embedding_cache
+
+
 def get_img_embedding(img_path):
-    clip_model = CLIPModel.from_pretrained(CLIP_MODEL_PATH)
-    clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL_PATH, use_fast=True)
     try:
-        import re
-        import requests
-        
-        # Check if img_path is a URL using regex
-        url_pattern = re.compile(
-            r'^https?://'  # http:// or https://
-            r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain...
-            r'localhost|'  # localhost...
-            r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
-            r'(?::\d+)?'  # optional port
-            r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-        
-        print(img_path)
-        if url_pattern.match(img_path):
-            try:
-                image = Image.open(requests.get(img_path, stream=True).raw).convert("RGB")
-            except:
-                image = Image.open("files/error.jpg").convert("RGB")
-        else:
-            image = Image.open(img_path).convert("RGB")
-            
-        inputs = clip_processor(images=image, return_tensors="pt")
-        with torch.no_grad():
-            image_embedding = clip_model.get_image_features(**inputs)
-        return image_embedding.squeeze().numpy().tolist() # in shape (512,)
+        return get_img_embedding_cache().get(img_path)  # in shape (512,)
     except Exception as e:
         print(f"Error in get_img_embedding: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def get_img_embeddings(img_paths):
+    """
+    Embed several images, encoding the uncached ones in one batched CLIP forward pass.
+    Args:
+        img_paths: List of local paths or URLs
+    Returns:
+        List of embeddings of size 512, None for images that failed to load
+    """
+    return get_img_embedding_cache().get_many(img_paths)
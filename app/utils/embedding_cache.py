@@ -0,0 +1,190 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+# relative, as the module is also imported as app.utils.embedding_cache by the database scripts
+from .tracing import metrics
+
+MAX_MEMORY_ENTRIES = 10000
+MAX_DISK_ENTRIES = 1000000
+
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalize the text and collapse runs of whitespace."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache():
+    """
+    Two-tier cache for text embeddings.
+
+    Entries are keyed by (model, dimensions, sha256 of the normalized text). A bounded
+    in-memory LRU sits in front of an optional SQLite store; both tiers evict the least
+    recently used entries once they exceed their capacity. Misses are sent to `embedder`,
+    which takes a list of texts and returns their embeddings in the same order, so the
+    cache can be used offline with a fake provider.
+    """
+    def __init__(self, embedder: Callable[[List[str]], List[List[float]]], model: str, dimensions: int,
+                 path: Optional[str] = None, max_memory_entries: int = MAX_MEMORY_ENTRIES,
+                 max_disk_entries: int = MAX_DISK_ENTRIES) -> None:
+        self.embedder = embedder
+        self.model = model
+        self.dimensions = dimensions
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.RLock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "memory_evictions": 0, "disk_evictions": 0}
+        self._db = None
+        self._disk_entries = 0
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT, dimensions INTEGER, vector BLOB, last_access REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+            self._db.commit()
+            # kept up to date on writes, so eviction does not count the table on each miss
+            self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def key(self, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{self.model}:{self.dimensions}:{digest}"
+
+    def _remember(self, key: str, embedding: List[float]) -> None:
+        # float32 arrays take ~8x less memory than lists of Python floats
+        self._memory[key] = array("f", embedding)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    def _load(self, keys: List[str]) -> Dict[str, List[float]]:
+        if self._db is None or not keys:
+            return {}
+        found = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self._db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            for key, blob in rows:
+                found[key] = array("f", blob).tolist()
+        if found:
+            now = time.time()
+            self._db.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, k) for k in found])
+            self._db.commit()
+        return found
+
+    def _store(self, items: Dict[str, List[float]]) -> None:
+        if self._db is None or not items:
+            return
+        now = time.time()
+        # a key already stored, e.g. by another process since `_load`, holds the same embedding
+        self._disk_entries += self._db.executemany(
+            "INSERT OR IGNORE INTO embeddings (key, model, dimensions, vector, last_access) VALUES (?, ?, ?, ?, ?)",
+            [(k, self.model, self.dimensions, array("f", v).tobytes(), now) for k, v in items.items()]).rowcount
+        excess = self._disk_entries - self.max_disk_entries
+        if excess > 0:
+            evicted = self._db.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+                (excess,)).rowcount
+            self._disk_entries -= evicted
+            self._stats["disk_evictions"] += evicted
+        self._db.commit()
+
+    def get_many(self, texts: List[str]) -> List[List[float]]:
+        """
+        Get the embeddings of several texts, calling the embedder once for all misses.
+        Args:
+            texts: List of texts to embed
+        Returns:
+            List of embeddings, in the same order as `texts`
+        """
+        keys = [self.key(text) for text in texts]
+        results = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    results[key] = self._memory[key].tolist()
+                    self._stats["memory_hits"] += 1
+            pending = list(dict.fromkeys(k for k in keys if k not in results))
+            for key, embedding in self._load(pending).items():
+                self._remember(key, embedding)
+                results[key] = embedding
+                self._stats["disk_hits"] += 1
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in results and key not in missing:
+                missing[key] = text
+        if missing:
+            embeddings = self.embedder(list(missing.values()))
+            fetched = dict(zip(missing.keys(), embeddings))
+            with self._lock:
+                self._stats["misses"] += len(fetched)
+                for key, embedding in fetched.items():
+                    self._remember(key, embedding)
+                self._store(fetched)
+            results.update(fetched)
+        metrics.count("text_embedding_cache_lookups", len(keys) - len(missing), result="hit")
+        metrics.count("text_embedding_cache_lookups", len(missing), result="miss")
+        return [results[key] for key in keys]
+
+    def get(self, text: str) -> List[float]:
+        """
+        Get the embedding of a single text.
+        Args:
+            text: Text to embed
+        Returns:
+            The embedding of the text
+        """
+        return self.get_many([text])[0]
+
+    def invalidate(self, text: str) -> None:
+        """Drop the cached embedding of a text from both tiers."""
+        key = self.key(text)
+        with self._lock:
+            self._memory.pop(key, None)
+            if self._db is not None:
+                self._disk_entries -= self._db.execute("DELETE FROM embeddings WHERE key = ?", (key,)).rowcount
+                self._db.commit()
+
+    def clear(self) -> None:
+        """Drop every cached embedding from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+                self._disk_entries = 0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get hit/miss counters of the cache.
+        Returns:
+            Dict with hit, miss and eviction counts, the tier sizes and the overall hit rate
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = self._disk_entries
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+
+TEXT_EMBED_FULL_SIZE = 1536  # output size of text-embedding-3-small
+TEXT_EMBED_SIZES = (256, 512, 768, 1024, TEXT_EMBED_FULL_SIZE)
+TEXT_EMBED_FIELD_PREFIX = "description_embedding"
+TEXT_VECTOR_INDEX_PREFIX = "vector_index_text"
+# size of the text embeddings searched by the app: a reduced (Matryoshka) size reads the
+# truncated vectors written by database/truncate_embeddings.py, e.g. TEXT_EMBED_SIZE=512
+TEXT_EMBED_SIZE = int(os.getenv('TEXT_EMBED_SIZE', TEXT_EMBED_FULL_SIZE))
+if not 0 < TEXT_EMBED_SIZE <= TEXT_EMBED_FULL_SIZE:
+    raise ValueError(f"TEXT_EMBED_SIZE must be between 1 and {TEXT_EMBED_FULL_SIZE}, got {TEXT_EMBED_SIZE}")
+
+
+def text_embedding_field(size: int = TEXT_EMBED_SIZE) -> str:
+    """Field holding the text embeddings of a size, the full ones in `description_embedding`."""
+    return TEXT_EMBED_FIELD_PREFIX if size == TEXT_EMBED_FULL_SIZE else f"{TEXT_EMBED_FIELD_PREFIX}_{size}"
+
+
+def text_vector_index(size: int = TEXT_EMBED_SIZE) -> str:
+    """Atlas vector index over `text_embedding_field(size)`."""
+    return TEXT_VECTOR_INDEX_PREFIX if size == TEXT_EMBED_FULL_SIZE else f"{TEXT_VECTOR_INDEX_PREFIX}_{size}"
+
+
+def truncate_embeddings(vectors, size: int) -> np.ndarray:
+    """
+    Shorten Matryoshka embeddings: keep the first `size` dimensions and renormalize, which is
+    what the embeddings API returns for `dimensions=size`.
+    Args:
+        vectors: (n, d) or (d,) embeddings, d >= size
+        size: Number of dimensions kept
+    Returns:
+        float32 unit vectors of the same shape but the last dimension
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)[..., :size]
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+TEXT_EMBED_FIELD = text_embedding_field()
+TEXT_VECTOR_INDEX = text_vector_index()
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+MAX_WORKERS = 8
+CACHE_DIR = ".cache/evaluation"
+TOP_KS = [1, 3, 5, 10]
+
+
+class JsonlStore():
+    """
+    Append-only key/value store in a JSONL file, loaded in memory on open.
+
+    Every result is appended as soon as it is produced, so an interrupted run loses at most
+    the calls that were in flight and resumes by skipping the keys already stored.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # a line cut by an interruption
+                    self._data[record["key"]] = record["value"]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._data
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._data.get(key, default)
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({"key": key, "value": value}, default=str) + "\n")
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def hash_key(*parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, default=str, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def run_concurrently(items: Dict[str, Any], func: Callable[[Any], Any], store: JsonlStore,
+                     max_workers: int = MAX_WORKERS) -> Dict[str, Any]:
+    """
+    Apply `func` to the items missing from the store with bounded concurrency, storing each result.
+    Failed items are reported and left out, so the next run retries them.
+    Returns:
+        Dict of key to result, for every item that has one
+    """
+    pending = {key: item for key, item in items.items() if key not in store}
+    if pending:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(func, item): key for key, item in pending.items()}
+            for future in as_completed(futures):
+                try:
+                    store.put(futures[future], future.result())
+                except Exception as e:
+                    print(f"Error in evaluation item {futures[future][:8]}: {e}")
+    return {key: store.get(key) for key in items if key in store}
+
+
+def first_relevant_positions(retrieved: Sequence[Sequence[Any]], relevant: Sequence[Any]) -> np.ndarray:
+    """
+    0-based rank of the relevant id in each query's results, as one vectorized comparison.
+    Args:
+        retrieved: Ranked result ids of each query
+        relevant: The relevant id of each query
+    Returns:
+        np.ndarray of shape (n_queries,), np.inf where the relevant id was not retrieved
+    """
+    depth = max((len(ids) for ids in retrieved), default=0)
+    matrix = np.full((len(retrieved), max(depth, 1)), None, dtype=object)
+    for i, ids in enumerate(retrieved):
+        matrix[i, :len(ids)] = list(ids)
+    hits = matrix == np.asarray(relevant, dtype=object)[:, None]
+    found = hits.any(axis=1)
+    return np.where(found, hits.argmax(axis=1), np.inf)
+
+
+def retrieval_metrics(positions: np.ndarray, ks: Sequence[int] = TOP_KS) -> Dict[str, float]:
+    """
+    Recall@k, MRR and nDCG@k of queries with a single relevant listing each.
+    Args:
+        positions: 0-based rank of the relevant listing of each query, np.inf when missing
+        ks: Cut-offs
+    Returns:
+        Dict of metric name to value averaged over the queries
+    """
+    positions = np.asarray(positions, dtype=float)
+    metrics = {"queries": float(len(positions))}
+    if len(positions) == 0:
+        return metrics
+    found = np.isfinite(positions)
+    metrics["mrr"] = float(np.where(found, 1 / (np.where(found, positions, 0) + 1), 0).mean())
+    for k in ks:
+        in_top_k = positions < k
+        metrics[f"recall@{k}"] = float(in_top_k.mean())
+        # one relevant item: the ideal DCG is 1
+        metrics[f"ndcg@{k}"] = float(np.where(in_top_k, 1 / np.log2(np.where(in_top_k, positions, 0) + 2), 0).mean())
+    return metrics
+
+
+class EvaluationRunner():
+    """
+    Generates evaluation queries and runs retrieval configurations over them, concurrently,
+    with every LLM output and every retrieval result cached on disk under `cache_dir`.
+    Re-running after an interruption, or sweeping a new configuration, only pays for the
+    missing calls.
+    """
+    def __init__(self, generate_query: Callable[[Dict[str, Any]], str], generator_name: str,
+                 cache_dir: str = CACHE_DIR, max_workers: int = MAX_WORKERS) -> None:
+        self.generate_query = generate_query
+        self.generator_name = generator_name
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.queries = JsonlStore(os.path.join(cache_dir, "queries.jsonl"))
+
+    def generate_queries(self, properties: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Generate a query for each property, like `evaluation.generate_queries`.
+        Returns:
+            The properties that have a query, with their `generated_query`
+        """
+        items = {hash_key(self.generator_name, p['id'], p['description']): p for p in properties}
+        generated = run_concurrently(items, self.generate_query, self.queries, self.max_workers)
+        return [{**p, 'generated_query': generated[key]} for key, p in items.items() if key in generated]
+
+    def retrieve(self, config_name: str, search: Callable[[str], List[Any]], queries: List[Dict[str, Any]],
+                 params: Optional[Dict[str, Any]] = None) -> List[List[Any]]:
+        """
+        Run one retrieval configuration over the queries.
+        Args:
+            config_name: Name of the configuration, part of the cache path
+            search: Function from query text to ranked result ids
+            queries: Output of `generate_queries`
+            params: Parameters of the configuration, part of the cache key, so results cached
+                before a configuration changed under the same name are not reused. Without them
+                a changed configuration needs a new name.
+        Returns:
+            Ranked result ids of each query, empty for queries whose search failed
+        """
+        store = JsonlStore(os.path.join(self.cache_dir, f"retrieval_{config_name}.jsonl"))
+        items = {hash_key(q['generated_query'], params): q['generated_query'] for q in queries}
+        results = run_concurrently(items, search, store, self.max_workers)
+        return [results.get(hash_key(q['generated_query'], params), []) for q in queries]
+
+    def evaluate(self, configs: Dict[str, Callable[[str], List[Any]]], properties: List[Dict[str, Any]],
+                 ks: Sequence[int] = TOP_KS) -> Dict[str, Dict[str, float]]:
+        """
+        Sweep retrieval configurations over the queries generated for the properties.
+        Args:
+            configs: Configuration name to search function (query text -> ranked result ids); the
+                `params` attribute of a search function, if any, is passed to `retrieve`
+            properties: Properties with 'id' and 'description', e.g. from `get_random_properties`
+            ks: Cut-offs of recall@k and nDCG@k
+        Returns:
+            Configuration name to its metrics
+        """
+        queries = self.generate_queries(properties)
+        relevant = [q['id'] for q in queries]
+        metrics = {}
+        for name, search in configs.items():
+            retrieved = self.retrieve(name, search, queries, getattr(search, "params", None))
+            metrics[name] = retrieval_metrics(first_relevant_positions(retrieved, relevant), ks)
+        return metrics
+
+
+def result_ids(search_results) -> List[Any]:
+    """Ranked ids of the documents returned by a search class's `do_search`."""
+    return [doc['_id'] for doc in search_results]
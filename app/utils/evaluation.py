@@ -2,11 +2,14 @@ import sys
 import os
 from transformers import BlipProcessor, BlipForConditionalGeneration
 from PIL import Image
-from typing import List, Dict, Any, Tuple
+from typing import Callable, List, Dict, Any, Optional, Sequence, Tuple
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
-import random
 from app.utils.mongodb import get_collection
+from app.utils.embedding_dimensions import TEXT_EMBED_FIELD
+from app.utils.eval_runner import (EvaluationRunner, CACHE_DIR, MAX_WORKERS, TOP_KS, first_relevant_positions,
+                                   result_ids)
+from app.utils.sampler import sample_listings
 import numpy as np
 import requests
 
@@ -21,25 +24,28 @@ user_llm = ChatOpenAI(model="gpt-4.1-nano", temperature=0.5)
 rag_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
 
 
-def get_random_properties(num_properties: int = 20) -> Tuple[List[Dict[str, Any]], List[int]]:
+def get_random_properties(num_properties: int = 20, seed: Optional[int] = None,
+                          stratify_by: Sequence[str] = ()) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """
+    Sample properties for evaluation.
+    Args:
+        num_properties: Number of properties
+        seed: Seed of the sample, to rebuild the same evaluation set
+        stratify_by: Strata keys among "market", "property_type" and "has_image"
+    Returns:
+        Tuple of (properties, their ids)
+    """
     collection = get_collection()
-    
-    # Get total count of documents
-    total_docs = collection.count_documents({})
-    
-    # Generate random indices
-    random_indices = random.sample(range(total_docs), min(num_properties, total_docs))
-    
-    # Get random documents
+    docs = sample_listings(collection, num_properties, seed=seed, stratify_by=stratify_by)
+
     properties = []
     ids = []
-    for idx in random_indices:
-        doc = collection.find().skip(idx).limit(1).next()
+    for doc in docs:
         properties.append({
             'id': doc.get('_id', ''),
             'name': doc.get('name', ''),
             'description': doc.get('description', ''),
-            'image_url': doc.get('images').get('picture_url'),
+            'image_url': (doc.get('images') or {}).get('picture_url'),
         })
         ids.append(doc.get('_id', ''))
     return properties, ids
@@ -65,16 +71,60 @@ def generate_query_for_property(property_info: Dict[str, str]) -> str:
     return response.content.strip()
 
 
-def generate_queries(properties: List[Dict[str, str]]) -> List[Dict[str, str]]:     
-    # Generate queries for each property
+def get_evaluation_runner(generate_query: Callable[[Dict[str, Any]], str] = generate_query_for_property,
+                          generator_name: Optional[str] = None, max_workers: int = MAX_WORKERS,
+                          cache_dir: str = CACHE_DIR) -> EvaluationRunner:
+    """
+    Runner generating the evaluation queries and running the searches over them, concurrently and
+    cached on disk (see eval_runner).
+    Args:
+        generate_query: Function from property to query text
+        generator_name: Name of the query generator, part of the cache key. Defaults to the LLM model name.
+    """
+    return EvaluationRunner(generate_query, generator_name or user_llm.model_name, cache_dir, max_workers)
+
+
+def search_ids(searcher, **kwargs) -> Callable[[str], List[Any]]:
+    """
+    Search function of a configuration: query text -> ranked ids returned by `searcher.do_search`.
+
+    Its `params`, the searcher class with its scalar settings (e.g. alpha_vector), the keyword
+    arguments and the text embedding field, key the cached results of the configuration.
+    """
+    def search(query_text):
+        return result_ids(searcher.do_search(query_text, **kwargs))
+
+    settings = {k: v for k, v in vars(searcher).items() if isinstance(v, (bool, int, float, str, type(None)))}
+    search.params = {"searcher": type(searcher).__name__, **settings, **kwargs, "text_embedding_field": TEXT_EMBED_FIELD}
+    return search
+
+
+def evaluate_configs(configs: Dict[str, Callable[[str], List[Any]]], properties: List[Dict[str, Any]],
+                     ks: Sequence[int] = TOP_KS, runner: Optional[EvaluationRunner] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Sweep retrieval configurations over the queries generated for the properties.
+    Args:
+        configs: Configuration name to search function, e.g. {"hybrid": search_ids(HybridSearch(collection))}
+        properties: Properties with 'id' and 'description', e.g. from `get_random_properties`
+        ks: Cut-offs of recall@k and nDCG@k
+        runner: Runner of the queries and searches. Defaults to `get_evaluation_runner()`.
+    Returns:
+        Configuration name to its metrics (recall@k, MRR, nDCG@k)
+    """
+    return (runner or get_evaluation_runner()).evaluate(configs, properties, ks)
+
+
+def generate_queries(properties: List[Dict[str, str]], max_workers: int = MAX_WORKERS,
+                     cache_dir: str = CACHE_DIR) -> List[Dict[str, str]]:
+    # Generate queries for each property, concurrently and cached on disk (see eval_runner)
+    runner = get_evaluation_runner(max_workers=max_workers, cache_dir=cache_dir)
     results = []
-    for property_info in properties:
-        query = generate_query_for_property(property_info)
+    for property_info in runner.generate_queries(properties):
         results.append({
             'id': property_info['id'],
             'name': property_info['name'],
             'description': property_info['description'],
-            'generated_query': query,
+            'generated_query': property_info['generated_query'],
             'image_url': property_info['image_url']
         })
     return results
@@ -100,27 +150,36 @@ def generate_response(query, context):
     return rag_llm(formatted_messages)  
 
 
-def check_top_k_positions(arr: np.ndarray, value: int, positions: list[int] = [1, 3, 5, 10]) -> np.ndarray:
+def top_k_hits(retrieved: Sequence[Sequence[Any]], relevant: Sequence[Any],
+               positions: Sequence[int] = TOP_KS) -> np.ndarray:
+    """
+    Check for every query at once if its relevant id is in the top k of its results.
+
+    Args:
+        retrieved: Ranked result ids of each query
+        relevant: The relevant id of each query
+        positions: List of k positions to check
+
+    Returns:
+        np.ndarray: Binary array of shape (n_queries, len(positions))
+    """
+    ranks = first_relevant_positions(retrieved, relevant)
+    return (ranks[:, None] < np.asarray(positions)[None, :]).astype(int)
+
+
+def check_top_k_positions(arr: Sequence[Any], value: Any, positions: list[int] = TOP_KS) -> np.ndarray:
     """
     Check if a value is in the top k positions of an array.
     
     Args:
-        arr: Input array to search in
+        arr: Ranked ids to search in
         value: Value to search for
         positions: List of k positions to check
         
     Returns:
         np.ndarray: Binary array indicating if value is in top k positions
     """
-    results = []
-    try:
-        index = arr.index(value)
-        for pos in positions:
-            results.append(1 if index < pos else 0)
-    except ValueError:
-        results = [0] * len(positions)
-    
-    return np.array(results)
+    return top_k_hits([arr], [value], positions)[0]
 
 
 class Gen_MultimodalEvlDataset:
@@ -0,0 +1,283 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+from utils.image_fetcher import ImageFetcher, ImageFetchError, decode_image, is_url
+from utils.logger import LOG
+from utils.tracing import metrics, span
+
+ERROR_IMAGE_PATH = "files/error.jpg"  # embedded instead of images that cannot be fetched
+MAX_MEMORY_ENTRIES = 5000
+MAX_DISK_ENTRIES = 200000
+URL_TTL = 7 * 24 * 3600  # seconds before the bytes behind a cached URL are fetched again
+
+
+class ImageEmbeddingCache():
+    """
+    Two-tier cache for image embeddings, keyed by content.
+
+    Embeddings are keyed by (model, sha256 of the image bytes), so a photo reachable under
+    several URLs, or uploaded twice, is encoded once. On top of it a URL index maps remote
+    images to the digest of their bytes, so a repeated URL is answered without network I/O;
+    a URL is fetched again after `url_ttl` seconds. Both sit in a bounded in-memory LRU in
+    front of an optional SQLite store, each tier evicting the least recently used entries.
+    Images that cannot be fetched are replaced by `error_image_path`, without indexing their
+    URL so they are retried. Misses are decoded and sent to `encoder`, which takes a list of
+    PIL images and returns their embeddings in the same order.
+    """
+    def __init__(self, encoder: Callable[[List[Image.Image]], List[List[float]]], model: str,
+                 path: Optional[str] = None, fetcher: Optional[ImageFetcher] = None,
+                 max_memory_entries: int = MAX_MEMORY_ENTRIES, max_disk_entries: int = MAX_DISK_ENTRIES,
+                 url_ttl: float = URL_TTL, error_image_path: str = ERROR_IMAGE_PATH) -> None:
+        self.encoder = encoder
+        self.model = model
+        self.path = path
+        self.fetcher = fetcher or ImageFetcher()
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.url_ttl = url_ttl
+        self.error_image_path = error_image_path
+        self._memory = OrderedDict()  # content key -> embedding
+        self._urls = OrderedDict()  # url -> (content key, fetch time)
+        self._lock = threading.RLock()
+        self._stats = {"url_hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "fetches": 0,
+                       "fetch_errors": 0, "bytes_fetched": 0, "memory_evictions": 0, "disk_evictions": 0}
+        self._db = None
+        self._disk_entries = 0
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, vector BLOB, last_access REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, key TEXT, fetched_at REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS urls_key ON urls (key)")
+            self._db.commit()
+            # kept up to date on writes, so eviction does not count the table on each miss
+            self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def key(self, data: bytes) -> str:
+        return f"{self.model}:{hashlib.sha256(data).hexdigest()}"
+
+    def _remember(self, key: str, embedding: List[float]) -> None:
+        self._memory[key] = array("f", embedding)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    def _remember_url(self, url: str, key: str, fetched_at: float) -> None:
+        self._urls[url] = (key, fetched_at)
+        self._urls.move_to_end(url)
+        while len(self._urls) > self.max_memory_entries:
+            self._urls.popitem(last=False)
+
+    def _lookup_url(self, url: str, now: float) -> Optional[str]:
+        entry = self._urls.get(url)
+        if entry is None and self._db is not None:
+            entry = self._db.execute("SELECT key, fetched_at FROM urls WHERE url = ?", (url,)).fetchone()
+            if entry is not None:
+                self._remember_url(url, *entry)
+        if entry is None or now - entry[1] > self.url_ttl:
+            return None
+        self._urls.move_to_end(url)
+        return entry[0]
+
+    def _lookup(self, key: str) -> Optional[List[float]]:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return self._memory[key].tolist()
+        if self._db is not None:
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE embeddings SET last_access = ? WHERE key = ?", (time.time(), key))
+                self._db.commit()
+                embedding = array("f", row[0]).tolist()
+                self._remember(key, embedding)
+                self._stats["disk_hits"] += 1
+                return embedding
+        return None
+
+    def _store(self, items: Dict[str, List[float]], urls: Dict[str, Tuple[str, float]]) -> None:
+        if self._db is None or not (items or urls):
+            return
+        now = time.time()
+        # a key already stored, e.g. by another process since `_lookup`, holds the same embedding
+        self._disk_entries += self._db.executemany(
+            "INSERT OR IGNORE INTO embeddings (key, model, vector, last_access) VALUES (?, ?, ?, ?)",
+            [(k, self.model, array("f", v).tobytes(), now) for k, v in items.items()]).rowcount
+        self._db.executemany("INSERT OR REPLACE INTO urls (url, key, fetched_at) VALUES (?, ?, ?)",
+                             [(url, key, fetched_at) for url, (key, fetched_at) in urls.items()])
+        excess = self._disk_entries - self.max_disk_entries
+        if excess > 0:
+            evicted = [row[0] for row in self._db.execute(
+                "SELECT key FROM embeddings ORDER BY last_access LIMIT ?", (excess,))]
+            for i in range(0, len(evicted), 500):
+                chunk = evicted[i:i + 500]
+                marks = ','.join('?' * len(chunk))
+                deleted = self._db.execute(f"DELETE FROM embeddings WHERE key IN ({marks})", chunk).rowcount
+                self._db.execute(f"DELETE FROM urls WHERE key IN ({marks})", chunk)
+                self._disk_entries -= deleted
+                self._stats["disk_evictions"] += deleted
+        self._db.commit()
+
+    def _error_image(self) -> bytes:
+        with open(self.error_image_path, "rb") as f:
+            return f.read()
+
+    def _read(self, img_path: str) -> Tuple[bytes, bool]:
+        # the bytes of the image, and whether they are those of the URL, so the URL can be indexed
+        if not is_url(img_path):
+            with open(img_path, "rb") as f:
+                return f.read(), False
+        try:
+            data = self.fetcher.fetch(img_path)
+        except ImageFetchError as e:
+            LOG.warning(f"image fetch failed, using {self.error_image_path}: {e}")
+            with self._lock:
+                self._stats["fetch_errors"] += 1
+            return self._error_image(), False
+        with self._lock:
+            self._stats["fetches"] += 1
+            self._stats["bytes_fetched"] += len(data)
+        return data, True
+
+    def get_many(self, img_paths: List[str]) -> List[Optional[List[float]]]:
+        """
+        Get the embeddings of several images, encoding all misses in one batch.
+        Args:
+            img_paths: List of local paths or URLs
+        Returns:
+            List of embeddings, in the same order as `img_paths`, None for local images that
+            failed to load
+        """
+        embeddings = [None] * len(img_paths)
+        now = time.time()
+        with self._lock:
+            for i, img_path in enumerate(img_paths):
+                if is_url(img_path):
+                    key = self._lookup_url(img_path, now)
+                    embedding = self._lookup(key) if key is not None else None
+                    if embedding is not None:
+                        embeddings[i] = embedding
+                        self._stats["url_hits"] += 1
+
+        keys, contents, urls = {}, {}, {}
+        with span("image_load"):
+            for i, img_path in enumerate(img_paths):
+                if embeddings[i] is not None:
+                    continue
+                try:
+                    data, indexable = self._read(img_path)
+                except Exception as e:
+                    LOG.warning(f"Error in loading image {img_path}: {e}")
+                    continue
+                keys[i] = self.key(data)
+                contents.setdefault(keys[i], data)
+                if indexable:
+                    urls[img_path] = (keys[i], now)
+
+        with self._lock:
+            found = {}
+            for key in dict.fromkeys(keys.values()):
+                embedding = self._lookup(key)
+                if embedding is not None:
+                    found[key] = embedding
+
+        images = {}
+        for key, data in contents.items():
+            if key in found:
+                continue
+            try:
+                images[key] = decode_image(data)
+            except Exception as e:
+                # e.g. an HTML error page served with a 200, embed the error image instead
+                LOG.warning(f"Error in decoding image: {e}")
+                error_data = self._error_image()
+                error_key = self.key(error_data)
+                for i, k in list(keys.items()):
+                    if k == key:
+                        keys[i] = error_key
+                for url, (k, _) in list(urls.items()):
+                    if k == key:
+                        del urls[url]
+                if error_key not in found and error_key not in images:
+                    with self._lock:
+                        embedding = self._lookup(error_key)
+                    if embedding is not None:
+                        found[error_key] = embedding
+                    else:
+                        images[error_key] = decode_image(error_data)
+
+        encoded = {}
+        if images:
+            with span("image_embedding"):
+                encoded = dict(zip(images.keys(), self.encoder(list(images.values()))))
+        found.update(encoded)
+
+        with self._lock:
+            self._stats["misses"] += len(encoded)
+            for key, embedding in encoded.items():
+                self._remember(key, embedding)
+            for url, (key, fetched_at) in urls.items():
+                self._remember_url(url, key, fetched_at)
+            self._store(encoded, urls)
+        for i, key in keys.items():
+            embeddings[i] = found[key]
+        metrics.count("image_embedding_cache_lookups", sum(e is not None for e in embeddings) - len(encoded),
+                      result="hit")
+        metrics.count("image_embedding_cache_lookups", len(encoded), result="miss")
+        return embeddings
+
+    def get(self, img_path: str) -> Optional[List[float]]:
+        """
+        Get the embedding of a single image.
+        Args:
+            img_path: Local path or URL of the image
+        Returns:
+            The embedding of the image, None if a local image failed to load
+        """
+        return self.get_many([img_path])[0]
+
+    def clear(self) -> None:
+        """Drop every cached embedding and URL from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            self._urls.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.execute("DELETE FROM urls")
+                self._db.commit()
+                self._disk_entries = 0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get hit/miss counters of the cache.
+        Returns:
+            Dict with memory and disk hits (`url_hits` of them answered without fetching),
+            misses (CLIP inferences), fetches, fetch errors, evictions, the tier sizes and the
+            overall hit rate
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_urls"] = len(self._urls)
+            stats["disk_entries"] = self._disk_entries
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
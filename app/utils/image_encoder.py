@@ -0,0 +1,168 @@
+import threading
+import queue
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+
+import torch
+from PIL import Image
+from transformers import CLIPProcessor, CLIPModel
+
+DEFAULT_CLIP_MODEL_PATH = "openai/clip-vit-base-patch32"
+MAX_BATCH_SIZE = 8
+MAX_WAIT_MS = 10
+# "fp32" runs the model as released, "int8" with the vision tower dynamically quantized
+BACKENDS = ("fp32", "int8")
+
+
+def quantize_vision_tower(model: CLIPModel) -> CLIPModel:
+    """
+    Dynamic int8 quantization of the Linear layers of the vision tower and projection: weights
+    are stored in int8 and activations quantized on the fly, so the attention and MLP matmuls,
+    most of the ViT's CPU time, run on int8 kernels (fbgemm on x86, qnnpack on ARM). The text
+    tower is not used to embed images and is left as is.
+    """
+    qconfig = torch.ao.quantization.default_dynamic_qconfig
+    return torch.ao.quantization.quantize_dynamic(
+        model, {"vision_model": qconfig, "visual_projection": qconfig}, dtype=torch.qint8)
+
+
+class ImageEncoder():
+    """
+    Resident CLIP image encoder.
+
+    The model and processor are loaded once and kept warm. Calls to `encode` from
+    several threads are queued and a single worker thread groups them into batches
+    of at most `max_batch_size` images, waiting no longer than `max_wait_ms` for a
+    batch to fill before running inference. `backend` selects the fp32 model or its
+    int8-quantized vision tower. The torch intra-op threads are a process-wide setting, left to
+    the entry points (`torch.set_num_threads`).
+    """
+    def __init__(self, model_path: str = DEFAULT_CLIP_MODEL_PATH, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait_ms: float = MAX_WAIT_MS, backend: str = "fp32") -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown CLIP backend {backend!r}, expected one of {BACKENDS}")
+        self.model_path = model_path
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._model = None
+        self._processor = None
+        self._load_lock = threading.Lock()
+        self._infer_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+
+    def load(self) -> None:
+        """Load the CLIP model and processor if they are not loaded yet."""
+        with self._load_lock:
+            if self._model is not None:
+                return
+            model = CLIPModel.from_pretrained(self.model_path)
+            model.eval()
+            if self.backend == "int8":
+                model = quantize_vision_tower(model)
+            self._processor = CLIPProcessor.from_pretrained(self.model_path, use_fast=True)
+            self._model = model
+
+    def _ensure_worker(self) -> None:
+        with self._load_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="clip-image-encoder", daemon=True)
+                self._worker.start()
+
+    def _infer(self, images: List[Image.Image]) -> List[List[float]]:
+        self.load()
+        inputs = self._processor(images=images, return_tensors="pt")
+        with self._infer_lock, torch.no_grad():
+            features = self._model.get_image_features(**inputs)
+        return features.numpy().tolist()  # in shape (n, 512)
+
+    def _collect_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            images = [image for image, _ in batch]
+            try:
+                embeddings = self._infer(images)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    def submit(self, image: Image.Image) -> Future:
+        """Queue one image for encoding and return a future holding its embedding."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def encode(self, image: Image.Image, timeout: Optional[float] = None) -> List[float]:
+        """
+        Encode a single image, sharing a batch with concurrent callers.
+        Args:
+            image: RGB PIL image
+            timeout: Seconds to wait for the result, None to wait forever
+        Returns:
+            Image embedding of size 512
+        """
+        return self.submit(image).result(timeout=timeout)
+
+    def encode_batch(self, images: List[Image.Image]) -> List[List[float]]:
+        """
+        Encode a list of images in chunks of `max_batch_size`, bypassing the queue.
+        Args:
+            images: List of RGB PIL images
+        Returns:
+            List of image embeddings, in the same order as `images`
+        """
+        embeddings = []
+        for i in range(0, len(images), self.max_batch_size):
+            embeddings.extend(self._infer(images[i:i + self.max_batch_size]))
+        return embeddings
+
+    def encode_pixel_values(self, pixel_values) -> List[List[float]]:
+        """
+        Encode images already preprocessed by the CLIP processor, e.g. in worker processes.
+        Args:
+            pixel_values: Array of shape (n, 3, 224, 224)
+        Returns:
+            List of image embeddings, in the same order
+        """
+        self.load()
+        with self._infer_lock, torch.no_grad():
+            features = self._model.get_image_features(pixel_values=torch.as_tensor(pixel_values))
+        return features.numpy().tolist()  # in shape (n, 512)
+
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def get_image_encoder(model_path: str = DEFAULT_CLIP_MODEL_PATH, backend: str = "fp32") -> ImageEncoder:
+    """
+    Get the process-wide encoder for a model path and backend, creating it on first use.
+    Args:
+        model_path: Hugging Face id or local path of the CLIP model
+        backend: One of BACKENDS
+    Returns:
+        ImageEncoder: the shared encoder
+    """
+    with _encoders_lock:
+        if (model_path, backend) not in _encoders:
+            _encoders[(model_path, backend)] = ImageEncoder(model_path, backend=backend)
+        return _encoders[(model_path, backend)]
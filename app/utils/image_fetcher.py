@@ -0,0 +1,81 @@
+import io
+import re
+import time
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+CONNECT_TIMEOUT = 3.05  # seconds
+READ_TIMEOUT = 10  # seconds, for the whole download
+POOL_SIZE = 16
+
+# Check if img_path is a URL using regex
+URL_PATTERN = re.compile(
+    r'^https?://'  # http:// or https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain...
+    r'localhost|'  # localhost...
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
+    r'(?::\d+)?'  # optional port
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
+
+def is_url(img_path: str) -> bool:
+    return bool(URL_PATTERN.match(img_path))
+
+
+def decode_image(data: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(data)).convert("RGB")
+
+
+class ImageFetchError(Exception):
+    pass
+
+
+class ImageFetcher():
+    """
+    HTTP client for remote images: keep-alive connections pooled per host, retries with backoff
+    on connection errors and 429/5xx responses, a connect timeout, a deadline for the whole
+    download and a limit on its size.
+    """
+    def __init__(self, pool_size: int = POOL_SIZE, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT, max_bytes: int = MAX_IMAGE_BYTES, retries: int = 2) -> None:
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_bytes = max_bytes
+        retry = Retry(total=retries, backoff_factor=0.2, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, url: str) -> bytes:
+        """
+        Download an image.
+        Args:
+            url: URL of the image
+        Returns:
+            The bytes of the image
+        Raises:
+            ImageFetchError: on network errors, error statuses, timeouts and oversized images
+        """
+        deadline = time.monotonic() + self.read_timeout
+        try:
+            with self.session.get(url, stream=True, timeout=(self.connect_timeout, self.read_timeout)) as response:
+                response.raise_for_status()
+                if int(response.headers.get("Content-Length") or 0) > self.max_bytes:
+                    raise ImageFetchError(f"{url}: larger than {self.max_bytes} bytes")
+                chunks, size = [], 0
+                for chunk in response.iter_content(64 * 1024):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ImageFetchError(f"{url}: larger than {self.max_bytes} bytes")
+                    if time.monotonic() > deadline:
+                        raise ImageFetchError(f"{url}: download took more than {self.read_timeout}s")
+                    chunks.append(chunk)
+                return b"".join(chunks)
+        except requests.RequestException as e:
+            raise ImageFetchError(f"{url}: {e}") from e
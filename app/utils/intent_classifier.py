@@ -0,0 +1,116 @@
+import json
+import re
+import zlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+INTENT_EXAMPLES_PATH = "files/intent_examples.jsonl"
+N_FEATURES = 2 ** 14
+CONFIDENCE = 0.9  # probability of the predicted class below which the LLM decides
+L2 = 1e-4
+EPOCHS = 300
+LEARNING_RATE = 8.0
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def lexical_features(texts: Sequence[str], n_features: int = N_FEATURES) -> np.ndarray:
+    """
+    Hashed bag of word unigrams, word bigrams and character trigrams, L2-normalized.
+
+    Character trigrams within words carry the signal across inflections and languages
+    ("appartement", "apartamento"), the bigrams short phrases ("looking for", "near the").
+    Features are hashed with crc32, stable across processes unlike `hash`.
+    Args:
+        texts: Query texts
+        n_features: Size of the hashed feature space
+    Returns:
+        np.ndarray of shape (len(texts), n_features)
+    """
+    matrix = np.zeros((len(texts), n_features), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = WORD_PATTERN.findall((text or "").lower())
+        tokens = [f"w:{w}" for w in words] + [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            tokens.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+        for token in tokens:
+            matrix[row, zlib.crc32(token.encode()) % n_features] += 1
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def load_examples(path: str = INTENT_EXAMPLES_PATH) -> Tuple[List[str], List[bool]]:
+    """Read labelled queries from a JSONL file of {"text": ..., "label": true|false} records."""
+    texts, labels = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                texts.append(record["text"])
+                labels.append(bool(record["label"]))
+    return texts, labels
+
+
+class IntentClassifier():
+    """
+    Local classifier of whether a query asks for property recommendations.
+
+    A logistic regression over `lexical_features`, trained in milliseconds on a few hundred
+    labelled queries. `classify` returns None when the probability of the predicted class is
+    below `confidence`, leaving the query to the LLM classifier.
+    """
+    def __init__(self, n_features: int = N_FEATURES, confidence: float = CONFIDENCE, l2: float = L2,
+                 epochs: int = EPOCHS, learning_rate: float = LEARNING_RATE) -> None:
+        self.n_features = n_features
+        self.confidence = confidence
+        self.l2 = l2
+        self.epochs = epochs
+        self.learning_rate = learning_rate
+        self.weights = np.zeros(n_features, dtype=np.float32)
+        self.bias = 0.0
+
+    @classmethod
+    def from_examples(cls, path: str = INTENT_EXAMPLES_PATH, **kwargs) -> "IntentClassifier":
+        texts, labels = load_examples(path)
+        return cls(**kwargs).fit(texts, labels)
+
+    def fit(self, texts: Sequence[str], labels: Sequence[bool]) -> "IntentClassifier":
+        """
+        Train with full-batch gradient descent on the L2-regularized log loss.
+        Args:
+            texts: Query texts
+            labels: True for property recommendation queries
+        Returns:
+            self
+        """
+        features = lexical_features(texts, self.n_features)
+        targets = np.asarray(labels, dtype=np.float32)
+        # balance the classes, so the decision threshold stays at 0.5
+        positives = max(targets.mean(), 1e-6)
+        sample_weights = np.where(targets == 1, 0.5 / positives, 0.5 / max(1 - positives, 1e-6)) / len(targets)
+        weights, bias = np.zeros(self.n_features, dtype=np.float32), 0.0
+        for _ in range(self.epochs):
+            errors = (1 / (1 + np.exp(-(features @ weights + bias))) - targets) * sample_weights
+            weights -= self.learning_rate * (features.T @ errors + self.l2 * weights)
+            bias -= self.learning_rate * float(errors.sum())
+        self.weights, self.bias = weights.astype(np.float32), bias
+        return self
+
+    def predict_proba(self, texts: Sequence[str]) -> np.ndarray:
+        """Probability that each query asks for property recommendations."""
+        return 1 / (1 + np.exp(-(lexical_features(texts, self.n_features) @ self.weights + self.bias)))
+
+    def classify(self, text: str) -> Optional[bool]:
+        """
+        Classify one query.
+        Args:
+            text: Query text
+        Returns:
+            True or False when confident, None to defer to the LLM
+        """
+        probability = float(self.predict_proba([text])[0])
+        if max(probability, 1 - probability) < self.confidence:
+            return None
+        return probability >= 0.5
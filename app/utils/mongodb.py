@@ -1,9 +1,166 @@
 import os
-from pymongo import MongoClient
-
-def get_collection():
-    uri = os.getenv('MONGODB_URI')
-    client = MongoClient(uri)
-    db_name = 'airbnb_dataset'  # Change this to your actual database name
-    collection_name = 'airbnb_embeddings'  # Change this to your actual collection name
-    return client[db_name][collection_name]
\ No newline at end of file
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Optional
+from pymongo import MongoClient, monitoring
+
+DB_NAME = 'airbnb_dataset'  # Change this to your actual database name
+COLLECTION_NAME = 'airbnb_embeddings'  # Change this to your actual collection name
+
+# client options, overridable from the environment
+MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', 50))
+MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', 0))
+CONNECT_TIMEOUT_MS = int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', 10000))
+SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 10000))
+SOCKET_TIMEOUT_MS = int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS', 60000))
+READ_PREFERENCE = os.getenv('MONGODB_READ_PREFERENCE', 'primary')  # the driver default, e.g. primaryPreferred to also read from secondaries
+
+
+class _ClientStats(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+    """Collects command latencies and connection pool events of the clients it is attached to."""
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.commands = defaultdict(lambda: {"count": 0, "failures": 0, "total_ms": 0.0, "max_ms": 0.0})
+        self.pool = defaultdict(int)
+        self.observers = []
+
+    def _command_done(self, event, failed: bool) -> None:
+        ms = event.duration_micros / 1000
+        with self._lock:
+            stats = self.commands[event.command_name]
+            stats["count"] += 1
+            stats["failures"] += failed
+            stats["total_ms"] += ms
+            stats["max_ms"] = max(stats["max_ms"], ms)
+        for observer in self.observers:
+            observer(event.command_name, ms / 1000, failed)
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        self._command_done(event, failed=False)
+
+    def failed(self, event) -> None:
+        self._command_done(event, failed=True)
+
+    def _count(self, key: str, delta: int = 1) -> None:
+        with self._lock:
+            self.pool[key] += delta
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        self._count("pool_cleared")
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_created(self, event) -> None:
+        self._count("connections_created")
+        self._count("connections_open")
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        self._count("connections_closed")
+        self._count("connections_open", -1)
+
+    def connection_check_out_started(self, event) -> None:
+        pass
+
+    def connection_check_out_failed(self, event) -> None:
+        self._count("check_out_failures")
+
+    def connection_checked_out(self, event) -> None:
+        self._count("check_outs")
+        self._count("checked_out", 1)
+
+    def connection_checked_in(self, event) -> None:
+        self._count("checked_out", -1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            commands = {}
+            for name, stats in self.commands.items():
+                commands[name] = dict(stats, mean_ms=stats["total_ms"] / stats["count"] if stats["count"] else 0.0)
+            return {"commands": commands, "pool": dict(self.pool)}
+
+
+class MongoClientRegistry():
+    """
+    One pooled MongoClient per URI for the whole process.
+
+    MongoClient is thread-safe and keeps its own connection pool, so creating one per call
+    only pays repeated TCP/TLS handshakes and server discovery. Every client of the registry
+    reports command latencies and pool events to `stats()`.
+    """
+    def __init__(self, max_pool_size: int = MAX_POOL_SIZE, min_pool_size: int = MIN_POOL_SIZE,
+                 connect_timeout_ms: int = CONNECT_TIMEOUT_MS,
+                 server_selection_timeout_ms: int = SERVER_SELECTION_TIMEOUT_MS,
+                 socket_timeout_ms: int = SOCKET_TIMEOUT_MS, read_preference: str = READ_PREFERENCE) -> None:
+        self.options = {
+            "maxPoolSize": max_pool_size,
+            "minPoolSize": min_pool_size,
+            "connectTimeoutMS": connect_timeout_ms,
+            "serverSelectionTimeoutMS": server_selection_timeout_ms,
+            "socketTimeoutMS": socket_timeout_ms,
+            "readPreference": read_preference,
+        }
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._stats = _ClientStats()
+
+    def get_client(self, uri: Optional[str] = None) -> MongoClient:
+        """
+        Get the shared client of a URI, creating it on first use.
+        Args:
+            uri: MongoDB connection string, defaults to the MONGODB_URI environment variable
+        Returns:
+            MongoClient: the shared client
+        """
+        uri = uri or os.getenv('MONGODB_URI')
+        with self._lock:
+            if uri not in self._clients:
+                self._clients[uri] = MongoClient(uri, event_listeners=[self._stats], **self.options)
+            return self._clients[uri]
+
+    def add_command_observer(self, observer: Callable[[str, float, bool], None]) -> None:
+        """
+        Call `observer(command_name, seconds, failed)` after each command of the registry's clients,
+        e.g. to export the latencies as histograms. It runs on the thread that issued the command.
+        """
+        self._stats.observers.append(observer)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get pool and latency statistics of all clients.
+        Returns:
+            Dict with per-command count/failures/mean/max latency, pool counters and the client options
+        """
+        stats = self._stats.snapshot()
+        stats["clients"] = len(self._clients)
+        stats["options"] = dict(self.options)
+        return stats
+
+    def close_all(self) -> None:
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+registry = MongoClientRegistry()
+
+
+def get_client(uri: Optional[str] = None) -> MongoClient:
+    return registry.get_client(uri)
+
+
+def get_collection(db_name: str = DB_NAME, collection_name: str = COLLECTION_NAME):
+    return get_client()[db_name][collection_name]
@@ -0,0 +1,130 @@
+import random
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# fields needed to build evaluation sets, never the embedding arrays
+EVAL_PROJECTION = {"_id": 1, "name": 1, "description": 1, "images.picture_url": 1,
+                   "address.market": 1, "property_type": 1}
+# stratification keys and the field each one reads
+STRATA = {"market": "address.market", "property_type": "property_type", "has_image": "images.picture_url"}
+
+
+def _get_path(doc: Dict[str, Any], path: str) -> Any:
+    for part in path.split('.'):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def stratum_of(doc: Dict[str, Any], stratify_by: Sequence[str]) -> Tuple:
+    key = []
+    for name in stratify_by:
+        value = _get_path(doc, STRATA[name])
+        key.append(bool(value) if name == "has_image" else value)
+    return tuple(key)
+
+
+def allocate(counts: Dict[Tuple, int], n: int) -> Dict[Tuple, int]:
+    """
+    Split `n` samples across strata proportionally to their sizes (largest remainder method),
+    never asking a stratum for more samples than it has.
+    """
+    total = sum(counts.values())
+    n = min(n, total)
+    quotas = {key: n * count / total for key, count in counts.items()} if total else {}
+    allocation = {key: min(counts[key], int(quota)) for key, quota in quotas.items()}
+    # hand out the remaining samples by decreasing remainder; sorting by key keeps it deterministic
+    remaining = n - sum(allocation.values())
+    while remaining > 0:
+        open_strata = [key for key in quotas if allocation[key] < counts[key]]
+        open_strata.sort(key=lambda key: (-(quotas[key] - allocation[key]), str(key)))
+        for key in open_strata[:remaining]:
+            allocation[key] += 1
+        remaining = n - sum(allocation.values())
+    return allocation
+
+
+def sample_listing_ids(collection, n: int, seed: Optional[int] = None, stratify_by: Sequence[str] = (),
+                       query: Optional[Dict[str, Any]] = None) -> List[Any]:
+    """
+    Draw a reproducible random sample of listing ids.
+
+    Only `_id` and the stratification fields are read, in one pass over the collection; the
+    sample is then drawn client-side from a seeded generator.
+
+    Args:
+        collection: MongoDB collection
+        n: Number of listings
+        seed: Seed of the sample, None for a different sample on every call
+        stratify_by: Strata keys among "market", "property_type" and "has_image"
+        query: Optional filter on the listings
+    Returns:
+        List of sampled ids, in a shuffled order
+    """
+    projection = {"_id": 1, **{STRATA[name]: 1 for name in stratify_by}}
+    strata = defaultdict(list)
+    for doc in collection.find(query or {}, projection).sort("_id", 1):
+        strata[stratum_of(doc, stratify_by)].append(doc["_id"])
+
+    rng = random.Random(seed)
+    allocation = allocate({key: len(ids) for key, ids in strata.items()}, n)
+    ids = []
+    for key in sorted(strata, key=str):
+        ids.extend(rng.sample(strata[key], allocation[key]))
+    rng.shuffle(ids)
+    return ids
+
+
+def sample_listings(collection, n: int, seed: Optional[int] = None, stratify_by: Sequence[str] = (),
+                    query: Optional[Dict[str, Any]] = None,
+                    projection: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Draw a reproducible random sample of listings and fetch them with a single `$in` query.
+    Args:
+        collection: MongoDB collection
+        n: Number of listings
+        seed: Seed of the sample, None for a different sample on every call
+        stratify_by: Strata keys among "market", "property_type" and "has_image"
+        query: Optional filter on the listings
+        projection: Fields to return, defaults to the fields needed for evaluation
+    Returns:
+        List of listings, in the sampled order
+    """
+    ids = sample_listing_ids(collection, n, seed, stratify_by, query)
+    docs = {doc["_id"]: doc for doc in collection.find({"_id": {"$in": ids}}, projection or EVAL_PROJECTION)}
+    return [docs[id_] for id_ in ids if id_ in docs]
+
+
+def server_sample_listings(collection, n: int, stratify_by: Sequence[str] = (),
+                           projection: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Sample listings with `$sample` on the server, for collections too large to scan ids.
+    Samples are not reproducible. With strata, one `$group` counts the strata and each
+    stratum is sampled with its own `$match` + `$sample`.
+    """
+    projection = projection or EVAL_PROJECTION
+    if not stratify_by:
+        return list(collection.aggregate([{"$sample": {"size": n}}, {"$project": projection}]))
+
+    group_key = {}
+    for name in stratify_by:
+        if name == "has_image":
+            group_key[name] = {"$gt": [{"$strLenCP": {"$ifNull": ["$images.picture_url", ""]}}, 0]}
+        else:
+            group_key[name] = f"${STRATA[name]}"
+    counts = {tuple(row["_id"].get(name) for name in stratify_by): row["count"]
+              for row in collection.aggregate([{"$group": {"_id": group_key, "count": {"$sum": 1}}}])}
+
+    docs = []
+    for key, size in allocate(counts, n).items():
+        if size == 0:
+            continue
+        match = {}
+        for name, value in zip(stratify_by, key):
+            if name == "has_image":
+                match[STRATA[name]] = {"$nin": [None, ""]} if value else {"$in": [None, ""]}
+            else:
+                match[STRATA[name]] = value
+        docs.extend(collection.aggregate([{"$match": match}, {"$sample": {"size": size}}, {"$project": projection}]))
+    return docs
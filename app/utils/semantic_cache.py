@@ -0,0 +1,159 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+SIMILARITY_THRESHOLD = 0.95
+TTL_SECONDS = 3600
+MAX_ENTRIES = 1000
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    embedding: np.ndarray
+    query_text: str
+    listing_ids: List[Any]
+    context: List[Dict[str, Any]]
+    answer: Optional[str] = None
+    created: float = field(default_factory=time.time)
+
+
+class SemanticCache():
+    """
+    Cache of retrievals and answers keyed by query-embedding similarity.
+
+    A new query hits an entry when the cosine similarity between the query embeddings is at
+    least `threshold`, so paraphrases of a question reuse its retrieved listings (and answer).
+    Entries expire after `ttl` seconds and the least recently used ones are evicted beyond
+    `max_entries`. Entries referencing a listing can be dropped with `invalidate_listings`
+    when the listing changes.
+    """
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, ttl: float = TTL_SECONDS,
+                 max_entries: int = MAX_ENTRIES) -> None:
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._keys = []
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def _remove(self, key: str, reason: str) -> None:
+        if self._entries.pop(key, None) is not None:
+            self._stats[reason] += 1
+            self._matrix = None
+
+    def _expire(self) -> None:
+        now = time.time()
+        for key in [k for k, entry in self._entries.items() if now - entry.created > self.ttl]:
+            self._remove(key, "expirations")
+
+    def _similarities(self, embedding: np.ndarray) -> np.ndarray:
+        if self._matrix is None:
+            self._keys = list(self._entries)
+            self._matrix = np.stack([self._entries[k].embedding for k in self._keys]) if self._keys \
+                else np.zeros((0, len(embedding)), dtype=np.float32)
+        return self._matrix @ embedding
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: List[float]) -> Optional[CacheEntry]:
+        """
+        Find the most similar cached query above the threshold.
+        Args:
+            embedding: Embedding of the new query
+        Returns:
+            The cache entry, or None on a miss
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._expire()
+            similarities = self._similarities(vector)
+            if len(similarities) and similarities.max() >= self.threshold:
+                key = self._keys[int(similarities.argmax())]
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return self._entries[key]
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, embedding: List[float], query_text: str, listing_ids: List[Any],
+            context: List[Dict[str, Any]], answer: Optional[str] = None) -> CacheEntry:
+        """
+        Cache the retrieval of a query.
+        Args:
+            embedding: Embedding of the query
+            query_text: Text of the query
+            listing_ids: Ids of the retrieved listings
+            context: Retrieved context passed to the LLM
+            answer: Final answer, if it can be reused as is
+        Returns:
+            The new cache entry
+        """
+        entry = CacheEntry(str(uuid.uuid4()), self._normalize(embedding), query_text, list(listing_ids), context, answer)
+        with self._lock:
+            self._entries[entry.key] = entry
+            self._matrix = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)), "evictions")
+        return entry
+
+    def set_answer(self, key: str, answer: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._entries[key].answer = answer
+
+    def invalidate_listings(self, listing_ids: List[Any]) -> int:
+        """
+        Drop every entry whose retrieval contains one of the listings.
+        Returns:
+            Number of entries dropped
+        """
+        listing_ids = set(listing_ids)
+        with self._lock:
+            keys = [k for k, entry in self._entries.items() if listing_ids.intersection(entry.listing_ids)]
+            for key in keys:
+                self._remove(key, "invalidations")
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+def watch_listing_changes(cache: SemanticCache, collection) -> threading.Thread:
+    """
+    Invalidate cache entries when their listings are updated, replaced or deleted, using a
+    MongoDB change stream on the collection (requires a replica set, e.g. Atlas).
+    Returns:
+        The daemon thread consuming the change stream
+    """
+    def run():
+        pipeline = [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}]
+        with collection.watch(pipeline) as stream:
+            for change in stream:
+                cache.invalidate_listings([change["documentKey"]["_id"]])
+
+    thread = threading.Thread(target=run, name="semantic-cache-invalidation", daemon=True)
+    thread.start()
+    return thread
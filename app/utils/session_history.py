@@ -1,20 +1,231 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Sequence
+
 from langchain_core.chat_history import (
-    BaseChatMessageHistory,  
-    InMemoryChatMessageHistory,  
+    BaseChatMessageHistory,
+    InMemoryChatMessageHistory,
 )
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from utils.context_builder import count_tokens
+
+SESSION_STORE_PATH = os.getenv('SESSION_STORE_PATH', '')  # SQLite file shared by worker processes, empty to keep sessions in memory
+SESSION_TTL = float(os.getenv('SESSION_TTL', 24 * 3600))  # seconds since the last access
+MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', 10000))
+MAX_SESSION_MESSAGES = 100  # messages kept per session
+# window of the history put into the prompt
+PROMPT_HISTORY_MESSAGES = int(os.getenv('PROMPT_HISTORY_MESSAGES', 10))
+PROMPT_HISTORY_TOKENS = int(os.getenv('PROMPT_HISTORY_TOKENS', 1500))
+
+
+class BoundedChatMessageHistory(InMemoryChatMessageHistory):
+    """In-memory chat history keeping only the last `max_messages` messages."""
+    max_messages: int = MAX_SESSION_MESSAGES
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.messages.append(message)
+        if len(self.messages) > self.max_messages:
+            del self.messages[:len(self.messages) - self.max_messages]
+
+
+class InMemorySessionStore():
+    """
+    Chat histories of the sessions of one process, bounded in number and in length.
+
+    Sessions unused for `ttl` seconds expire, and the least recently used ones are evicted
+    beyond `max_sessions`; each history keeps its last `max_messages` messages.
+    """
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl: float = SESSION_TTL,
+                 max_messages: int = MAX_SESSION_MESSAGES) -> None:
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._sessions = OrderedDict()  # session id -> (history, last access)
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "expirations": 0, "evictions": 0}
+
+    def _expire(self, now: float) -> None:
+        # the least recently used sessions come first, stop at the first one still alive
+        while self._sessions:
+            session_id, (_, last_access) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl:
+                break
+            del self._sessions[session_id]
+            self._stats["expirations"] += 1
 
+    def get(self, session_id: str) -> BaseChatMessageHistory:
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if session_id in self._sessions:
+                history = self._sessions.pop(session_id)[0]
+            else:
+                history = BoundedChatMessageHistory(max_messages=self.max_messages)
+                self._stats["created"] += 1
+            self._sessions[session_id] = (history, now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._stats["evictions"] += 1
+            return history
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, sessions=len(self._sessions))
+
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    """Chat history of one session, read from and written to a `SQLiteSessionStore`."""
+    def __init__(self, store: "SQLiteSessionStore", session_id: str) -> None:
+        self.store = store
+        self.session_id = session_id
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self.store.load_messages(self.session_id)
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.store.append_messages(self.session_id, [message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.store.append_messages(self.session_id, messages)
+
+    def clear(self) -> None:
+        self.store.delete(self.session_id)
+
+
+class SQLiteSessionStore():
+    """
+    Chat histories persisted in SQLite, surviving restarts and shared by the worker processes
+    of one host. Same bounds as `InMemorySessionStore`: sessions expire after `ttl` seconds
+    without access, the least recently used are evicted beyond `max_sessions`, and each session
+    keeps its last `max_messages` messages.
+    """
+    def __init__(self, path: str, max_sessions: int = MAX_SESSIONS, ttl: float = SESSION_TTL,
+                 max_messages: int = MAX_SESSION_MESSAGES) -> None:
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._stats = {"expirations": 0, "evictions": 0}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, last_access REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, message TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+        self._db.commit()
+
+    def _delete_sessions(self, where: str, params: tuple) -> int:
+        ids = [row[0] for row in self._db.execute(f"SELECT session_id FROM sessions WHERE {where}", params)]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ','.join('?' * len(chunk))
+            self._db.execute(f"DELETE FROM messages WHERE session_id IN ({marks})", chunk)
+            self._db.execute(f"DELETE FROM sessions WHERE session_id IN ({marks})", chunk)
+        return len(ids)
+
+    def get(self, session_id: str) -> BaseChatMessageHistory:
+        now = time.time()
+        with self._lock:
+            self._stats["expirations"] += self._delete_sessions("last_access < ?", (now - self.ttl,))
+            self._db.execute("INSERT OR REPLACE INTO sessions (session_id, last_access) VALUES (?, ?)", (session_id, now))
+            excess = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.max_sessions
+            if excess > 0:
+                self._stats["evictions"] += self._delete_sessions(
+                    "session_id IN (SELECT session_id FROM sessions ORDER BY last_access LIMIT ?)", (excess,))
+            self._db.commit()
+        return SQLiteChatMessageHistory(self, session_id)
+
+    def load_messages(self, session_id: str) -> List[BaseMessage]:
+        with self._lock:
+            rows = self._db.execute("SELECT message FROM messages WHERE session_id = ? ORDER BY id",
+                                    (session_id,)).fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in rows])
+
+    def append_messages(self, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        with self._lock:
+            self._db.executemany("INSERT INTO messages (session_id, message) VALUES (?, ?)",
+                                 [(session_id, json.dumps(message_to_dict(m))) for m in messages])
+            self._db.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id NOT IN "
+                "(SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, self.max_messages))
+            self._db.execute("INSERT OR REPLACE INTO sessions (session_id, last_access) VALUES (?, ?)",
+                             (session_id, time.time()))
+            self._db.commit()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._delete_sessions("session_id = ?", (session_id,))
+            self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            sessions = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return dict(self._stats, sessions=sessions)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    global store
+    with _store_lock:
+        if store is None:
+            store = SQLiteSessionStore(SESSION_STORE_PATH) if SESSION_STORE_PATH else InMemorySessionStore()
+        return store
 
-store = {}
 
 def get_session_history(session_id: str) -> BaseChatMessageHistory:
     """
     get the session history
     Args:
         session_id (str): the unique identifier of the session
-    
+
     Returns:
         BaseChatMessageHistory: the chat history of the session
     """
-    if session_id not in store:
-        store[session_id] = InMemoryChatMessageHistory()
-    return store[session_id]
\ No newline at end of file
+    return get_session_store().get(session_id)
+
+
+def prompt_history(messages: Sequence[BaseMessage], max_messages: int = PROMPT_HISTORY_MESSAGES,
+                   max_tokens: int = PROMPT_HISTORY_TOKENS) -> List[BaseMessage]:
+    """
+    Window of the history to put into a prompt: the most recent messages within both limits,
+    oldest first, starting with a user message so no answer is left without its question.
+    Args:
+        messages: Full history of the session
+        max_messages: Maximum number of messages
+        max_tokens: Maximum total tokens of the message contents
+    Returns:
+        List of messages
+    """
+    window, tokens = [], 0
+    for message in reversed(messages[-max_messages:] if max_messages > 0 else []):
+        content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+        tokens += count_tokens(content)
+        if tokens > max_tokens:
+            break
+        window.append(message)
+    window.reverse()
+    while window and window[0].type != "human":
+        window.pop(0)
+    return window
@@ -0,0 +1,272 @@
+import contextvars
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+MAX_SPANS = 1000
+METRIC_PREFIX = "rag"
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+_session_id = contextvars.ContextVar("session_id", default=None)
+
+
+class _Histogram():
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+class _Span():
+    __slots__ = ("registry", "stage", "labels", "start")
+
+    def __init__(self, registry: "MetricsRegistry", stage: str, labels: Dict[str, str]) -> None:
+        self.registry = registry
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.registry.record_span(self.stage, time.perf_counter() - self.start, self.labels, exc_type is not None)
+        return False
+
+
+class _NoopSpan():
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class MetricsRegistry():
+    """
+    In-process registry of stage latencies and counters.
+
+    Each timed span feeds a latency histogram keyed by stage and labels, and is kept in a ring
+    buffer of recent spans with the request and session ids of the context it ran in. The
+    registry is disabled by default: `span` then returns a shared no-op context manager and
+    `count`/`observe` return immediately, so the hooks cost one attribute check.
+    """
+    def __init__(self, enabled: bool = False, max_spans: int = MAX_SPANS) -> None:
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(_Histogram)
+        self._counters = defaultdict(float)
+        self._spans = deque(maxlen=max_spans)
+        self._gauge_sources = []
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def span(self, stage: str, **labels: str):
+        """
+        Time a block of code as one stage.
+        Args:
+            stage: Name of the stage, e.g. "classify" or "aggregate"
+            labels: Extra labels of the stage metrics, e.g. search="hybrid"
+        Returns:
+            Context manager recording the duration and whether the block raised
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, stage, labels)
+
+    def record_span(self, stage: str, seconds: float, labels: Optional[Dict[str, str]] = None,
+                    error: bool = False) -> None:
+        if not self.enabled:
+            return
+        key = (stage, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._histograms[key].observe(seconds)
+            if error:
+                self._counters[("stage_errors", tuple(sorted(key[1] + (("stage", stage),))))] += 1
+            self._spans.append({"request_id": _request_id.get(), "session_id": _session_id.get(), "stage": stage,
+                                "labels": dict(labels or {}), "duration_ms": seconds * 1000, "error": error,
+                                "end": time.time()})
+
+    def observe(self, stage: str, seconds: float, **labels: str) -> None:
+        """Record a duration measured by the caller, e.g. the time to the first streamed token."""
+        self.record_span(stage, seconds, labels)
+
+    def count(self, name: str, value: float = 1, **labels: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def add_gauges(self, source: Callable[[], Dict[str, float]]) -> None:
+        """
+        Export values owned elsewhere as gauges, e.g. connection pool counters.
+        Args:
+            source: Called on each snapshot and export, returns the current value of each gauge by name
+        """
+        with self._lock:
+            self._gauge_sources.append(source)
+
+    def _read_gauges(self) -> Dict[str, float]:
+        with self._lock:
+            sources = list(self._gauge_sources)
+        gauges = {}
+        for source in sources:
+            gauges.update(source())
+        return gauges
+
+    def recent_spans(self, request_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Recent spans, oldest first, optionally only those of one request."""
+        with self._lock:
+            spans = list(self._spans)
+        return [s for s in spans if request_id is None or s["request_id"] == request_id]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get the current metrics.
+        Returns:
+            Dict with per-stage count/sum/mean latency and bucket counts, the counters and the gauges
+        """
+        gauges = self._read_gauges()
+        with self._lock:
+            stages = {}
+            for (stage, labels), histogram in self._histograms.items():
+                name = stage + "".join(f",{k}={v}" for k, v in labels)
+                stages[name] = {"count": histogram.count, "sum_s": histogram.sum,
+                                "mean_ms": histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+                                "buckets": dict(zip(BUCKETS, histogram.counts))}
+            counters = {name + "".join(f",{k}={v}" for k, v in labels): value
+                        for (name, labels), value in self._counters.items()}
+        return {"stages": stages, "counters": counters, "gauges": gauges}
+
+    def export_prometheus(self) -> str:
+        """
+        Render the registry in the Prometheus text exposition format.
+        Returns:
+            Text with one `<prefix>_stage_duration_seconds` histogram, one `<prefix>_<name>_total`
+            counter family per counter name and one `<prefix>_<name>` gauge per gauge
+        """
+        def format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+            escaped = (k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+                       for k, v in labels)
+            return "{" + ",".join(escaped) + "}" if labels else ""
+
+        gauges = self._read_gauges()
+        with self._lock:
+            histograms = [(key, list(h.counts), h.count, h.sum) for key, h in sorted(self._histograms.items())]
+            counters = sorted(self._counters.items())
+
+        name = f"{METRIC_PREFIX}_stage_duration_seconds"
+        lines = [f"# HELP {name} Latency of the stages of the RAG request path.", f"# TYPE {name} histogram"]
+        for (stage, labels), counts, count, total in histograms:
+            labels = (("stage", stage),) + labels
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        seen = set()
+        for (counter, labels), value in counters:
+            name = f"{METRIC_PREFIX}_{counter}_total"
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{format_labels(labels)} {value}")
+
+        for gauge, value in sorted(gauges.items()):
+            name = f"{METRIC_PREFIX}_{gauge}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._spans.clear()
+
+
+metrics = MetricsRegistry()
+
+
+def span(stage: str, **labels: str):
+    """Time a block as one stage in the process registry, see `MetricsRegistry.span`."""
+    if not metrics.enabled:
+        return _NOOP_SPAN
+    return _Span(metrics, stage, labels)
+
+
+@contextmanager
+def request_context(session_id: Optional[str] = None, request_id: Optional[str] = None) -> Iterator[str]:
+    """
+    Tag the spans recorded in this context, including those of tasks started from it, with a
+    request id and a session id. Work handed to a thread pool keeps the tags only when run
+    through `contextvars.copy_context().run`.
+    Yields:
+        The request id
+    """
+    request_id = request_id or uuid.uuid4().hex[:16]
+    request_token = _request_id.set(request_id)
+    session_token = _session_id.set(session_id)
+    try:
+        yield request_id
+    finally:
+        _request_id.reset(request_token)
+        _session_id.reset(session_token)
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0", registry: MetricsRegistry = metrics) -> ThreadingHTTPServer:
+    """
+    Serve `registry.export_prometheus()` on http://<host>:<port>/metrics from a daemon thread.
+    Returns:
+        The running server
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.export_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
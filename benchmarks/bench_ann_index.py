@@ -0,0 +1,82 @@
+'''
+Recall@10, QPS and memory per vector of the IVF / IVF-PQ local indexes against exact search,
+for a sweep of numCandidates.
+
+Usage:
+    python benchmarks/bench_ann_index.py --n 50000 --dim 1536 --pq_m 96
+    python benchmarks/bench_ann_index.py --index_dir data/vectors/description_embedding
+'''
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+from search.vector_store import LocalVectorIndex, IVFIndex
+
+
+def synthetic_corpus(n, dim, clusters=64, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    return centers[labels] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def measure(index, queries, k, num_candidates):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(index.search(query, k, num_candidates)[0])
+    return results, len(queries) / (time.perf_counter() - start)
+
+
+def recall_at_k(results, truth, k):
+    return float(np.mean([len(set(r[:k]) & set(t[:k])) / k for r, t in zip(results, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index_dir', default=None, help='exported exact index to benchmark on instead of synthetic data')
+    parser.add_argument('--n', type=int, default=20000)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--pq_m', type=int, default=96)
+    parser.add_argument('--num_candidates', type=int, nargs='+', default=[20, 50, 100, 150, 300, 600])
+    args = parser.parse_args()
+
+    if args.index_dir:
+        exact = LocalVectorIndex.load(args.index_dir, mmap=False)
+        ids, vectors = exact.ids, exact.vectors
+    else:
+        vectors = synthetic_corpus(args.n, args.dim)
+        ids = np.arange(len(vectors))
+        exact = LocalVectorIndex.build(ids, vectors)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.3 * rng.normal(size=queries.shape).astype(np.float32)
+
+    truth, qps = measure(exact, queries, args.k, None)
+    print(f"{'index':<12}{'numCandidates':>14}{'recall@' + str(args.k):>11}{'QPS':>10}{'bytes/vec':>11}")
+    print(f"{'exact':<12}{'-':>14}{1.0:>11.3f}{qps:>10.0f}{exact.dimensions * 4:>11}")
+
+    indexes = {}
+    start = time.perf_counter()
+    indexes['ivf-flat'] = IVFIndex.train(ids, vectors, nlist=args.nlist)
+    print(f"ivf-flat built in {time.perf_counter() - start:.1f}s")
+    if args.pq_m:
+        start = time.perf_counter()
+        indexes['ivf-pq'] = IVFIndex.train(ids, vectors, nlist=args.nlist, pq_m=args.pq_m)
+        print(f"ivf-pq built in {time.perf_counter() - start:.1f}s")
+    for name, index in indexes.items():
+        for num_candidates in args.num_candidates:
+            results, qps = measure(index, queries, args.k, num_candidates)
+            print(f"{name:<12}{num_candidates:>14}{recall_at_k(results, truth, args.k):>11.3f}"
+                  f"{qps:>10.0f}{index.bytes_per_vector():>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
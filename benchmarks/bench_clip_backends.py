@@ -0,0 +1,130 @@
+'''
+Per-image CPU latency of the fp32 and int8-quantized CLIP image encoders over a sweep of torch
+thread counts, and the parity of the int8 embeddings with the fp32 ones: their cosine
+similarity, and whether searching with them returns the same listings as the fp32 query
+embeddings (the stored `image_embeddings` and `vector_index_image` stay fp32).
+
+Exits with status 1 when the lowest cosine similarity is below --min_cosine.
+
+Usage:
+    python benchmarks/bench_clip_backends.py --threads 1 2 4
+    python benchmarks/bench_clip_backends.py --from_db 200 --index_dir data/vectors
+'''
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+from search.vector_store import load_index
+from utils.image_encoder import BACKENDS, ImageEncoder
+from utils.image_fetcher import ImageFetcher, ImageFetchError, decode_image
+
+DEFAULT_IMAGES = ['files/image1.png', 'files/image2.png', 'files/image_plateau_montRoyal.png']
+
+
+def sample_images(n):
+    from utils.mongodb import get_collection
+    fetcher = ImageFetcher()
+    images = []
+    cursor = get_collection().find({"images.picture_url": {"$exists": True, "$nin": [None, ""]}},
+                                   {"images.picture_url": 1}).limit(n * 2)
+    for doc in cursor:
+        try:
+            images.append(decode_image(fetcher.fetch(doc["images"]["picture_url"])))
+        except (ImageFetchError, OSError):
+            continue
+        if len(images) == n:
+            break
+    return images
+
+
+def measure(encoder, images, batch_size, repeats):
+    # milliseconds per image of each call, over `repeats` passes on the images
+    encoder.max_batch_size = batch_size
+    latencies = []
+    for _ in range(repeats):
+        for i in range(0, len(images), batch_size):
+            batch = images[i:i + batch_size]
+            start = time.perf_counter()
+            encoder.encode_batch(batch)
+            latencies.append((time.perf_counter() - start) * 1000 / len(batch))
+    return np.asarray(latencies)
+
+
+def cosine(a, b):
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    return np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+def top_k(index, queries, k):
+    return [index.search(query, k)[0] for query in queries]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', nargs='+', default=DEFAULT_IMAGES)
+    parser.add_argument('--from_db', type=int, default=0, help='also embed this many listing pictures (live cluster)')
+    parser.add_argument('--index_dir', default=None, help='exported indexes to compare the search results, see database/export_vectors.py')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--min_cosine', type=float, default=0.99)
+    args = parser.parse_args()
+
+    images = [Image.open(path).convert("RGB") for path in args.images]
+    if args.from_db:
+        images += sample_images(args.from_db)
+    print(f"{len(images)} images")
+
+    encoders = {}
+    for backend in BACKENDS:
+        start = time.perf_counter()
+        encoders[backend] = ImageEncoder(backend=backend)
+        encoders[backend].load()
+        encoders[backend].encode_batch(images[:1])  # warm up
+        print(f"{backend}: loaded in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    print(f"{'backend':<9}{'threads':>8}{'batch':>7}{'p50 ms/img':>12}{'p95 ms/img':>12}{'images/s':>10}")
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for batch_size in args.batch_sizes:
+            for backend, encoder in encoders.items():
+                latencies = measure(encoder, images, batch_size, args.repeats)
+                print(f"{backend:<9}{threads:>8}{batch_size:>7}{np.percentile(latencies, 50):>12.1f}"
+                      f"{np.percentile(latencies, 95):>12.1f}{1000 / latencies.mean():>10.1f}")
+
+    reference = encoders["fp32"].encode_batch(images)
+    passed = True
+    for backend, encoder in encoders.items():
+        if backend == "fp32":
+            continue
+        embeddings = encoder.encode_batch(images)
+        similarities = cosine(reference, embeddings)
+        print(f"parity {backend} vs fp32: cosine min {similarities.min():.4f}, "
+              f"p1 {np.percentile(similarities, 1):.4f}, mean {similarities.mean():.4f}")
+        passed = passed and similarities.min() >= args.min_cosine
+
+        # the fp32 embeddings of the images are the corpus, each query should find its own image first
+        corpus = np.asarray(reference, dtype=np.float32)
+        corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+        own = np.argmax(np.asarray(embeddings, dtype=np.float32) @ corpus.T, axis=1) == np.arange(len(images))
+        print(f"parity {backend} vs fp32: own image ranked first for {own.mean():.3f} of the images")
+        if args.index_dir:
+            index = load_index(os.path.join(args.index_dir, "image_embeddings"))
+            expected, results = top_k(index, reference, args.k), top_k(index, embeddings, args.k)
+            overlap = np.mean([len(set(r) & set(e)) / args.k for r, e in zip(results, expected)])
+            same_first = np.mean([list(r[:1]) == list(e[:1]) for r, e in zip(results, expected)])
+            print(f"parity {backend} vs fp32: image search overlap@{args.k} {overlap:.3f}, same top-1 {same_first:.3f}")
+
+    print("parity check " + ("passed" if passed else f"FAILED, cosine below {args.min_cosine}"))
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+'''
+Load test of concurrent chats: simulated users, each with its own session, send several turns
+to RagAgent (stubbed LLM and retrieval latencies) through a queue with the semantics of the
+Gradio queue (`concurrency_limit` requests served at once, at most `max_size` waiting, the
+rest rejected). Compares the previous serving setup, where Gradio served one request at a
+time, with the bounded concurrent one of my_app.py, and checks that no session sees messages
+of another.
+
+Usage:
+    python benchmarks/bench_concurrency.py --users 1 4 16 32 --turns 3
+    python benchmarks/bench_concurrency.py --concurrency_limit 16 --max_size 8
+'''
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+from bench_rag_orchestration import stub_agent
+from utils.session_history import get_session_history
+
+
+class QueueFull(Exception):
+    pass
+
+
+class RequestQueue():
+    """Admission control of a Gradio event: a concurrency limit and a bounded waiting queue."""
+    def __init__(self, concurrency_limit, max_size):
+        self.semaphore = asyncio.Semaphore(concurrency_limit)
+        self.max_size = max_size
+        self.waiting = 0
+
+    async def submit(self, make_request):
+        if self.max_size is not None and self.waiting >= self.max_size:
+            raise QueueFull()
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            return await make_request()
+        finally:
+            self.semaphore.release()
+
+
+async def user(agent, queue, session_id, turns, latencies, rejected):
+    for turn in range(turns):
+        query = {'text': f"{session_id} turn {turn}: 2 bedroom flat near the beach", 'files': []}
+        start = time.perf_counter()
+        try:
+            await queue.submit(lambda: agent.aresponse_to_user(query, session_id))
+        except QueueFull:
+            rejected.append(session_id)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(agent, users, turns, concurrency_limit, max_size, tag):
+    queue = RequestQueue(concurrency_limit, max_size)
+    latencies, rejected = [], []
+    session_ids = [f"{tag}-user{i}" for i in range(users)]
+    start = time.perf_counter()
+    await asyncio.gather(*[user(agent, queue, session_id, turns, latencies, rejected) for session_id in session_ids])
+    elapsed = time.perf_counter() - start
+
+    # each session only holds its own turns
+    for session_id in session_ids:
+        for message in get_session_history(session_id).messages:
+            if message.type == "human":
+                assert f"{session_id} turn" in message.content, f"{session_id} got a message of another session"
+    return elapsed, latencies, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--llm_ms', type=float, default=300)
+    parser.add_argument('--retrieval_ms', type=float, default=200)
+    parser.add_argument('--concurrency_limit', type=int, default=16)
+    parser.add_argument('--max_size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=None, help='threads of the agent, default 2 * concurrency_limit')
+    args = parser.parse_args()
+
+    configs = [
+        ("one at a time", 1, None, 8),
+        (f"limit={args.concurrency_limit}", args.concurrency_limit, args.max_size,
+         args.workers or 2 * args.concurrency_limit),
+    ]
+    print(f"{'setup':<14} {'users':>5} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'rejected':>8}")
+    for name, concurrency_limit, max_size, workers in configs:
+        agent = stub_agent(args.llm_ms / 1000, args.retrieval_ms / 1000, 'yes')
+        agent.executor = ThreadPoolExecutor(max_workers=workers)
+        for users in args.users:
+            elapsed, latencies, rejected = asyncio.run(
+                run(agent, users, args.turns, concurrency_limit, max_size, f"{name}-{users}"))
+            served = len(latencies)
+            latencies = np.asarray(latencies) * 1000 if latencies else np.zeros(1)
+            print(f"{name:<14} {users:5d} {served / elapsed:7.2f} {np.percentile(latencies, 50):8.0f} "
+                  f"{np.percentile(latencies, 95):8.0f} {len(rejected):8d}")
+
+
+if __name__ == "__main__":
+    main()
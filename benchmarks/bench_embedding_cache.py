@@ -0,0 +1,145 @@
+'''
+Offline check of the two-tier text embedding cache (app/utils/embedding_cache.py) with a
+counting fake embedder, no OpenAI calls.
+
+Replays a Zipf-distributed query stream through a cache with a small memory tier in front of a
+SQLite file, and reports the hit rate, the embedder calls and texts, the per-lookup latency
+and the evictions of each tier. Then checks that:
+  - repeated and whitespace-variant texts are served from memory, and the embedder is called
+    once per batch of misses;
+  - texts evicted from memory are served from disk, also by a new cache opened on the file;
+  - the disk tier stays within its capacity, dropping the least recently used entries;
+  - invalidated texts are embedded again.
+Exits with status 1 when a check fails.
+
+Usage:
+    python benchmarks/bench_embedding_cache.py --queries 20000 --vocabulary 5000 --embed_ms 50
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+from utils.embedding_cache import EmbeddingCache
+
+
+class CountingEmbedder():
+    """Fake provider: deterministic vectors derived from the text, with a fixed latency per call."""
+    def __init__(self, dimensions, latency=0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.calls = 0
+        self.texts = 0
+
+    def __call__(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.latency)
+        return [[(hash(text) % 1000 + i) / 1000 for i in range(self.dimensions)] for text in texts]
+
+
+def replay(cache, queries):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        cache.get(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.asarray(latencies)
+
+
+def run_checks(directory, dimensions):
+    failures = []
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+
+    path = os.path.join(directory, "checks.sqlite")
+    embedder = CountingEmbedder(dimensions)
+    cache = EmbeddingCache(embedder, "fake", dimensions, path=path, max_memory_entries=2, max_disk_entries=4)
+    first = cache.get_many(["a", "b", "a"])
+    check(embedder.calls == 1 and embedder.texts == 2,
+          f"misses: {embedder.texts} texts in {embedder.calls} calls, 2 in 1 expected")
+    check(first[0] == first[2], "a repeated text got different embeddings")
+    cache.get("  b ")
+    check(embedder.texts == 2 and cache.stats()["memory_hits"] == 1,
+          "memory hits: a whitespace variant was embedded again")
+
+    cache.get_many(["c", "d"])  # evicts "a" and "b" from the memory tier
+    check(cache.stats()["memory_evictions"] == 2, f"memory evictions: {cache.stats()['memory_evictions']}, 2 expected")
+    cache.get("a")
+    check(embedder.texts == 4 and cache.stats()["disk_hits"] == 1, "disk hits: a text evicted from memory was embedded again")
+
+    reopened_embedder = CountingEmbedder(dimensions)
+    reopened = EmbeddingCache(reopened_embedder, "fake", dimensions, path=path, max_memory_entries=2, max_disk_entries=4)
+    check(reopened.get_many(["a", "b", "c", "d"]) == [cache.get(t) for t in "abcd"] and reopened_embedder.calls == 0,
+          "reopened cache: stored texts were embedded again")
+    reopened.close()
+
+    embedder.texts = 0
+    cache.invalidate("a")
+    cache.get("a")
+    check(embedder.texts == 1, "invalidate: the text was served from the cache")
+    cache.close()
+
+    # one entry in memory, so every lookup but the last one reads the disk tier
+    embedder = CountingEmbedder(dimensions)
+    cache = EmbeddingCache(embedder, "fake", dimensions, path=os.path.join(directory, "lru.sqlite"), max_memory_entries=1, max_disk_entries=3)
+    for text in ["a", "b", "c", "a", "d"]:  # "d" is the 4th text on disk, "b" the least recently used
+        cache.get(text)
+    stats = cache.stats()
+    check(stats["disk_entries"] == 3 and stats["disk_evictions"] == 1,
+          f"disk evictions: {stats['disk_entries']} entries and {stats['disk_evictions']} evictions, 3 and 1 expected")
+    embedder.texts = 0
+    for text in ["a", "c", "d", "b"]:
+        cache.get(text)
+    check(embedder.texts == 1,
+          f"disk evictions: {embedder.texts} texts embedded again, only the least recently used expected")
+    cache.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--vocabulary', type=int, default=5000, help='distinct texts of the query stream')
+    parser.add_argument('--zipf', type=float, default=1.1, help='exponent of the query popularity')
+    parser.add_argument('--memory_entries', type=int, default=1000)
+    parser.add_argument('--disk_entries', type=int, default=3000)
+    parser.add_argument('--dimensions', type=int, default=1536)
+    parser.add_argument('--embed_ms', type=float, default=0, help='latency of each call of the fake embedder')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    ranks = rng.zipf(args.zipf, size=args.queries * 2)
+    queries = [f"2 bedroom flat near the beach, listing {r}" for r in ranks[ranks <= args.vocabulary][:args.queries]]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        embedder = CountingEmbedder(args.dimensions, args.embed_ms / 1000)
+        cache = EmbeddingCache(embedder, "fake", args.dimensions, path=os.path.join(tmp, "replay.sqlite"),
+                               max_memory_entries=args.memory_entries, max_disk_entries=args.disk_entries)
+        latencies = replay(cache, queries)
+        stats = cache.stats()
+        cache.close()
+        print(f"{len(queries)} queries over {len(set(queries))} distinct texts, "
+              f"memory tier {args.memory_entries}, disk tier {args.disk_entries}")
+        print(f"hit rate {stats['hit_rate']:.3f} (memory {stats['memory_hits']}, disk {stats['disk_hits']}), "
+              f"{embedder.calls} embedder calls for {embedder.texts} texts")
+        print(f"evictions: memory {stats['memory_evictions']}, disk {stats['disk_evictions']}; "
+              f"entries: memory {stats['memory_entries']}, disk {stats['disk_entries']}")
+        print(f"latency per lookup: p50 {np.percentile(latencies, 50):.3f} ms, p99 {np.percentile(latencies, 99):.3f} ms")
+
+        failures = run_checks(tmp, dimensions=8)
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    print("cache check " + ("passed" if not failures else "FAILED"))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
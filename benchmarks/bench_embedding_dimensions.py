@@ -0,0 +1,98 @@
+'''
+Retrieval quality, latency and memory of reduced-dimension (Matryoshka) text embeddings: the
+full 1536-d description embeddings are truncated to each size and renormalized, as done by
+database/truncate_embeddings.py, and searched exactly.
+
+By default the corpus is synthetic, with a per-dimension variance decaying like the spectrum of
+Matryoshka embeddings, and each query is a noisy copy of its relevant listing. With
+--index_dir the exported description embeddings are used with LLM-generated evaluation queries
+of sampled listings (live cluster and OpenAI, the queries are cached under .cache/evaluation).
+
+Usage:
+    python benchmarks/bench_embedding_dimensions.py --n 20000
+    python benchmarks/bench_embedding_dimensions.py --index_dir data/vectors --queries 200
+'''
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'app'))
+from search.vector_store import LocalVectorIndex
+from utils.embedding_dimensions import TEXT_EMBED_FULL_SIZE, TEXT_EMBED_SIZES, text_embedding_field, truncate_embeddings
+from utils.eval_runner import first_relevant_positions, retrieval_metrics
+
+
+def synthetic_matryoshka(n, queries, dim=TEXT_EMBED_FULL_SIZE, clusters=64, noise=1.2, seed=0):
+    # listings share cluster directions, the leading dimensions carry most of the variance
+    rng = np.random.default_rng(seed)
+    scale = (1 + np.arange(dim, dtype=np.float32)) ** -0.5
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = (centers[rng.integers(0, clusters, n)] + rng.normal(size=(n, dim)).astype(np.float32)) * scale
+    relevant = rng.choice(n, queries, replace=False)
+    query_vectors = vectors[relevant] + noise * rng.normal(size=(queries, dim)).astype(np.float32) * scale
+    return np.arange(n), vectors, query_vectors, relevant
+
+
+def live_queries(index_dir, queries, seed):
+    sys.path.append(ROOT)
+    from app.utils.evaluation import get_random_properties, generate_queries
+    from database.mongodb_utils import get_text_embedding_cache
+
+    exact = LocalVectorIndex.load(os.path.join(index_dir, text_embedding_field(TEXT_EMBED_FULL_SIZE)))
+    properties, _ = get_random_properties(queries, seed=seed)
+    generated = generate_queries(properties)
+    # full-size query embeddings, truncated like the corpus
+    query_vectors = np.asarray(get_text_embedding_cache().get_many([q['generated_query'] for q in generated]))
+    positions = exact.positions([q['id'] for q in generated])
+    found = positions >= 0  # listings without a description embedding are not in the index
+    return np.array(exact.ids), exact.vectors, query_vectors[found], np.asarray(exact.ids)[positions[found]]
+
+
+def search_all(index, queries, k):
+    results, latencies = [], []
+    index.search(queries[0], k)  # warm up
+    for query in queries:
+        start = time.perf_counter()
+        results.append(index.search(query, k)[0])
+        latencies.append(time.perf_counter() - start)
+    return results, np.asarray(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index_dir', default=None, help='directory of exported indexes, see database/export_vectors.py')
+    parser.add_argument('--n', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(TEXT_EMBED_SIZES))
+    args = parser.parse_args()
+
+    if args.index_dir:
+        ids, vectors, queries, relevant = live_queries(args.index_dir, args.queries, args.seed)
+    else:
+        ids, vectors, queries, relevant = synthetic_matryoshka(args.n, args.queries, seed=args.seed)
+    relevant = list(relevant)
+
+    full_results = None
+    print(f"{'size':>6}{'bytes/vec':>10}{'corpus MB':>10}{'p50 ms':>9}{'p95 ms':>9}{'recall@1':>10}"
+          f"{'recall@' + str(args.k):>11}{'mrr':>7}{'overlap@' + str(args.k):>12}")
+    for size in sorted(args.sizes, reverse=True):
+        index = LocalVectorIndex.build(ids, truncate_embeddings(vectors, size))
+        results, latencies = search_all(index, truncate_embeddings(queries, size), args.k)
+        if full_results is None:
+            full_results = results  # the largest size is the reference of the overlap
+        metrics = retrieval_metrics(first_relevant_positions(results, relevant), ks=[1, args.k])
+        overlap = np.mean([len(set(r) & set(f)) / args.k for r, f in zip(results, full_results)])
+        print(f"{size:>6}{size * 4:>10}{index.vectors.nbytes / 2**20:>10.1f}{np.percentile(latencies, 50):>9.2f}"
+              f"{np.percentile(latencies, 95):>9.2f}{metrics['recall@1']:>10.3f}{metrics[f'recall@{args.k}']:>11.3f}"
+              f"{metrics['mrr']:>7.3f}{overlap:>12.3f}")
+        del index
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+'''
+End-to-end latency of the server-side hybrid search pipeline ($group/$unwind/$unionWith)
+vs. concurrent id+score legs fused client-side, on the live collection (needs MONGODB_URI
+and OPENAI_API_KEY; query embeddings are computed once, outside the timings).
+
+Usage:
+    python benchmarks/bench_fusion.py --runs 5
+    python benchmarks/bench_fusion.py --local_vector_dir data/vectors
+'''
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+from search.fusion import FusionExecutor
+from search.pipelines.hybrid_search_pipeline import build_hybrid_search_stage, build_hybrid_search_legs, HYBRID_RETURN_KEYS
+from search.vector_store import LocalVectorBackend
+from utils.embedding import get_text_embedding
+from utils.mongodb import get_collection
+
+QUERIES = [
+    "Fully furnished 3+1 flat decorated with vintage style.",
+    "2 bedroom flat near the beach in Barcelona",
+    "Quiet studio close to the metro with a fast wifi connection",
+    "Large family house with a garden and a swimming pool",
+    "Cozy loft in the city center with a view of the harbour",
+]
+
+
+def summarize(name, latencies):
+    latencies = np.asarray(latencies) * 1000
+    print(f"{name:<28} mean {latencies.mean():8.1f} ms   p50 {np.percentile(latencies, 50):8.1f} ms   "
+          f"p95 {np.percentile(latencies, 95):8.1f} ms")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--alpha_vector', type=float, default=0.8)
+    parser.add_argument('--local_vector_dir', default=None)
+    args = parser.parse_args()
+
+    collection = get_collection()
+    vectors = {query: get_text_embedding(query) for query in QUERIES}
+    executors = {"client-side fusion": FusionExecutor(collection)}
+    if args.local_vector_dir:
+        executors["client-side fusion + local"] = FusionExecutor(collection, LocalVectorBackend.load(args.local_vector_dir))
+
+    # warm up connections
+    list(collection.aggregate(build_hybrid_search_stage(vectors[QUERIES[0]], QUERIES[0])))
+
+    latencies = {"server-side pipeline": []}
+    latencies.update({name: [] for name in executors})
+    for _ in range(args.runs):
+        for query, vector in vectors.items():
+            start = time.perf_counter()
+            list(collection.aggregate(build_hybrid_search_stage(vector, query, alpha_vector=args.alpha_vector)))
+            latencies["server-side pipeline"].append(time.perf_counter() - start)
+            for name, executor in executors.items():
+                start = time.perf_counter()
+                executor.search(build_hybrid_search_legs(vector, query), [args.alpha_vector, 1 - args.alpha_vector],
+                                ["vs_score", "fts_score"], HYBRID_RETURN_KEYS, limit=10)
+                latencies[name].append(time.perf_counter() - start)
+    for name, values in latencies.items():
+        summarize(name, values)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+'''
+Compare the old per-call CLIP loading with the resident, micro-batching ImageEncoder.
+
+Usage:
+    python benchmarks/bench_image_encoder.py --images files/image1.png files/image2.png --requests 32
+'''
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from PIL import Image
+from transformers import CLIPProcessor, CLIPModel
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+from utils.image_encoder import ImageEncoder, DEFAULT_CLIP_MODEL_PATH
+
+
+def cold_embedding(image):
+    # what get_img_embedding used to do on every call
+    clip_model = CLIPModel.from_pretrained(DEFAULT_CLIP_MODEL_PATH)
+    clip_processor = CLIPProcessor.from_pretrained(DEFAULT_CLIP_MODEL_PATH, use_fast=True)
+    inputs = clip_processor(images=image, return_tensors="pt")
+    with torch.no_grad():
+        return clip_model.get_image_features(**inputs).squeeze().numpy().tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', nargs='+', default=['files/image1.png', 'files/image2.png'])
+    parser.add_argument('--requests', type=int, default=32)
+    parser.add_argument('--cold_requests', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--max_batch_size', type=int, default=8)
+    parser.add_argument('--max_wait_ms', type=float, default=10)
+    args = parser.parse_args()
+
+    images = [Image.open(path).convert("RGB") for path in args.images]
+    workload = [images[i % len(images)] for i in range(args.requests)]
+
+    start = time.perf_counter()
+    for image in workload[:args.cold_requests]:
+        cold_embedding(image)
+    cold_latency = (time.perf_counter() - start) / args.cold_requests
+    print(f"cold per-call: {cold_latency * 1000:.1f} ms/image, {1 / cold_latency:.2f} images/s")
+
+    encoder = ImageEncoder(max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    start = time.perf_counter()
+    encoder.load()
+    print(f"one-time model load: {(time.perf_counter() - start) * 1000:.1f} ms")
+    encoder.encode(images[0])  # warm up
+
+    start = time.perf_counter()
+    for image in workload:
+        encoder.encode(image)
+    elapsed = time.perf_counter() - start
+    print(f"warm sequential: {elapsed / len(workload) * 1000:.1f} ms/image, {len(workload) / elapsed:.2f} images/s")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(encoder.encode, workload))
+    elapsed = time.perf_counter() - start
+    print(f"warm batched x{args.concurrency}: {elapsed / len(workload) * 1000:.1f} ms/image, "
+          f"{len(workload) / elapsed:.2f} images/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+'''
+Offline check of database/data_ingestion.py: a generated JSONL dataset is ingested into an
+in-memory mongomock collection, once per number of concurrent writers, then ingested again
+with a run interrupted after a few batches and resumed from its checkpoint.
+
+Reports the ingestion rate and checks that every row with a description is stored exactly
+once, with its Extended JSON fields decoded. Exits with status 1 when a check fails.
+
+Usage:
+    python benchmarks/bench_ingestion.py --rows 20000 --writers 1 4
+'''
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+import mongomock
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.checkpoint import Checkpoint
+from database.data_ingestion import ingest_data
+
+
+class InterruptedCollection():
+    """Collection failing every insert_many after the first `batches`, like a lost connection."""
+    def __init__(self, collection, batches):
+        self.collection = collection
+        self.batches = batches
+
+    def insert_many(self, documents, ordered=True):
+        if self.batches <= 0:
+            raise ConnectionError("simulated interruption")
+        self.batches -= 1
+        return self.collection.insert_many(documents, ordered=ordered)
+
+
+def write_dataset(path, rows, dim, seed=0):
+    # one row in ten has no description and is skipped by the ingestion
+    rng = np.random.default_rng(seed)
+    expected = 0
+    with open(path, 'w') as f:
+        for i in range(rows):
+            has_description = i % 10 != 9
+            expected += has_description
+            f.write(json.dumps({
+                "_id": str(i), "name": f"Listing {i}",
+                "description": f"Flat {i} near the beach" if has_description else None,
+                "last_scraped": {"$date": "2019-03-06T05:00:00Z"},
+                "price": {"$numberDecimal": f"{i % 500}.00"},
+                "text_embeddings": rng.normal(size=dim).round(4).tolist(),
+            }) + "\n")
+    return expected
+
+
+def check_collection(collection, expected):
+    failures = []
+    if collection.count_documents({}) != expected:
+        failures.append(f"{collection.count_documents({})} documents stored, {expected} expected")
+    if collection.count_documents({"description": None}):
+        failures.append("rows without a description were stored")
+    doc = collection.find_one({"_id": "0"})
+    if doc is None or not isinstance(doc["last_scraped"], datetime.datetime):
+        failures.append("$date was not decoded into a datetime")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--dim', type=int, default=32, help='size of the generated embedding of each row')
+    parser.add_argument('--batch_size', type=int, default=1000)
+    parser.add_argument('--writers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--interrupt_after', type=int, default=5, help='batches inserted before the interruption')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "airbnb.jsonl")
+        expected = write_dataset(source, args.rows, args.dim)
+        print(f"{args.rows} rows, {expected} with a description")
+        if args.interrupt_after * args.batch_size >= expected:
+            parser.error(f"--interrupt_after {args.interrupt_after} leaves no batch to resume, "
+                         f"{expected} documents make {-(-expected // args.batch_size)} batches")
+        failures = []
+
+        print(f"{'writers':>8}{'seconds':>9}{'docs/s':>9}")
+        for writers in args.writers:
+            collection = mongomock.MongoClient()["airbnb_dataset"]["airbnb_embeddings"]
+            start = time.perf_counter()
+            inserted = ingest_data(source, args.batch_size, writers, checkpoint_path=None, collection=collection)
+            elapsed = time.perf_counter() - start
+            print(f"{writers:>8}{elapsed:>9.2f}{inserted / elapsed:>9.0f}")
+            failures += [f"{writers} writers: {f}" for f in check_collection(collection, expected)]
+
+        # interrupted run, then resumed from the checkpoint; one writer, so the interruption
+        # always hits the same batch
+        checkpoint_path = os.path.join(tmp, "ingestion_checkpoint.json")
+        collection = mongomock.MongoClient()["airbnb_dataset"]["airbnb_embeddings"]
+        try:
+            ingest_data(source, args.batch_size, 1, checkpoint_path,
+                        InterruptedCollection(collection, args.interrupt_after))
+            failures.append("resume: the interruption was not raised")
+        except ConnectionError:
+            pass
+        checkpoint = Checkpoint(checkpoint_path)
+        print(f"interrupted at row {checkpoint.position} with {collection.count_documents({})} documents stored, "
+              f"{checkpoint.count} checkpointed")
+        if checkpoint.count != args.interrupt_after * args.batch_size:
+            failures.append(f"resume: {checkpoint.count} documents checkpointed, "
+                            f"{args.interrupt_after * args.batch_size} expected")
+        stored = collection.count_documents({})
+        resumed = ingest_data(source, args.batch_size, max(args.writers), checkpoint_path, collection)
+        print(f"resumed run inserted {resumed} documents")
+        if stored + resumed != expected:
+            failures.append(f"resume: {stored} + {resumed} documents inserted, {expected} expected")
+        failures += [f"resume: {f}" for f in check_collection(collection, expected)]
+        if os.path.exists(checkpoint_path):
+            failures.append("resume: the checkpoint was not cleared after the full run")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    print("ingestion check " + ("passed" if not failures else "FAILED"))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+'''
+Agreement and latency of the local query-intent classifier vs. the LLM classifier of RagAgent.
+
+The labelled queries are split in folds: each fold is classified by a classifier trained on
+the other folds. For each confidence threshold the report gives the share of queries decided
+locally, the agreement of the local decisions with the reference, the agreement of the
+local-then-LLM classifier as served, and the classifier latency saved per turn.
+
+The reference is the LLM classifier with --llm (its decisions and latencies are cached under
+.cache/evaluation), else the labels, with the LLM latency taken from --llm_ms.
+
+Usage:
+    python benchmarks/bench_intent_classifier.py
+    python benchmarks/bench_intent_classifier.py --llm
+'''
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+from utils.eval_runner import CACHE_DIR, JsonlStore, hash_key, run_concurrently
+from utils.intent_classifier import INTENT_EXAMPLES_PATH, IntentClassifier, load_examples
+
+
+def cross_validated_probabilities(texts, labels, folds, seed=0):
+    folds_of = np.random.default_rng(seed).permutation(len(texts)) % folds
+    probabilities = np.zeros(len(texts))
+    for fold in range(folds):
+        train, test = np.flatnonzero(folds_of != fold), np.flatnonzero(folds_of == fold)
+        classifier = IntentClassifier().fit([texts[i] for i in train], [labels[i] for i in train])
+        probabilities[test] = classifier.predict_proba([texts[i] for i in test])
+    return probabilities
+
+
+def llm_decisions(texts):
+    from langchain.chat_models import ChatOpenAI
+    from rag import RagAgent
+    # only the chat model is needed by classify_query
+    agent = RagAgent.__new__(RagAgent)
+    agent.chat = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+
+    def classify(text):
+        start = time.perf_counter()
+        label = agent.classify_query(text)
+        return {"label": label, "ms": (time.perf_counter() - start) * 1000}
+
+    store = JsonlStore(os.path.join(CACHE_DIR, "intent_llm.jsonl"))
+    results = run_concurrently({hash_key("intent", text): text for text in texts}, classify, store)
+    decisions = [results.get(hash_key("intent", text)) for text in texts]
+    return np.array([d["label"] if d else None for d in decisions]), np.array([d["ms"] for d in decisions if d])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--examples', default=INTENT_EXAMPLES_PATH)
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--confidence', type=float, nargs='+', default=[0.5, 0.6, 0.7, 0.8, 0.9])
+    parser.add_argument('--llm', action='store_true', help='compare with the LLM classifier (OpenAI)')
+    parser.add_argument('--llm_ms', type=float, default=600, help='LLM classifier latency without --llm')
+    args = parser.parse_args()
+
+    texts, labels = load_examples(args.examples)
+    labels = np.asarray(labels)
+    probabilities = cross_validated_probabilities(texts, list(labels), args.folds)
+    predictions = probabilities >= 0.5
+
+    classifier = IntentClassifier.from_examples(args.examples)
+    latencies = []
+    for text in texts:
+        start = time.perf_counter()
+        classifier.classify(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+    local_ms = float(np.mean(latencies))
+    print(f"{len(texts)} labelled queries, local classifier p50 {np.percentile(latencies, 50):.3f} ms, "
+          f"p99 {np.percentile(latencies, 99):.3f} ms")
+
+    reference, llm_ms = labels, args.llm_ms
+    if args.llm:
+        decisions, llm_latencies = llm_decisions(texts)
+        answered = np.array([d is not None for d in decisions])
+        texts = [t for t, a in zip(texts, answered) if a]
+        reference, labels = decisions[answered].astype(bool), labels[answered]
+        probabilities, predictions = probabilities[answered], predictions[answered]
+        llm_ms = float(np.mean(llm_latencies))
+        print(f"LLM classifier: {llm_ms:.0f} ms mean, agreement with the labels {np.mean(reference == labels):.3f}")
+    else:
+        print(f"reference: the labels, LLM latency {llm_ms:.0f} ms (assumed to agree with the labels)")
+
+    print(f"{'confidence':>10}{'local %':>9}{'local agree':>13}{'served agree':>14}{'LLM calls %':>13}{'saved ms/turn':>15}")
+    for confidence in args.confidence:
+        local = np.maximum(probabilities, 1 - probabilities) >= confidence
+        local_agree = np.mean(predictions[local] == reference[local]) if local.any() else float('nan')
+        # deferred queries get the LLM decision, i.e. the reference
+        served_agree = np.mean(np.where(local, predictions == reference, True))
+        saved = local.mean() * llm_ms - local_ms
+        print(f"{confidence:>10.2f}{local.mean() * 100:>9.1f}{local_agree:>13.3f}{served_agree:>14.3f}"
+              f"{(1 - local.mean()) * 100:>13.1f}{saved:>15.0f}")
+
+    disagreements = [(t, p) for t, p, r, c in zip(texts, probabilities, reference, predictions) if r != c]
+    for text, probability in disagreements[:10]:
+        print(f"  disagrees at p={probability:.2f}: {text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+'''
+Recall@10, latency and resident memory of the int8 and binary quantized local indexes
+(codes scan + full-precision rescoring of a shortlist) against exact float32 search, for both
+embedding families (1536-d descriptions, 512-d images) and a sweep of numCandidates. Indexes
+are saved and memory-mapped back as the app serves them.
+
+Usage:
+    python benchmarks/bench_quantization.py --n 50000
+    python benchmarks/bench_quantization.py --index_dir data/vectors
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+from bench_ann_index import recall_at_k, synthetic_corpus
+from search.vector_store import LocalVectorIndex, QuantizedIndex, QUANTIZATIONS, load_index
+
+FAMILIES = [("description_embedding", 1536), ("image_embeddings", 512)]
+
+
+def measure(index, queries, k, num_candidates):
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(index.search(query, k, num_candidates)[0])
+        latencies.append(time.perf_counter() - start)
+    return results, np.asarray(latencies) * 1000
+
+
+def resident_bytes(index):
+    # what every query reads, the rest stays on disk behind the memory map
+    if isinstance(index, QuantizedIndex):
+        extras = sum(a.nbytes for a in (index.scales, index.center) if a is not None)
+        return index.codes.nbytes + extras + index.ids.nbytes
+    return index.vectors.nbytes + index.ids.nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index_dir', default=None, help='directory of exported exact indexes, see database/export_vectors.py')
+    parser.add_argument('--n', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--num_candidates', type=int, nargs='+', default=[10, 50, 100, 200])
+    args = parser.parse_args()
+
+    per_listing = {"float32": 0, **{q: 0 for q in QUANTIZATIONS}}
+    print(f"{'field':<22}{'index':<9}{'numCandidates':>14}{'recall@' + str(args.k):>11}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'bytes/vec':>10}{'resident MB':>12}")
+    for path, dim in FAMILIES:
+        with tempfile.TemporaryDirectory() as tmp:
+            if args.index_dir:
+                exact = LocalVectorIndex.load(os.path.join(args.index_dir, path))
+                ids, vectors = np.array(exact.ids), exact.vectors
+            else:
+                vectors = synthetic_corpus(args.n, dim)
+                ids = np.arange(len(vectors))
+                LocalVectorIndex.build(ids, vectors).save(os.path.join(tmp, "exact"))
+                exact = load_index(os.path.join(tmp, "exact"))
+            rng = np.random.default_rng(1)
+            queries = np.asarray(vectors[rng.choice(len(vectors), args.queries, replace=False)])
+            queries = queries + 0.3 * rng.normal(size=queries.shape).astype(np.float32)
+
+            truth, latencies = measure(exact, queries, args.k, None)
+            per_listing["float32"] += exact.dimensions * 4
+            print(f"{path:<22}{'float32':<9}{'-':>14}{1.0:>11.3f}{np.percentile(latencies, 50):>9.2f}"
+                  f"{np.percentile(latencies, 95):>9.2f}{exact.dimensions * 4:>10}{resident_bytes(exact) / 2**20:>12.1f}")
+            for quantization in QUANTIZATIONS:
+                QuantizedIndex.quantize(ids, exact.vectors, quantization).save(os.path.join(tmp, quantization))
+                index = load_index(os.path.join(tmp, quantization))
+                per_listing[quantization] += index.bytes_per_vector()
+                # no rescoring: the scores estimated from the codes only
+                codes_only = QuantizedIndex(index.ids, None, quantization, index.codes, index.scales, index.center,
+                                            index.dimensions)
+                for label, candidates, searched in [("codes", args.k, codes_only), ("default", None, index)] + \
+                        [(str(c), c, index) for c in args.num_candidates]:
+                    results, latencies = measure(searched, queries, args.k, candidates)
+                    print(f"{path:<22}{quantization:<9}{label:>14}{recall_at_k(results, truth, args.k):>11.3f}"
+                          f"{np.percentile(latencies, 50):>9.2f}{np.percentile(latencies, 95):>9.2f}"
+                          f"{index.bytes_per_vector():>10.0f}{resident_bytes(index) / 2**20:>12.1f}")
+                del index, codes_only
+            del exact
+
+    print("resident bytes per listing (both fields): " +
+          ", ".join(f"{name} {size:.0f}" for name, size in per_listing.items()))
+
+
+if __name__ == "__main__":
+    main()
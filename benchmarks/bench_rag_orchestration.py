@@ -0,0 +1,116 @@
+'''
+Critical path of RagAgent.response_to_user with stubbed LLM and retrieval latencies:
+the old strictly sequential classify -> retrieve -> answer chain vs. the async orchestration
+that retrieves speculatively while the classifier runs, and the LLM classifier calls and
+retrievals saved by the local intent classifier on a mix of property and chit-chat turns.
+
+Usage:
+    python benchmarks/bench_rag_orchestration.py --llm_ms 600 --retrieval_ms 400
+'''
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+from rag import RagAgent
+from utils.context_builder import ContextBuilder
+from utils.intent_classifier import IntentClassifier
+
+MIXED_QUERIES = ["2 bedroom flat near the beach in Barcelona", "hi there, who are you?",
+                 "Can you suggest a place with a jacuzzi near the lake?", "what's the weather like in Porto?"]
+
+
+def fake_listing(i):
+    return {
+        "_id": i, "name": f"Listing {i}", "accommodates": 2, "summary": "summary", "description": "description",
+        "address": {"street": "street", "government_area": "area", "market": "Barcelona", "country": "Spain",
+                    "country_code": "ES", "location": {"type": "Point", "coordinates": [2.17, 41.38], "is_location_exact": True}},
+        "images": {"thumbnail_url": "", "medium_url": "", "picture_url": "", "xl_picture_url": ""},
+        "search_score": 1.0 / (i + 1), "reviews": [],
+    }
+
+
+class StubChat():
+    def __init__(self, latency, label):
+        self.latency = latency
+        self.label = label
+        self.classifier_calls = 0
+
+    def __call__(self, messages):
+        time.sleep(self.latency)
+        is_classifier = "query classifier" in messages[0].content
+        self.classifier_calls += is_classifier
+        return SimpleNamespace(content=self.label if is_classifier else "Here are some listings.")
+
+
+class StubSearch():
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def do_search(self, *args):
+        self.calls += 1
+        time.sleep(self.latency)
+        return [fake_listing(i) for i in range(10)]
+
+
+def stub_agent(llm_latency, retrieval_latency, label):
+    agent = RagAgent.__new__(RagAgent)
+    agent.chat = StubChat(llm_latency, label)
+    agent.hybrid_search = agent.semantic_search = agent.multimodal_search = StubSearch(retrieval_latency)
+    agent.executor = ThreadPoolExecutor(max_workers=8)
+    agent.semantic_cache = None
+    agent.intent_classifier = None
+    agent.context_builder = ContextBuilder()
+    return agent
+
+
+def sequential(agent, query, session_id):
+    # the order of the calls before the async orchestration
+    from utils.session_history import get_session_history
+    history = get_session_history(session_id)
+    is_property_query = agent.classify_query(query['text'])
+    context = agent.retrieve_knowledge(query) if is_property_query else []
+    return agent.chat(agent.build_messages(query, history, is_property_query, context)).content
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--llm_ms', type=float, default=600)
+    parser.add_argument('--retrieval_ms', type=float, default=400)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    query = {'text': "2 bedroom flat near the beach in Barcelona", 'files': []}
+    for label in ['yes', 'no']:
+        agent = stub_agent(args.llm_ms / 1000, args.retrieval_ms / 1000, label)
+        for name, run in [("sequential", lambda: sequential(agent, query, "bench-sequential")),
+                          ("async speculative", lambda: agent.response_to_user(query, "bench-async"))]:
+            start = time.perf_counter()
+            for _ in range(args.runs):
+                run()
+            elapsed = (time.perf_counter() - start) / args.runs
+            print(f"classifier={label:<4} {name:<18} {elapsed * 1000:8.1f} ms/request")
+
+    # the stubbed LLM classifier answers "yes" to every query it is asked about
+    local_classifier = IntentClassifier.from_examples()
+    for name, classifier in [("LLM classifier", None), ("local + LLM classifier", local_classifier)]:
+        agent = stub_agent(args.llm_ms / 1000, args.retrieval_ms / 1000, 'yes')
+        agent.intent_classifier = classifier
+        start = time.perf_counter()
+        for _ in range(args.runs):
+            for text in MIXED_QUERIES:
+                agent.response_to_user({'text': text, 'files': []}, "bench-mixed")
+        requests = args.runs * len(MIXED_QUERIES)
+        elapsed = (time.perf_counter() - start) / requests
+        # a discarded speculative retrieval still runs to the end in the thread pool
+        print(f"mixed turns {name:<24} {elapsed * 1000:8.1f} ms/request, "
+              f"{agent.chat.classifier_calls / requests:.2f} LLM classifier calls/request, "
+              f"{agent.hybrid_search.calls / requests:.2f} retrievals/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+'''
+Latency (p50/p95/p99) and throughput (QPS) of FullTextSearch, SemanticSearch, HybridSearch and
+MultiModalSearch against a local synthetic corpus, for a sweep of corpus size, limit,
+numCandidates and concurrency.
+
+The corpus has 1536-d text and 512-d image vectors. Query embeddings come from a deterministic
+fake embedder, and `LocalCollection` stands in for the Atlas collection: it answers `$vectorSearch`
+from the local vector indexes and `$search` from an in-memory BM25 index. Hybrid and multimodal
+searches run through the FusionExecutor, since the stand-in does not execute the server-side
+fusion pipelines. The numbers therefore measure the client code paths and the local engine, not
+a cluster round trip.
+
+Every run writes `search_<commit>_<timestamp>.json` and `.csv` to --out; pass a previous JSON
+as --baseline to print the relative change of each configuration.
+
+Usage:
+    python benchmarks/bench_search.py --corpus_sizes 1000 10000 --concurrency 1 4 16
+    python benchmarks/bench_search.py --baseline benchmarks/results/search_abc1234_20250101-120000.json
+'''
+import argparse
+import csv
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+from search import hybrid_search, multimodal_search, semantic_search
+from search.fulltext_search import FullTextSearch
+from search.fusion import FusionExecutor
+from search.hybrid_search import HybridSearch
+from search.multimodal_search import MultiModalSearch
+from search.semantic_search import SemanticSearch
+from search.vector_store import IVFIndex, LocalVectorBackend, LocalVectorIndex
+
+TEXT_DIM = 1536
+IMG_DIM = 512
+VOCABULARY = ("apartment flat loft studio house villa room bedroom bathroom kitchen balcony terrace garden pool "
+              "beach sea ocean view city centre downtown quiet cozy bright spacious modern renovated charming "
+              "family friends couple metro station bus airport restaurants bars shops park museum walk minutes "
+              "wifi parking air conditioning washer heating breakfast host welcome clean comfortable").split()
+MARKETS = ["Barcelona", "New York", "Sydney", "Porto", "Istanbul", "Montreal", "Hong Kong", "Rio De Janeiro"]
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def seeded_vector(key, dim):
+    rng = np.random.default_rng(zlib.crc32(key.encode("utf-8")))
+    return rng.normal(size=dim).astype(np.float32)
+
+
+def fake_text_embedding(text):
+    return seeded_vector(f"text:{text}", TEXT_DIM).tolist()
+
+
+def fake_img_embedding(img_path):
+    return seeded_vector(f"image:{img_path}", IMG_DIM).tolist()
+
+
+class FullTextIndex():
+    """In-memory BM25 over one text field, standing in for the Atlas Search index."""
+    def __init__(self, texts, k1=1.2, b=0.75):
+        self.k1, self.b = k1, b
+        postings = defaultdict(lambda: defaultdict(int))
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[i] = len(tokens)
+            for token in tokens:
+                postings[token][i] += 1
+        self.size = len(texts)
+        self.length_norm = 1 - b + b * lengths / max(lengths.mean(), 1)
+        self.postings = {token: (np.fromiter(docs.keys(), dtype=np.int64), np.fromiter(docs.values(), dtype=np.float32))
+                         for token, docs in postings.items()}
+
+    def search(self, query):
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in set(tokenize(query)):
+            if token not in self.postings:
+                continue
+            rows, tf = self.postings[token]
+            idf = np.log(1 + (self.size - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + self.k1 * self.length_norm[rows])
+        matched = np.flatnonzero(scores)
+        order = matched[np.argsort(-scores[matched], kind='stable')]
+        return order, scores[order]
+
+
+class LocalCollection():
+    """
+    Stand-in for the listings collection, enough for the pipelines of the search classes:
+    a leading `$vectorSearch` or `$search` stage followed by `$limit`, `$sort`, `$addFields`
+    and `$project` stages, and `find` by `_id` `$in`. Returned documents are always copies,
+    as a driver would decode fresh ones.
+    """
+    def __init__(self, docs, vector_backend, text_index):
+        self.docs = docs
+        self.positions = {doc["_id"]: i for i, doc in enumerate(docs)}
+        self.vector_backend = vector_backend
+        self.text_index = text_index
+
+    def _first_stage(self, stage):
+        if "$vectorSearch" in stage:
+            spec = stage["$vectorSearch"]
+            ids, scores = self.vector_backend.search(spec["path"], spec["queryVector"], spec.get("limit", 10),
+                                                     spec.get("numCandidates"))
+            return [(self.docs[self.positions[id_]], score) for id_, score in zip(ids, scores)]
+        if "$search" in stage:
+            spec = stage["$search"]
+            operator = spec.get("text") or spec.get("phrase")
+            rows, scores = self.text_index.search(operator["query"])
+            return [(self.docs[row], float(score)) for row, score in zip(rows, scores)]
+        raise NotImplementedError(f"unsupported first stage: {list(stage)}")
+
+    @staticmethod
+    def _value(value, doc, score):
+        if isinstance(value, dict) and "$meta" in value:
+            return score
+        if isinstance(value, str) and value.startswith("$"):
+            return doc.get(value[1:])
+        return value
+
+    def aggregate(self, pipeline):
+        docs = self._first_stage(pipeline[0])
+        for stage in pipeline[1:]:
+            if "$limit" in stage:
+                docs = docs[:stage["$limit"]]
+            elif "$sort" in stage:
+                for key, direction in reversed(list(stage["$sort"].items())):
+                    docs.sort(key=lambda item: item[0].get(key, 0), reverse=direction < 0)
+            elif "$addFields" in stage:
+                docs = [({**doc, **{key: self._value(value, doc, score) for key, value in stage["$addFields"].items()}},
+                         score) for doc, score in docs]
+            elif "$project" in stage:
+                projected = []
+                for doc, score in docs:
+                    out = {"_id": doc["_id"]}
+                    for key, value in stage["$project"].items():
+                        if value == 1 or value is True:
+                            if key in doc:
+                                out[key] = doc[key]
+                        elif value != 0:
+                            out[key] = self._value(value, doc, score)
+                    projected.append((out, score))
+                docs = projected
+            else:
+                raise NotImplementedError(f"unsupported stage: {list(stage)}")
+        return iter([dict(doc) for doc, _ in docs])
+
+    def find(self, filter, projection=None):
+        ids = filter["_id"]["$in"]
+        fields = [key for key, value in (projection or {}).items() if value]
+        for id_ in ids:
+            if id_ in self.positions:
+                doc = self.docs[self.positions[id_]]
+                yield {"_id": id_, **{key: doc[key] for key in fields if key in doc}} if fields else dict(doc)
+
+
+def synthetic_listings(n, seed=0):
+    rng = np.random.default_rng(seed)
+    words = np.asarray(VOCABULARY)
+    docs = []
+    for i in range(n):
+        market = MARKETS[i % len(MARKETS)]
+        docs.append({
+            "_id": str(10000000 + i),
+            "listing_url": f"https://www.airbnb.com/rooms/{10000000 + i}",
+            "name": " ".join(rng.choice(words, 4)).capitalize(),
+            "accommodates": int(rng.integers(1, 9)),
+            "summary": " ".join(rng.choice(words, 20)),
+            "description": " ".join(rng.choice(words, int(rng.integers(40, 160)))),
+            "neighborhood_overview": " ".join(rng.choice(words, 30)),
+            "notes": "",
+            "address": {"street": f"{market}, Street {i}", "government_area": "Centre", "market": market,
+                        "country": "Country", "country_code": "CC",
+                        "location": {"type": "Point", "coordinates": [0.0, 0.0], "is_location_exact": True}},
+            "images": {"thumbnail_url": "", "medium_url": "", "xl_picture_url": "",
+                       "picture_url": f"https://a0.muscache.com/im/pictures/{i}.jpg"},
+            "reviews": [{"_id": str(j), "comments": " ".join(rng.choice(words, 25))}
+                        for j in range(int(rng.integers(0, 20)))],
+        })
+    return docs
+
+
+def synthetic_vectors(n, dim, clusters=64, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    return centers[rng.integers(0, clusters, n)] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def build_collection(n, index_type):
+    docs = synthetic_listings(n)
+    ids = [doc["_id"] for doc in docs]
+    indexes = {}
+    for path, dim, seed in [("description_embedding", TEXT_DIM, 1), ("image_embeddings", IMG_DIM, 2)]:
+        vectors = synthetic_vectors(n, dim, seed=seed)
+        if index_type == "ivf":
+            indexes[path] = IVFIndex.train(ids, vectors)
+        else:
+            indexes[path] = LocalVectorIndex.build(ids, vectors)
+    text_index = FullTextIndex([doc["description"] for doc in docs])
+    return LocalCollection(docs, LocalVectorBackend(indexes), text_index)
+
+
+def use_fake_embedder():
+    for module in (semantic_search, hybrid_search, multimodal_search):
+        module.get_text_embedding = fake_text_embedding
+    multimodal_search.get_img_embedding = fake_img_embedding
+
+
+def search_configs(collection, fusion, limit, num_candidates, two_phase=False):
+    """Name, query function and the numCandidates it uses, of each search class."""
+    fulltext = FullTextSearch(collection, limit=limit, two_phase=two_phase)
+    semantic = SemanticSearch(collection, num_candidates=num_candidates, limit=limit, two_phase=two_phase)
+    hybrid = HybridSearch(collection, fusion=fusion, num_candidates=num_candidates, limit=limit, two_phase=two_phase)
+    multimodal = MultiModalSearch(collection, fusion=fusion, num_candidates=num_candidates, top_k=limit,
+                                  two_phase=two_phase)
+    return [
+        ("fulltext", lambda q: list(fulltext.do_search(q["text"])), None),
+        ("semantic", lambda q: list(semantic.do_search(q["text"])), num_candidates),
+        ("hybrid", lambda q: list(hybrid.do_search(q["text"])), num_candidates),
+        ("multimodal", lambda q: list(multimodal.do_search(q["text"], q["image"])), num_candidates),
+        ("image_only", lambda q: list(multimodal.do_search(None, q["image"])), num_candidates),
+    ]
+
+
+def run_load(func, queries, concurrency):
+    """Run every query once with `concurrency` callers and time each call and the whole run."""
+    def timed(query):
+        start = time.perf_counter()
+        try:
+            func(query)
+            return time.perf_counter() - start, False
+        except Exception:
+            return time.perf_counter() - start, True
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        outcomes = list(pool.map(timed, queries))
+        wall = time.perf_counter() - start
+    latencies = np.array([latency for latency, _ in outcomes]) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"queries": len(queries), "errors": sum(failed for _, failed in outcomes),
+            "mean_ms": float(latencies.mean()), "p50_ms": float(p50), "p95_ms": float(p95),
+            "p99_ms": float(p99), "qps": len(queries) / wall}
+
+
+def synthetic_queries(n, seed=1):
+    rng = np.random.default_rng(seed)
+    words = np.asarray(VOCABULARY)
+    return [{"text": " ".join(rng.choice(words, int(rng.integers(3, 9)))), "image": f"query_images/{i}.jpg"}
+            for i in range(n)]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+ROW_KEY = ("search", "corpus_size", "limit", "num_candidates", "concurrency")
+CSV_FIELDS = list(ROW_KEY) + ["queries", "errors", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "qps"]
+
+
+def save_results(rows, meta, directory):
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, f"search_{meta['commit']}_{meta['timestamp']}")
+    with open(stem + ".json", "w") as f:
+        json.dump({"meta": meta, "results": rows}, f, indent=2)
+    with open(stem + ".csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return stem
+
+
+def compare(rows, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {tuple(row[key] for key in ROW_KEY): row for row in baseline["results"]}
+    print(f"\nChange vs. {baseline['meta']['commit']} (p95 latency, QPS):")
+    for row in rows:
+        old = previous.get(tuple(row[key] for key in ROW_KEY))
+        if old is None:
+            continue
+        print(f"{row['search']:<11} n={row['corpus_size']:<7} limit={row['limit']:<4} "
+              f"numCandidates={str(row['num_candidates']):<5} c={row['concurrency']:<3} "
+              f"p95 {100 * (row['p95_ms'] / old['p95_ms'] - 1):+6.1f}%  qps {100 * (row['qps'] / old['qps'] - 1):+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus_sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--limits', type=int, nargs='+', default=[10, 20])
+    parser.add_argument('--num_candidates', type=int, nargs='+', default=[100, 150, 300])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--index', choices=['exact', 'ivf'], default='exact')
+    parser.add_argument('--two_phase', action='store_true', help='rank on ids and scores, then hydrate the results')
+    parser.add_argument('--searches', nargs='+', default=None, help='subset of fulltext semantic hybrid multimodal image_only')
+    parser.add_argument('--out', default='benchmarks/results')
+    parser.add_argument('--baseline', default=None, help='previous results JSON to compare against')
+    args = parser.parse_args()
+
+    use_fake_embedder()
+    queries = synthetic_queries(args.queries)
+    rows = []
+    for corpus_size in args.corpus_sizes:
+        start = time.perf_counter()
+        collection = build_collection(corpus_size, args.index)
+        fusion = FusionExecutor(collection, collection.vector_backend)
+        print(f"corpus of {corpus_size} listings built in {time.perf_counter() - start:.1f}s")
+        for limit in args.limits:
+            for i, num_candidates in enumerate(args.num_candidates):
+                if num_candidates < limit:
+                    continue  # rejected by $vectorSearch
+                for name, func, used_candidates in search_configs(collection, fusion, limit, num_candidates, args.two_phase):
+                    if args.searches and name not in args.searches:
+                        continue
+                    if used_candidates is None and i > 0:
+                        continue  # not affected by numCandidates, measured once per limit
+                    for query in queries[:5]:
+                        func(query)  # warm-up
+                    for concurrency in args.concurrency:
+                        row = {"search": name, "corpus_size": corpus_size, "limit": limit,
+                               "num_candidates": used_candidates, "concurrency": concurrency,
+                               **run_load(func, queries, concurrency)}
+                        rows.append(row)
+                        print(f"{name:<11} n={corpus_size:<7} limit={limit:<4} numCandidates={str(used_candidates):<5} "
+                              f"c={concurrency:<3} p50 {row['p50_ms']:7.2f} ms  p95 {row['p95_ms']:7.2f} ms  "
+                              f"p99 {row['p99_ms']:7.2f} ms  {row['qps']:8.1f} QPS"
+                              + (f"  errors {row['errors']}" if row['errors'] else ""))
+        fusion.pool.shutdown()
+
+    meta = {"commit": git_commit(), "timestamp": time.strftime("%Y%m%d-%H%M%S"), "index": args.index, "two_phase": args.two_phase,
+            "python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+            "cpus": os.cpu_count(), "args": vars(args)}
+    print(f"\nresults written to {save_results(rows, meta, args.out)}.json/.csv")
+    if args.baseline:
+        compare(rows, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
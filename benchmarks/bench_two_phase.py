@@ -0,0 +1,112 @@
+'''
+Bytes on the wire per query of each search class, returning full documents vs. two-phase
+retrieval (rank on ids and scores, then hydrate the final listings with a projection and
+sliced reviews), with the client-side BSON decoding time and end-to-end latency. Runs on the
+live collection (needs MONGODB_URI and OPENAI_API_KEY; query embeddings are cached after the
+first run).
+
+Usage:
+    python benchmarks/bench_two_phase.py --runs 3
+    python benchmarks/bench_two_phase.py --client_side_fusion
+'''
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import bson
+import numpy as np
+from dotenv import load_dotenv
+from pymongo import MongoClient, monitoring
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+from search.fulltext_search import FullTextSearch
+from search.fusion import FusionExecutor
+from search.hybrid_search import HybridSearch
+from search.semantic_search import SemanticSearch
+from utils.mongodb import COLLECTION_NAME, DB_NAME
+
+QUERIES = [
+    "Fully furnished 3+1 flat decorated with vintage style.",
+    "2 bedroom flat near the beach in Barcelona",
+    "Quiet studio close to the metro with a fast wifi connection",
+    "Large family house with a garden and a swimming pool",
+    "Cozy loft in the city center with a view of the harbour",
+]
+READ_COMMANDS = {"aggregate", "find", "getMore"}
+
+
+class ReplySizes(monitoring.CommandListener):
+    """Sums the BSON size of the replies of read commands, and the time to decode them again."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.bytes, self.commands, self.decode_s = 0, 0, 0.0
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if event.command_name not in READ_COMMANDS:
+            return
+        raw = bson.encode(event.reply)
+        start = time.perf_counter()
+        bson.decode(raw)
+        decode_s = time.perf_counter() - start
+        with self._lock:
+            self.bytes += len(raw)
+            self.commands += 1
+            self.decode_s += decode_s
+
+    def failed(self, event):
+        pass
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--client_side_fusion', action='store_true', help='also measure HybridSearch with a FusionExecutor')
+    args = parser.parse_args()
+
+    listener = ReplySizes()
+    collection = MongoClient(os.getenv('MONGODB_URI'), event_listeners=[listener])[DB_NAME][COLLECTION_NAME]
+    configs = {}
+    for two_phase in (False, True):
+        mode = "two-phase" if two_phase else "full documents"
+        configs[("fulltext", mode)] = FullTextSearch(collection, two_phase=two_phase).do_search
+        configs[("semantic", mode)] = SemanticSearch(collection, two_phase=two_phase).do_search
+        configs[("hybrid", mode)] = HybridSearch(collection, two_phase=two_phase).do_search
+        if args.client_side_fusion:
+            configs[("hybrid fusion", mode)] = HybridSearch(collection, fusion=FusionExecutor(collection),
+                                                            two_phase=two_phase).do_search
+
+    for search in configs.values():
+        list(search(QUERIES[0]))  # warm up connections and the embedding cache
+
+    results = defaultdict(lambda: {"bytes": [], "commands": [], "decode_ms": [], "latency_ms": []})
+    for _ in range(args.runs):
+        for query in QUERIES:
+            for key, search in configs.items():
+                listener.reset()
+                start = time.perf_counter()
+                list(search(query))
+                elapsed = time.perf_counter() - start
+                results[key]["bytes"].append(listener.bytes)
+                results[key]["commands"].append(listener.commands)
+                results[key]["decode_ms"].append(listener.decode_s * 1000)
+                results[key]["latency_ms"].append(elapsed * 1000)
+
+    print(f"{'search':<14} {'mode':<15} {'KiB/query':>10} {'commands':>9} {'decode ms':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for (name, mode), values in results.items():
+        latencies = np.asarray(values["latency_ms"])
+        print(f"{name:<14} {mode:<15} {np.mean(values['bytes']) / 1024:10.1f} {np.mean(values['commands']):9.1f} "
+              f"{np.mean(values['decode_ms']):10.2f} {np.percentile(latencies, 50):8.1f} {np.percentile(latencies, 95):8.1f}")
+
+
+if __name__ == "__main__":
+    main()
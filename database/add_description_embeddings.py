@@ -1,108 +1,228 @@
-from database.mongodb_utils import get_text_embedding, get_collection
+from database.mongodb_utils import get_text_embedding_cache, get_collection
+from database.checkpoint import Checkpoint
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pymongo import UpdateOne
 from tqdm import tqdm
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+import random
+import time
+import openai
 
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # not installed, or the encoding file cannot be fetched
+    _encoding = None
 
-def get_documents_without_embeddings(limit: int = None) -> List[Dict[str, Any]]:
+MAX_TOKENS_PER_REQUEST = 100000  # the embeddings API rejects requests above 300k tokens
+MAX_INPUTS_PER_REQUEST = 256  # and above 2048 inputs
+MAX_TOKENS_PER_INPUT = 8191
+MAX_CONCURRENT_REQUESTS = 4
+MAX_RETRIES = 6
+CHECKPOINT_PATH = ".cache/description_embeddings_checkpoint.json"
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when available, otherwise estimate ~4 characters per token."""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def truncate_tokens(text: str, max_tokens: int = MAX_TOKENS_PER_INPUT) -> str:
+    """Cut a text to its first `max_tokens` tokens, the most the embeddings API accepts for one input."""
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else _encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 3]  # without tiktoken, assume no more than 3 characters per token
+
+
+def get_documents_without_embeddings(limit: int = None, after_id: Any = None) -> Iterable[Dict[str, Any]]:
     """
-    Get documents that have descriptions but no embeddings.
-    
+    Stream documents that have descriptions but no embeddings, in `_id` order.
+
     Args:
         limit (int, optional): Maximum number of documents to return. Defaults to None.
-    
+        after_id (optional): Only return documents with a larger `_id`, used to resume. Defaults to None.
+
     Returns:
-        List[Dict[str, Any]]: List of documents
+        Iterable[Dict[str, Any]]: Cursor over `_id` and `description` of the documents
     """
     collection = get_collection()
     query = {
         "description": {"$exists": True, "$ne": None},
         "description_embedding": {"$exists": False}  # Changed back to check if field doesn't exist
     }
-    
+    if after_id is not None:
+        query["_id"] = {"$gt": after_id}
+
+    cursor = collection.find(query, {"description": 1}).sort("_id", 1).batch_size(1000)
     if limit:
-        return list(collection.find(query).limit(limit))
-    return list(collection.find(query))
+        cursor = cursor.limit(limit)
+    return cursor
+
+def pack_requests(documents: Iterable[Dict[str, Any]], max_tokens: int = MAX_TOKENS_PER_REQUEST,
+                  max_inputs: int = MAX_INPUTS_PER_REQUEST) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Group documents into embedding requests bounded by input count and token count.
+
+    Args:
+        documents (Iterable[Dict[str, Any]]): Documents to process
+        max_tokens (int, optional): Token budget of one request
+        max_inputs (int, optional): Maximum number of inputs of one request
+
+    Returns:
+        Iterator[List[Dict[str, Any]]]: Batches of documents, in the input order
+    """
+    batch, batch_tokens = [], 0
+    for doc in documents:
+        description = doc.get('description')
+        if not description or not isinstance(description, str) or not description.strip():
+            continue
+        tokens = count_tokens(description)
+        if tokens > MAX_TOKENS_PER_INPUT:
+            doc['description'] = truncate_tokens(description)
+            tokens = MAX_TOKENS_PER_INPUT
+        if batch and (len(batch) >= max_inputs or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(doc)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def embed_descriptions(descriptions: List[str]) -> List[List[float]]:
+    """Embed descriptions with a single API request, backing off exponentially when rate limited."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return get_text_embedding_cache().get_many(descriptions)
+        except RETRYABLE_ERRORS as e:
+            if attempt == MAX_RETRIES:
+                raise
+            retry_after = None
+            response = getattr(e, 'response', None)
+            if response is not None:
+                retry_after = response.headers.get('retry-after')
+            delay = float(retry_after) if retry_after else min(60, 2 ** attempt) * (0.5 + random.random())
+            print(f"Embedding request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
 
 def generate_embeddings_for_documents(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
-    Generate embeddings for descriptions in documents.
-    
+    Generate embeddings for descriptions in documents with a single API request.
+
+    A request rejected as invalid is split in halves and retried, down to the documents the
+    API rejects on their own, which are skipped and logged so the batch can still finish.
+
     Args:
         documents (List[Dict[str, Any]]): List of documents to process
-    
+
     Returns:
         List[Dict[str, Any]]: List of documents with their embeddings
     """
+    try:
+        embeddings = embed_descriptions([doc['description'] for doc in documents])
+    except openai.BadRequestError as e:
+        if len(documents) == 1:
+            print(f"Skipping document {documents[0]['_id']}, its description was rejected: {e}")
+            return []
+        middle = len(documents) // 2
+        return generate_embeddings_for_documents(documents[:middle]) + \
+            generate_embeddings_for_documents(documents[middle:])
+
     documents_with_embeddings = []
-    
-    for doc in documents:
-        description = doc['description']
-        if description:
-                       
-            embedding = get_text_embedding(description)
-            if embedding:
-                doc['description_embedding'] = embedding
-                documents_with_embeddings.append(doc)
-    
+    for doc, embedding in zip(documents, embeddings):
+        if embedding:
+            documents_with_embeddings.append({"_id": doc["_id"], "description_embedding": embedding})
     return documents_with_embeddings
 
-def update_documents_with_embeddings(documents: List[Dict[str, Any]]) -> int:
+def update_documents_with_embeddings(documents: List[Dict[str, Any]], collection=None) -> int:
     """
-    Update documents in the collection with their embeddings.
-    
+    Update documents in the collection with their embeddings using one unordered bulk write.
+
     Args:
         documents (List[Dict[str, Any]]): List of documents with embeddings
-    
+        collection (optional): Collection to write to. Defaults to get_collection().
+
     Returns:
         int: Number of documents updated
     """
     if not documents:
         return 0
-        
-    collection = get_collection()
-    updated_count = 0
-    
-    for doc in documents:
-        result = collection.update_one(
-            {"_id": doc["_id"]},
-            {"$set": {"description_embedding": doc["description_embedding"]}}
-        )
-        updated_count += result.modified_count
-    
-    return updated_count
-
-def add_description_embeddings(limit: int = None):
+
+    collection = collection if collection is not None else get_collection()
+    result = collection.bulk_write([
+        UpdateOne({"_id": doc["_id"]}, {"$set": {"description_embedding": doc["description_embedding"]}})
+        for doc in documents
+    ], ordered=False)
+    return result.modified_count
+
+
+def add_description_embeddings(limit: int = None, max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+                               max_tokens: int = MAX_TOKENS_PER_REQUEST, max_inputs: int = MAX_INPUTS_PER_REQUEST,
+                               checkpoint_path: Optional[str] = CHECKPOINT_PATH):
     """
     Main function to update description embeddings.
-    
+
+    Streams pending documents, packs them into token-bounded embedding requests, runs up to
+    `max_concurrency` requests at a time and writes each batch with an unordered bulk write.
+    Progress is checkpointed so an interrupted run resumes where it stopped.
+
     Args:
         limit (int, optional): Maximum number of documents to process. Defaults to None.
+        max_concurrency (int, optional): Number of embedding requests in flight.
+        max_tokens (int, optional): Token budget of one embedding request.
+        max_inputs (int, optional): Maximum number of descriptions in one embedding request.
+        checkpoint_path (str, optional): Checkpoint file, None to disable resuming.
     """
-    # Step 1: Get documents without embeddings
-    documents = get_documents_without_embeddings(limit)
-    print(f"Found {len(documents)} documents to process")
-    
-    # Process documents in batches of 50
-    batch_size = 50
-    total_updated = 0
-    
-    for i in tqdm(range(0, len(documents), batch_size), desc="Processing batches"):
-        batch = documents[i:i + batch_size]
-        print(f"\nProcessing batch {i//batch_size + 1} ({len(batch)} documents)")
-        
-        # Step 2: Generate embeddings for current batch
-        print("Step 2: Generating embeddings...")
-        batch_with_embeddings = generate_embeddings_for_documents(batch)
-        
-        # Step 3: Update documents for current batch
-        print("Step 3: Updating documents...")
-        updated_count = update_documents_with_embeddings(batch_with_embeddings)
-        total_updated += updated_count
-        print(f"Updated {updated_count} documents in this batch")
-        print(f"Total documents updated so far: {total_updated}")
-    
-    print(f"\nAll batches processed. Total documents updated: {total_updated}")
+    collection = get_collection()
+    checkpoint = Checkpoint(checkpoint_path)
+    if checkpoint.position is not None:
+        print(f"Resuming after _id {checkpoint.position} ({checkpoint.count} documents already updated)")
+
+    documents = get_documents_without_embeddings(limit, after_id=checkpoint.position)
+    batches = pack_requests(documents, max_tokens=max_tokens, max_inputs=max_inputs)
+
+    def process(batch):
+        return update_documents_with_embeddings(generate_embeddings_for_documents(batch), collection)
+
+    start = time.perf_counter()
+    processed = 0
+    progress = tqdm(desc="Embedding descriptions", unit="doc")
+
+    def finish(done):
+        nonlocal processed
+        error = None
+        for future in done:
+            finished_no, finished_batch = in_flight.pop(future)
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            checkpoint.finish(finished_no, finished_batch[-1]["_id"], future.result())
+            processed += len(finished_batch)
+            progress.update(len(finished_batch))
+        # checkpoint the batches that succeeded alongside a failed one before giving up
+        if error is not None:
+            raise error
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        in_flight = {}
+        for batch_no, batch in enumerate(batches):
+            # keep a bounded number of batches in memory
+            if len(in_flight) >= max_concurrency * 2:
+                finish(wait(in_flight, return_when=FIRST_COMPLETED).done)
+            in_flight[pool.submit(process, batch)] = (batch_no, batch)
+        if in_flight:
+            finish(wait(in_flight).done)
+    progress.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"\nAll batches processed. {processed} documents in {elapsed:.1f}s "
+          f"({processed / elapsed if elapsed else 0:.1f} docs/s). Total documents updated: {checkpoint.count}")
+    checkpoint.clear()
     return
 
 if __name__ == "__main__":
-    add_description_embeddings(limit=None) 
\ No newline at end of file
+    add_description_embeddings(limit=None)
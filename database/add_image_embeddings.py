@@ -0,0 +1,310 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+from tqdm import tqdm
+from app.utils.image_encoder import DEFAULT_CLIP_MODEL_PATH, ImageEncoder
+from app.utils.image_fetcher import ImageFetcher, ImageFetchError, decode_image
+from database.checkpoint import Checkpoint
+from database.mongodb_utils import get_collection
+
+IMG_EMBED_FIELD = "image_embeddings"
+BATCH_SIZE = 32  # images per CLIP forward pass, and per bulk write
+DOWNLOAD_WORKERS = 32
+PREPROCESS_WORKERS = max((os.cpu_count() or 2) // 2, 1)
+PREFETCH_BATCHES = 4  # batches downloaded and preprocessed ahead of inference
+CHECKPOINT_PATH = ".cache/image_embeddings_checkpoint.json"
+
+_processor = None
+
+
+def get_documents_without_image_embeddings(limit: int = None, after_id: Any = None) -> Iterable[Dict[str, Any]]:
+    """
+    Stream documents that have a picture URL but no image embeddings, in `_id` order.
+
+    Args:
+        limit (int, optional): Maximum number of documents to return. Defaults to None.
+        after_id (optional): Only return documents with a larger `_id`, used to resume. Defaults to None.
+
+    Returns:
+        Iterable[Dict[str, Any]]: Cursor over `_id` and `images.picture_url` of the documents
+    """
+    collection = get_collection()
+    query = {
+        "images.picture_url": {"$exists": True, "$nin": [None, ""]},
+        IMG_EMBED_FIELD: {"$exists": False}
+    }
+    if after_id is not None:
+        query["_id"] = {"$gt": after_id}
+
+    cursor = collection.find(query, {"images.picture_url": 1}).sort("_id", 1).batch_size(1000)
+    if limit:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+def chunked(documents: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    iterator = iter(documents)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+class StageStats():
+    """Images and busy time of each pipeline stage, summed over the workers of the stage."""
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.images = defaultdict(int)
+        self.seconds = defaultdict(float)
+
+    def add(self, stage: str, images: int, seconds: float) -> None:
+        with self._lock:
+            self.images[stage] += images
+            self.seconds[stage] += seconds
+
+    def report(self, workers: Dict[str, int], elapsed: float) -> str:
+        """
+        Throughput of each stage if it were the only one running, i.e. its images per busy
+        second times its number of workers; the slowest stage bounds the pipeline.
+        """
+        lines = []
+        for stage in ["download", "preprocess", "inference", "write"]:
+            seconds = self.seconds[stage]
+            capacity = self.images[stage] / seconds * workers[stage] if seconds else 0.0
+            lines.append(f"{stage:<11} {self.images[stage]:7d} images {seconds:8.1f}s busy x{workers[stage]:<3d}"
+                         f" -> {capacity:8.1f} images/s")
+        done = self.images["write"]
+        lines.append(f"{'pipeline':<11} {done:7d} images {elapsed:8.1f}s wall     -> "
+                     f"{done / elapsed if elapsed else 0:8.1f} images/s")
+        return "\n".join(lines)
+
+
+def download(fetcher: ImageFetcher, url: str, stats: StageStats) -> Optional[bytes]:
+    start = time.perf_counter()
+    try:
+        return fetcher.fetch(url)
+    except ImageFetchError as e:
+        print(f"Error in downloading image: {e}")
+        return None
+    finally:
+        stats.add("download", 1, time.perf_counter() - start)
+
+
+def init_preprocess_worker(model_path: str) -> None:
+    global _processor
+    import torch
+    from transformers import CLIPProcessor
+    torch.set_num_threads(1)  # the worker processes already use the cores
+    _processor = CLIPProcessor.from_pretrained(model_path, use_fast=True)
+
+
+def preprocess_images(contents: List[bytes]) -> Tuple[List[int], Optional[np.ndarray], float]:
+    """
+    Decode and preprocess images in a worker process.
+
+    Args:
+        contents (List[bytes]): Encoded images
+
+    Returns:
+        Tuple of (positions of the images that could be decoded, their CLIP pixel values of
+        shape (n, 3, 224, 224), seconds spent)
+    """
+    start = time.perf_counter()
+    positions, images = [], []
+    for i, data in enumerate(contents):
+        try:
+            images.append(decode_image(data))
+            positions.append(i)
+        except Exception as e:
+            print(f"Error in decoding image: {e}")
+    pixel_values = None
+    if images:
+        pixel_values = _processor(images=images, return_tensors="pt")["pixel_values"].numpy()
+    return positions, pixel_values, time.perf_counter() - start
+
+
+def update_documents_with_image_embeddings(documents: List[Dict[str, Any]], collection=None) -> int:
+    """
+    Update documents in the collection with their image embeddings using one unordered bulk write.
+
+    Args:
+        documents (List[Dict[str, Any]]): List of `_id` and image embeddings
+        collection (optional): Collection to write to. Defaults to get_collection().
+
+    Returns:
+        int: Number of documents updated
+    """
+    if not documents:
+        return 0
+
+    collection = collection if collection is not None else get_collection()
+    result = collection.bulk_write([
+        UpdateOne({"_id": doc["_id"]}, {"$set": {IMG_EMBED_FIELD: doc[IMG_EMBED_FIELD]}})
+        for doc in documents
+    ], ordered=False)
+    return result.modified_count
+
+
+class BatchWriter():
+    """
+    Writes the embeddings of encoded batches with unordered bulk writes on a background thread,
+    so inference continues while a batch is written, and checkpoints each written batch.
+
+    At most `max_pending` batches wait for the writer. A failed write is raised once the
+    batches finished with it are checkpointed, so a resumed run does not redo them.
+    """
+    def __init__(self, collection, checkpoint: Checkpoint, stats: StageStats, progress: Optional[tqdm] = None,
+                 max_pending: int = 2) -> None:
+        self.collection = collection
+        self.checkpoint = checkpoint
+        self.stats = stats
+        self.progress = progress
+        self.max_pending = max_pending
+        self.pending = {}
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-writer")
+
+    def __enter__(self) -> "BatchWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self._pool.shutdown()
+        return False
+
+    def _write(self, ids: List[Any], embeddings: List[List[float]]) -> int:
+        start = time.perf_counter()
+        count = update_documents_with_image_embeddings(
+            [{"_id": _id, IMG_EMBED_FIELD: embedding} for _id, embedding in zip(ids, embeddings)], self.collection)
+        self.stats.add("write", len(ids), time.perf_counter() - start)
+        return count
+
+    def _finish(self, done) -> None:
+        error = None
+        for future in done:
+            batch_no, batch = self.pending.pop(future)
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            self.checkpoint.finish(batch_no, batch[-1]["_id"], future.result())
+            if self.progress is not None:
+                self.progress.update(len(batch))
+        if error is not None:
+            raise error
+
+    def submit(self, batch_no: int, batch: List[Dict[str, Any]], ids: List[Any], embeddings: List[List[float]]) -> None:
+        """
+        Queue the write of a batch, waiting for an earlier write when `max_pending` are queued.
+        Args:
+            batch_no: Sequence number of the batch
+            batch: Documents of the batch, the checkpoint advances to the `_id` of the last one
+            ids: `_id` of the documents whose picture was encoded
+            embeddings: Image embeddings of `ids`
+        """
+        self.pending[self._pool.submit(self._write, ids, embeddings)] = (batch_no, batch)
+        if len(self.pending) >= self.max_pending:
+            self._finish(wait(self.pending, return_when=FIRST_COMPLETED).done)
+
+    def flush(self) -> None:
+        """Wait for every queued write."""
+        if self.pending:
+            self._finish(wait(self.pending).done)
+
+
+def add_image_embeddings(limit: int = None, batch_size: int = BATCH_SIZE, download_workers: int = DOWNLOAD_WORKERS,
+                         preprocess_workers: int = PREPROCESS_WORKERS, model_path: str = DEFAULT_CLIP_MODEL_PATH,
+                         checkpoint_path: Optional[str] = CHECKPOINT_PATH):
+    """
+    Main function to backfill the image embeddings of the listing pictures.
+
+    A pipeline of four stages, each with its own workers: pictures are downloaded by a thread
+    pool over pooled HTTP connections, decoded and preprocessed in worker processes, encoded by
+    CLIP in batches on the main thread, and written with unordered bulk writes. Up to
+    `PREFETCH_BATCHES` batches are downloaded and preprocessed ahead of inference. Pictures
+    that cannot be downloaded or decoded are skipped and left for a later run. Progress is
+    checkpointed so an interrupted run resumes where it stopped, and the throughput of each
+    stage is reported at the end.
+
+    Args:
+        limit (int, optional): Maximum number of documents to process. Defaults to None.
+        batch_size (int, optional): Images per CLIP forward pass and per bulk write.
+        download_workers (int, optional): Number of concurrent downloads.
+        preprocess_workers (int, optional): Number of decoding and preprocessing processes.
+        model_path (str, optional): Hugging Face id or local path of the CLIP model.
+        checkpoint_path (str, optional): Checkpoint file, None to disable resuming.
+    """
+    collection = get_collection()
+    checkpoint = Checkpoint(checkpoint_path)
+    if checkpoint.position is not None:
+        print(f"Resuming after _id {checkpoint.position} ({checkpoint.count} documents already updated)")
+
+    documents = get_documents_without_image_embeddings(limit, after_id=checkpoint.position)
+    batches = enumerate(chunked(documents, batch_size))
+    stats = StageStats()
+    fetcher = ImageFetcher(pool_size=download_workers)
+    encoder = ImageEncoder(model_path, max_batch_size=batch_size)
+
+    # spawned rather than forked, a fork of a process running torch threads can deadlock
+    with ThreadPoolExecutor(max_workers=download_workers) as downloads, \
+            ProcessPoolExecutor(max_workers=preprocess_workers, mp_context=multiprocessing.get_context("spawn"),
+                                initializer=init_preprocess_worker, initargs=(model_path,)) as preprocessing, \
+            ThreadPoolExecutor(max_workers=PREFETCH_BATCHES) as prefetching, \
+            BatchWriter(collection, checkpoint, stats) as writer:
+        encoder.load()
+
+        def prepare(batch):
+            # download the pictures of a batch concurrently, then preprocess them in a worker process
+            contents = list(downloads.map(lambda doc: download(fetcher, doc["images"]["picture_url"], stats), batch))
+            fetched = [i for i, data in enumerate(contents) if data is not None]
+            if not fetched:
+                return [], None
+            positions, pixel_values, seconds = preprocessing.submit(
+                preprocess_images, [contents[i] for i in fetched]).result()
+            stats.add("preprocess", len(fetched), seconds)
+            return [batch[fetched[i]]["_id"] for i in positions], pixel_values
+
+        start = time.perf_counter()
+        progress = writer.progress = tqdm(desc="Embedding pictures", unit="doc")
+        prepared = deque()
+        for batch_no, batch in itertools.islice(batches, PREFETCH_BATCHES):
+            prepared.append((batch_no, batch, prefetching.submit(prepare, batch)))
+        while prepared:
+            batch_no, batch, future = prepared.popleft()
+            ids, pixel_values = future.result()
+            for next_batch_no, next_batch in itertools.islice(batches, 1):
+                prepared.append((next_batch_no, next_batch, prefetching.submit(prepare, next_batch)))
+
+            embeddings = []
+            if ids:
+                inference_start = time.perf_counter()
+                embeddings = encoder.encode_pixel_values(pixel_values)
+                stats.add("inference", len(ids), time.perf_counter() - inference_start)
+            writer.submit(batch_no, batch, ids, embeddings)
+        writer.flush()
+        progress.close()
+        elapsed = time.perf_counter() - start
+
+    workers = {"download": download_workers, "preprocess": preprocess_workers, "inference": 1, "write": 1}
+    print(f"\nAll batches processed. Total documents updated: {checkpoint.count}")
+    print(stats.report(workers, elapsed))
+    checkpoint.clear()
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--download_workers', type=int, default=DOWNLOAD_WORKERS)
+    parser.add_argument('--preprocess_workers', type=int, default=PREPROCESS_WORKERS)
+    parser.add_argument('--num_threads', type=int, default=None, help='torch threads of the CLIP inference')
+    args = parser.parse_args()
+    if args.num_threads:
+        import torch
+        torch.set_num_threads(args.num_threads)  # process-wide, the preprocessing workers set their own
+    add_image_embeddings(args.limit, args.batch_size, args.download_workers, args.preprocess_workers)
@@ -0,0 +1,54 @@
+import json
+import os
+from typing import Any, Optional
+
+
+class Checkpoint():
+    """
+    Resumable progress of a batched job, stored as JSON.
+
+    Batches are numbered in the order they are read and may finish out of order, so the
+    checkpoint only advances `position` to the end of the longest run of finished batches.
+    Everything up to `position` is done; `count` is the number of items written so far.
+    """
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.position = None
+        self.count = 0
+        self._next_batch = 0
+        self._finished = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.position = state.get('position')
+            self.count = state.get('count', 0)
+
+    def finish(self, batch_no: int, position: Any, count: int) -> None:
+        """
+        Mark a batch as done.
+
+        Args:
+            batch_no (int): Sequence number of the batch, starting at 0 for this run
+            position: Position reached at the end of the batch, e.g. its last `_id` or row offset
+            count (int): Number of items the batch wrote
+        """
+        self.count += count
+        self._finished[batch_no] = position
+        while self._next_batch in self._finished:
+            self.position = self._finished.pop(self._next_batch)
+            self._next_batch += 1
+        self.save()
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'position': self.position, 'count': self.count}, f, default=str)
+        os.replace(tmp_path, self.path)
+
+    def clear(self) -> None:
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,39 +1,151 @@
-import os
+import itertools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Dict, Iterator, List, Optional
 from datasets import load_dataset
 from bson import json_util
-from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from database.checkpoint import Checkpoint
 from database.mongodb_utils import get_collection
 
 
-def ingest_data():
-    collection = get_collection()
+DATASET_NAME = "MongoDB/airbnb_embeddings"
+BATCH_SIZE = 1000
+NUM_WRITERS = 4
+CHECKPOINT_PATH = ".cache/ingestion_checkpoint.json"
+DUPLICATE_KEY_ERROR = 11000
+
+
+def to_bson_document(value: Any) -> Any:
+    """
+    Convert a dataset row to a MongoDB document without a JSON round trip.
+
+    Plain Python values are kept as they are; only Extended JSON wrappers such as
+    {"$date": ...} or {"$numberDecimal": ...} are decoded into their BSON types.
+    """
+    if isinstance(value, dict):
+        if len(value) == 1 and next(iter(value)).startswith('$'):
+            return json_util.object_hook(value)
+        return {k: to_bson_document(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [to_bson_document(v) for v in value]
+    return value
+
+
+def iter_dataset(source: str = DATASET_NAME, start: int = 0) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily read rows from the HuggingFace hub, a local parquet file or a local JSONL file.
+
+    Args:
+        source (str): Dataset name on the hub, or a path ending in .parquet, .jsonl or .json
+        start (int): Number of rows to skip, used to resume
 
-    #NOTE: https://huggingface.co/datasets/MongoDB/airbnb_embeddings
-    #NOTE: This dataset contains several records with datapoint representing an airbnb listing.
-    dataset = load_dataset("MongoDB/airbnb_embeddings")
+    Returns:
+        Iterator[Dict[str, Any]]: Rows of the train split
+    """
+    if source.endswith(('.jsonl', '.json')):
+        with open(source) as f:
+            for line in itertools.islice(f, start, None):
+                if line.strip():
+                    yield json.loads(line, object_hook=json_util.object_hook)
+        return
+
+    if source.endswith('.parquet'):
+        dataset = load_dataset("parquet", data_files=source, split="train", streaming=True)
+    else:
+        #NOTE: https://huggingface.co/datasets/MongoDB/airbnb_embeddings
+        #NOTE: This dataset contains several records with datapoint representing an airbnb listing.
+        dataset = load_dataset(source, split="train", streaming=True)
+    yield from dataset.skip(start) if start else dataset
+
+
+def insert_batch(collection, documents: List[Dict[str, Any]]) -> int:
+    """
+    Insert documents with an unordered insert_many, ignoring documents that already exist.
 
-    insert_data = []
+    Returns:
+        int: Number of documents inserted
+    """
+    try:
+        return len(collection.insert_many(documents, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        # a resumed run may re-insert the tail of the last unfinished batch
+        if any(error['code'] != DUPLICATE_KEY_ERROR for error in e.details['writeErrors']):
+            raise
+        return e.details['nInserted']
 
-    # Iterate through the dataset and prepare the documents for insertion
-    # The script below ingests 1000 records into the database at a time
-    for item in dataset['train']:
-        # Convert the dataset item to MongoDB document format
-        doc_item = json_util.loads(json_util.dumps(item))
-        if doc_item['description'] is not None:
-            insert_data.append(doc_item)
 
-        # Insert in batches of 1000 documents
-        if len(insert_data) == 1000:
-            collection.insert_many(insert_data)
-            print("1000 records ingested")
-            insert_data = []
+def ingest_data(source: str = DATASET_NAME, batch_size: int = BATCH_SIZE, num_writers: int = NUM_WRITERS,
+                checkpoint_path: Optional[str] = CHECKPOINT_PATH, collection=None) -> int:
+    """
+    Stream the dataset into the collection.
 
-    # Insert any remaining documents
-    if len(insert_data) > 0:
-        collection.insert_many(insert_data)
-        print("{} records ingested".format(len(insert_data)))
+    Rows are read lazily while up to `num_writers` batches are inserted concurrently with
+    unordered insert_many. The row offset of the last fully inserted batch is checkpointed
+    so an interrupted ingestion resumes from there.
 
-    print("All records ingested successfully!")
+    Args:
+        source (str): Dataset name on the hub, or a local .parquet/.jsonl file
+        batch_size (int): Number of documents per insert_many
+        num_writers (int): Number of concurrent insert_many calls
+        checkpoint_path (str, optional): Checkpoint file, None to disable resuming
+        collection (optional): Collection to insert into. Defaults to get_collection().
+
+    Returns:
+        int: Number of documents inserted by this run
+    """
+    collection = collection if collection is not None else get_collection()
+    checkpoint = Checkpoint(checkpoint_path)
+    offset = checkpoint.position or 0
+    if offset:
+        print(f"Resuming from row {offset} ({checkpoint.count} records already ingested)")
+
+    start = time.perf_counter()
+    inserted = 0
+
+    def finish(done):
+        nonlocal inserted
+        error = None
+        for future in done:
+            batch_no, end_offset = in_flight.pop(future)
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            count = future.result()
+            inserted += count
+            checkpoint.finish(batch_no, end_offset, count)
+        # checkpoint the batches that succeeded alongside a failed one before giving up
+        if error is not None:
+            raise error
+        elapsed = time.perf_counter() - start
+        print(f"{inserted} records ingested ({inserted / elapsed:.0f} docs/s)")
+
+    with ThreadPoolExecutor(max_workers=num_writers) as pool:
+        in_flight = {}
+        insert_data = []
+        batch_no = 0
+        for offset, item in enumerate(iter_dataset(source, offset), start=offset):
+            if item.get('description') is not None:
+                insert_data.append(to_bson_document(item))
+            if len(insert_data) == batch_size:
+                # overlap reading with writing, but keep a bounded number of batches in memory
+                if len(in_flight) >= num_writers * 2:
+                    finish(wait(in_flight, return_when=FIRST_COMPLETED).done)
+                in_flight[pool.submit(insert_batch, collection, insert_data)] = (batch_no, offset + 1)
+                insert_data = []
+                batch_no += 1
+        # Insert any remaining documents
+        if insert_data:
+            in_flight[pool.submit(insert_batch, collection, insert_data)] = (batch_no, offset + 1)
+        if in_flight:
+            finish(wait(in_flight).done)
+
+    elapsed = time.perf_counter() - start
+    print(f"All records ingested successfully! {inserted} records in {elapsed:.1f}s "
+          f"({inserted / elapsed if elapsed else 0:.0f} docs/s)")
+    checkpoint.clear()
+    return inserted
 
 
 def delete_empty_descriptions():
@@ -43,14 +155,7 @@ def delete_empty_descriptions():
     Args:
         collection: MongoDB collection object
     """
-    uri = os.getenv('MONGODB_URI')
-    client = MongoClient(uri)
-
-    # Change to the appropriate database and collection names
-    db_name = 'airbnb_dataset'  # Change this to your actual database name
-    collection_name = 'airbnb_embeddings'  # Change this to your actual collection name
-
-    collection = client[db_name][collection_name]
+    collection = get_collection()
 
     # Delete documents where description is None, empty string, or just whitespace
     result = collection.delete_many({
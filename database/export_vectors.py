@@ -0,0 +1,52 @@
+import argparse
+import os
+import numpy as np
+from app.search.vector_store import export_vectors, IVFIndex, QuantizedIndex
+from app.utils.embedding_dimensions import text_embedding_field
+from database.mongodb_utils import get_collection
+
+EMBED_PATHS = [text_embedding_field(), "image_embeddings"]
+
+
+def export_all(directory: str, paths=EMBED_PATHS, index_type: str = "exact", nlist: int = None, pq_m: int = None):
+    """
+    Export the embedding fields of the collection to local memory-mapped indexes.
+
+    Each field is written to `<directory>/<field>/`, which is the layout expected by
+    LocalVectorBackend.load (set LOCAL_VECTOR_DIR to `directory` to serve the app from it).
+
+    Args:
+        directory (str): Output directory
+        paths (list, optional): Embedding fields to export
+        index_type (str, optional): "exact" for brute force, "ivf" for an approximate IVF/IVF-PQ index,
+            "int8" or "binary" for a scan of quantized codes rescored with the float vectors
+        nlist (int, optional): Number of IVF lists, defaults to about sqrt(n)
+        pq_m (int, optional): Number of PQ sub-quantizers, None for IVF-Flat
+    """
+    collection = get_collection()
+    for path in paths:
+        index = export_vectors(collection, path, os.path.join(directory, path))
+        print(f"Exported {len(index)} vectors of {path} ({index.dimensions}-d)")
+        if index_type == "ivf":
+            # copy out of the memory map before the files are rewritten
+            ids, vectors = np.array(index.ids), np.array(index.vectors)
+            del index
+            ivf = IVFIndex.train(ids, vectors, nlist=nlist, pq_m=pq_m)
+            ivf.save(os.path.join(directory, path))
+            print(f"Built IVF index of {path} with {ivf.nlist} lists, {ivf.bytes_per_vector():.0f} bytes/vector")
+        elif index_type in ("int8", "binary"):
+            # the ids file is rewritten, copy it out of the memory map; the vectors file is kept as is
+            quantized = QuantizedIndex.quantize(np.array(index.ids), index.vectors, index_type)
+            quantized.save(os.path.join(directory, path))
+            print(f"Quantized {path} to {index_type}, {quantized.bytes_per_vector():.0f} bytes/vector")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', default='data/vectors')
+    parser.add_argument('--paths', nargs='+', default=EMBED_PATHS)
+    parser.add_argument('--index', choices=['exact', 'ivf', 'int8', 'binary'], default='exact')
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--pq_m', type=int, default=None)
+    args = parser.parse_args()
+    export_all(args.out, args.paths, args.index, args.nlist, args.pq_m)
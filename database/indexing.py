@@ -1,6 +1,7 @@
 from pymongo.operations import SearchIndexModel
 import time
-from mongodb_utils import get_collection
+from app.utils.embedding_dimensions import TEXT_EMBED_SIZE, text_embedding_field, text_vector_index
+from database.mongodb_utils import get_collection
 
 
 def if_index_exist(collection, index_name):
@@ -13,15 +14,16 @@ def if_index_exist(collection, index_name):
     return index_exists
 
 
-def create_text_vector_index_model():
+def create_text_vector_index_model(dimensions: int = TEXT_EMBED_SIZE):
+    index_name = text_vector_index(dimensions)
     vector_search_index_model = SearchIndexModel(
         definition={
             "type": "vectorSearch",
             "mappings": {
                 "dynamic": True,
                 "fields": {
-                    "description_embedding": {
-                        "dimensions": 1536,
+                    text_embedding_field(dimensions): {
+                        "dimensions": dimensions,
                         "similarity": "cosine",
                         "type": "knnVector",
                     },
@@ -32,9 +34,9 @@ def create_text_vector_index_model():
                 "scoreField": "text_search_score"  # This ensures the score is returned
             }
         },
-        name="vector_index_text",
+        name=index_name,
     )
-    return vector_search_index_model, "vector_index_text"
+    return vector_search_index_model, index_name
 
 
 
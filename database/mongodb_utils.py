@@ -1,17 +1,28 @@
 import os
-from pymongo import MongoClient
+import threading
 import openai
+from app.utils.embedding_cache import EmbeddingCache
+from app.utils.embedding_dimensions import TEXT_EMBED_FULL_SIZE
+from app.utils.mongodb import get_client, get_collection, registry
 
 TEXT_EMBED_MODEL = "text-embedding-3-small"
-TEXT_EMBED_SIZE = 1536
+TEXT_EMBED_SIZE = TEXT_EMBED_FULL_SIZE  # stored in full, reduced sizes are derived by database/truncate_embeddings.py
+EMBED_CACHE_PATH = os.getenv('EMBED_CACHE_PATH', '.cache/text_embeddings.sqlite') # empty to keep the cache in memory only
 
-def get_collection():
-    uri = os.getenv('MONGODB_URI')
-    client = MongoClient(uri)
-    db_name = 'airbnb_dataset'  # Change this to your actual database name
-    collection_name = 'airbnb_embeddings'  # Change this to your actual collection name
-    return client[db_name][collection_name]
+_text_embedding_cache = None
+_text_embedding_cache_lock = threading.Lock()
 
+def embed_texts(texts):
+    response = openai.embeddings.create(input=texts, model=TEXT_EMBED_MODEL, dimensions=TEXT_EMBED_SIZE)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+def get_text_embedding_cache():
+    global _text_embedding_cache
+    with _text_embedding_cache_lock:
+        if _text_embedding_cache is None:
+            _text_embedding_cache = EmbeddingCache(embed_texts, TEXT_EMBED_MODEL, TEXT_EMBED_SIZE, path=EMBED_CACHE_PATH or None)
+        return _text_embedding_cache
 
 
 def get_text_embedding(text):
@@ -19,10 +30,7 @@ def get_text_embedding(text):
             print("text is not a string")
             return None
         try:
-            embedding = openai.embeddings.create(
-                input=text,
-                model=TEXT_EMBED_MODEL, dimensions=TEXT_EMBED_SIZE).data[0].embedding
-            return embedding
+            return get_text_embedding_cache().get(text)
         except Exception as e:
             print(f"Error in get_text_embedding: {e}")
             return None
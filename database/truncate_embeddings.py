@@ -0,0 +1,115 @@
+import argparse
+import itertools
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+from tqdm import tqdm
+from app.utils.embedding_dimensions import (TEXT_EMBED_FULL_SIZE, TEXT_EMBED_SIZE, text_embedding_field,
+                                            truncate_embeddings)
+from database.checkpoint import Checkpoint
+from database.mongodb_utils import get_collection
+
+BATCH_SIZE = 1000
+CHECKPOINT_PATH = ".cache/truncate_embeddings_{size}_checkpoint.json"
+
+
+def get_documents_to_truncate(size: int, limit: int = None, after_id: Any = None) -> Iterable[Dict[str, Any]]:
+    """
+    Stream documents with full description embeddings but no embeddings of `size`, in `_id` order.
+
+    Args:
+        size (int): Reduced number of dimensions
+        limit (int, optional): Maximum number of documents to return. Defaults to None.
+        after_id (optional): Only return documents with a larger `_id`, used to resume. Defaults to None.
+
+    Returns:
+        Iterable[Dict[str, Any]]: Cursor over `_id` and the full description embedding of the documents
+    """
+    collection = get_collection()
+    full_field = text_embedding_field(TEXT_EMBED_FULL_SIZE)
+    query = {
+        full_field: {"$exists": True},
+        text_embedding_field(size): {"$exists": False}
+    }
+    if after_id is not None:
+        query["_id"] = {"$gt": after_id}
+
+    cursor = collection.find(query, {full_field: 1}).sort("_id", 1).batch_size(BATCH_SIZE)
+    if limit:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+def update_documents_with_truncated_embeddings(documents: List[Dict[str, Any]], size: int, collection=None) -> int:
+    """
+    Write the first `size` dimensions of the full description embeddings, renormalized, with
+    one unordered bulk write.
+
+    Args:
+        documents (List[Dict[str, Any]]): List of `_id` and full description embeddings
+        size (int): Reduced number of dimensions
+        collection (optional): Collection to write to. Defaults to get_collection().
+
+    Returns:
+        int: Number of documents updated
+    """
+    if not documents:
+        return 0
+
+    collection = collection if collection is not None else get_collection()
+    full_field, field = text_embedding_field(TEXT_EMBED_FULL_SIZE), text_embedding_field(size)
+    embeddings = truncate_embeddings([doc[full_field] for doc in documents], size)
+    result = collection.bulk_write([
+        UpdateOne({"_id": doc["_id"]}, {"$set": {field: embedding.tolist()}})
+        for doc, embedding in zip(documents, embeddings)
+    ], ordered=False)
+    return result.modified_count
+
+
+def add_truncated_embeddings(size: int = TEXT_EMBED_SIZE, limit: int = None, batch_size: int = BATCH_SIZE,
+                             checkpoint_path: Optional[str] = CHECKPOINT_PATH):
+    """
+    Main function to derive reduced-dimension description embeddings from the full ones.
+
+    text-embedding-3 embeddings are Matryoshka embeddings: their first dimensions carry most of
+    the information, and the embedding of a smaller `dimensions` is the prefix of the full one,
+    renormalized. The reduced vectors are therefore computed locally, without calling the
+    embeddings API again, and stored next to the full ones in `description_embedding_<size>`.
+    Progress is checkpointed so an interrupted run resumes where it stopped.
+
+    Args:
+        size (int, optional): Reduced number of dimensions. Defaults to TEXT_EMBED_SIZE.
+        limit (int, optional): Maximum number of documents to process. Defaults to None.
+        batch_size (int, optional): Documents per bulk write.
+        checkpoint_path (str, optional): Checkpoint file, None to disable resuming.
+    """
+    if not 0 < size < TEXT_EMBED_FULL_SIZE:
+        raise ValueError(f"size must be between 1 and {TEXT_EMBED_FULL_SIZE - 1}, got {size}")
+    collection = get_collection()
+    checkpoint = Checkpoint(checkpoint_path.format(size=size) if checkpoint_path else None)
+    if checkpoint.position is not None:
+        print(f"Resuming after _id {checkpoint.position} ({checkpoint.count} documents already updated)")
+
+    documents = iter(get_documents_to_truncate(size, limit, after_id=checkpoint.position))
+    progress = tqdm(desc=f"Truncating embeddings to {size}", unit="doc")
+    batch_no = 0
+    while batch := list(itertools.islice(documents, batch_size)):
+        count = update_documents_with_truncated_embeddings(batch, size, collection)
+        checkpoint.finish(batch_no, batch[-1]["_id"], count)
+        progress.update(len(batch))
+        batch_no += 1
+    progress.close()
+
+    print(f"\nAll batches processed. Total documents updated: {checkpoint.count}")
+    print(f"Create the index with: TEXT_EMBED_SIZE={size} python -m database.indexing")
+    checkpoint.clear()
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=TEXT_EMBED_SIZE, help='reduced number of dimensions, e.g. 512')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    add_truncated_embeddings(args.size, args.limit, args.batch_size)
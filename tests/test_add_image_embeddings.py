@@ -0,0 +1,58 @@
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.add_image_embeddings import BatchWriter, StageStats
+from database.checkpoint import Checkpoint
+
+
+class FailingCollection():
+    """Fake collection whose bulk_write fails for the batch containing `failing_id`."""
+    def __init__(self, failing_id, release):
+        self.failing_id = failing_id
+        self.release = release
+        self.written = []
+
+    def bulk_write(self, requests, ordered=True):
+        # hold the first write until every batch is queued, so all of them finish in the same wait
+        self.release.wait(5)
+        ids = [request._filter["_id"] for request in requests]
+        if self.failing_id in ids:
+            raise ConnectionError("simulated write failure")
+        self.written.extend(ids)
+        return SimpleNamespace(modified_count=len(ids))
+
+
+def write_batches(tmp_path, failing_id, batches):
+    release = threading.Event()
+    collection = FailingCollection(failing_id, release)
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+    with BatchWriter(collection, checkpoint, StageStats(), max_pending=len(batches) + 1) as writer:
+        for batch_no, ids in enumerate(batches):
+            writer.submit(batch_no, [{"_id": _id} for _id in ids], ids, [[0.0]] * len(ids))
+        release.set()
+        with pytest.raises(ConnectionError):
+            writer.flush()
+        assert not writer.pending
+    return collection, Checkpoint(str(tmp_path / "checkpoint.json"))
+
+
+def test_failed_write_checkpoints_finished_siblings(tmp_path):
+    collection, checkpoint = write_batches(tmp_path, failing_id=3, batches=[[0, 1], [2, 3], [4, 5]])
+
+    assert collection.written == [0, 1, 4, 5]
+    assert checkpoint.count == 4
+    # the failed batch 1 stops the position after batch 0, batch 2 is counted but not skipped on resume
+    assert checkpoint.position == 1
+
+
+def test_failed_first_write_keeps_resume_position(tmp_path):
+    collection, checkpoint = write_batches(tmp_path, failing_id=0, batches=[[0, 1], [2, 3]])
+
+    assert collection.written == [2, 3]
+    assert checkpoint.count == 2
+    assert checkpoint.position is None